@@ -0,0 +1,262 @@
+"""Benchmark the API hot paths in-process.
+
+Seeds a database with configurable volumes (through seed_data.py), drives the FastAPI app through
+httpx's ASGI transport (no network, no uvicorn) and writes per-endpoint
+throughput and latency percentiles to a JSON file so runs can be compared
+across commits.
+
+    # mongomock stand-in (pip install mongomock-motor)
+    python benchmark.py --clients 500 --work-orders 5000
+
+    # against a local mongod; the database is dropped first
+    python benchmark.py --mongo-url mongodb://localhost:27017 --db-name bench_work_management
+
+    # compare with an earlier run, exit 1 if any p95 regressed by more than 20%
+    python benchmark.py --compare bench_results/previous.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+# Every scenario hammers one route as one caller
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import httpx  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+import seed_data  # noqa: E402
+import server  # noqa: E402
+
+BENCH_USERNAME = "bench"
+BENCH_PASSWORD = "bench-password"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def open_database(mongo_url, db_name):
+    if mongo_url:
+        return AsyncIOMotorClient(mongo_url)[db_name], "mongod"
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("mongomock-motor is not installed; install it or pass --mongo-url")
+    return AsyncMongoMockClient()[db_name], "mongomock"
+
+
+async def seed(db, args) -> dict:
+    """Insert the benchmark dataset and return ids the scenarios need."""
+    config = seed_data.SeedConfig(
+        clients=args.clients,
+        work_orders=args.work_orders,
+        invoice_ratio=args.invoice_ratio,
+        inventory=args.inventory,
+        history_mean=args.history_mean,
+        resources=args.resources,
+        seed=args.seed,
+    )
+    summary = await seed_data.seed_database(db, config)
+
+    await db.users.insert_one(server.UserInDB(
+        username=BENCH_USERNAME,
+        email="bench@example.com",
+        full_name="Benchmark User",
+        role=server.UserRole.admin,
+        hashed_password=server.get_password_hash(BENCH_PASSWORD),
+    ).model_dump())
+
+    return {
+        "client_ids": summary.sample_ids["clients"],
+        "work_order_ids": summary.sample_ids["work_orders"],
+        "invoice_ids": summary.sample_ids["invoices"],
+        "counts": dict(summary.counts),
+    }
+
+
+def scenarios(ids: dict, rng: random.Random) -> dict:
+    """name -> callable(http_client) returning an awaitable response."""
+    def pick(key):
+        return rng.choice(ids[key])
+
+    return {
+        "health": lambda http: http.get("/api/health"),
+        "login": lambda http: http.post(
+            "/api/auth/token", data={"username": BENCH_USERNAME, "password": BENCH_PASSWORD}
+        ),
+        "dashboard": lambda http: http.get("/api/dashboard"),
+        "list_clients": lambda http: http.get("/api/clients"),
+        "get_client": lambda http: http.get(f"/api/clients/{pick('client_ids')}"),
+        "list_work_orders": lambda http: http.get("/api/work-orders"),
+        "list_work_orders_pending": lambda http: http.get("/api/work-orders", params={"status": "pending"}),
+        "list_work_orders_expand_client": lambda http: http.get(
+            "/api/work-orders", params={"status": "pending", "expand": "client"}
+        ),
+        "get_work_order": lambda http: http.get(f"/api/work-orders/{pick('work_order_ids')}"),
+        "create_work_order": lambda http: http.post("/api/work-orders", json={
+            "title": "Orden de benchmark",
+            "description": "Creada por benchmark.py",
+            "client_id": pick("client_ids"),
+        }),
+        "list_invoices": lambda http: http.get("/api/invoices"),
+        "get_invoice": lambda http: http.get(f"/api/invoices/{pick('invoice_ids')}"),
+        "create_invoice": lambda http: http.post("/api/invoices", json={
+            "client_id": pick("client_ids"),
+            "items": [{"description": "Servicio", "quantity": 2, "unit_price": 1500}],
+        }),
+        "list_resources": lambda http: http.get("/api/resources"),
+        "list_inventory": lambda http: http.get("/api/inventory"),
+        "list_inventory_low_stock": lambda http: http.get("/api/inventory", params={"low_stock": "true"}),
+        "low_stock_summary": lambda http: http.get("/api/inventory/low-stock/summary"),
+        "search_prefix": lambda http: http.get("/api/search", params={"q": "cliente", "limit": 20}),
+    }
+
+
+async def measure(http, call, requests, concurrency, warmup) -> dict:
+    for _ in range(warmup):
+        await call(http)
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await call(http)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2),
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(latencies_ms.max()), 3),
+    }
+
+
+def compare(results: dict, baseline_path: str, max_regression: float) -> bool:
+    baseline = json.loads(Path(baseline_path).read_text())["results"]
+    ok = True
+    print(f"\n{'endpoint':34} {'p95 before':>11} {'p95 now':>9} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, now = baseline[name]["p95_ms"], result["p95_ms"]
+        change = (now - before) / before if before else 0.0
+        regressed = change > max_regression
+        ok = ok and not regressed
+        print(f"{name:34} {before:11.2f} {now:9.2f} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+async def run(args) -> int:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    bench_db, backend = open_database(args.mongo_url, args.db_name)
+    if backend == "mongod":
+        await bench_db.client.drop_database(args.db_name)
+
+    server.db = bench_db
+    server.client_ref_cache.invalidate()
+    if backend == "mongod":
+        await server.create_indexes()
+
+    seed_started = time.perf_counter()
+    ids = await seed(bench_db, args)
+    print(f"Seeded {backend} with {ids['counts']} in {time.perf_counter() - seed_started:.1f}s")
+
+    selected = scenarios(ids, rng)
+    if args.only:
+        selected = {name: call for name, call in selected.items() if name in args.only}
+
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for name, call in selected.items():
+            # bcrypt dominates login, so it gets fewer iterations
+            requests = max(args.requests // 10, 1) if name == "login" else args.requests
+            results[name] = await measure(http, call, requests, args.concurrency, args.warmup)
+            result = results[name]
+            print(
+                f"{name:34} {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f} ms"
+                f"  p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  errors {result['errors']}"
+            )
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "backend": backend,
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "volumes": ids["counts"],
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    output = Path(args.output) if args.output else (
+        Path("bench_results") / f"{datetime.utcnow():%Y%m%dT%H%M%S}-{report['meta']['commit']}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        return 1
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", help="Benchmark against this MongoDB instead of mongomock")
+    parser.add_argument("--db-name", default="bench_work_management")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--work-orders", type=int, default=2000)
+    parser.add_argument("--invoice-ratio", type=float, default=0.8, help="Share of completed work orders invoiced")
+    parser.add_argument("--inventory", type=int, default=500)
+    parser.add_argument("--history-mean", type=int, default=20, help="Mean stock movements per inventory item")
+    parser.add_argument("--resources", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="+", help="Run only these endpoints")
+    parser.add_argument("--output", help="Results file (default: bench_results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare p95 latencies with")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
@@ -0,0 +1,46 @@
+"""Address geocoding through a Nominatim-compatible search service."""
+import logging
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+GEOCODER_URL = os.environ.get("GEOCODER_URL")  # e.g. https://nominatim.openstreetmap.org/search
+GEOCODER_COUNTRY = os.environ.get("GEOCODER_COUNTRY", "uy")
+GEOCODER_TIMEOUT = float(os.environ.get("GEOCODER_TIMEOUT", 5))
+GEOCODER_USER_AGENT = os.environ.get("GEOCODER_USER_AGENT", "work-management-geocoder")
+
+
+def is_enabled() -> bool:
+    return bool(GEOCODER_URL)
+
+
+@lru_cache(maxsize=4096)
+def _search(address: str) -> Optional[Tuple[float, float]]:
+    # Errors propagate so that failed lookups are not cached
+    response = requests.get(
+        GEOCODER_URL,
+        params={"q": address, "format": "json", "limit": 1, "countrycodes": GEOCODER_COUNTRY},
+        headers={"User-Agent": GEOCODER_USER_AGENT},
+        timeout=GEOCODER_TIMEOUT,
+    )
+    response.raise_for_status()
+    results = response.json()
+    if not results:
+        return None
+    return float(results[0]["lon"]), float(results[0]["lat"])
+
+
+def geocode_address(address: str) -> Optional[Tuple[float, float]]:
+    """Return (longitude, latitude) for a free-text address, or None if unknown."""
+    if not GEOCODER_URL or not address:
+        return None
+
+    try:
+        return _search(address.strip())
+    except (requests.RequestException, ValueError, KeyError) as exc:
+        logger.warning("Geocoding failed for %r: %s", address, exc)
+        return None
@@ -0,0 +1,343 @@
+"""Replay realistic user sessions against a running deployment.
+
+Virtual users follow the call patterns of frontend/src/App.js: after logging
+in, every page load fetches /auth/me, the dashboard and the full client,
+work order, invoice, resource and inventory lists in sequence, and every
+create is followed by a dashboard refresh. Three personas mix these with
+their own work:
+
+- technician: opens work orders and moves them through in_progress/completed
+- dispatcher: polls the dashboard and work orders, creates work orders
+- accountant: browses invoices and clients, invoices completed work
+
+Users start linearly over --ramp-up seconds. With several --steps the test
+runs one stage per user count and reports where throughput stops growing
+(the saturation point) together with tail latency, which is how the
+uvicorn + nginx deployment from entrypoint.sh should be measured. Start the
+backend with RATE_LIMIT_ENABLED=false, or the per-user rate limits answer
+429 long before the server saturates.
+
+    python load_test.py --base-url http://localhost:8080 --steps 10 20 40 80 \\
+        --mix technician=6 dispatcher=3 accountant=1 --duration 60 --ramp-up 15
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+# Throughput must grow by at least this much between stages to count as unsaturated
+SATURATION_GAIN = 0.05
+
+
+@dataclass
+class Sample:
+    finished: float
+    name: str
+    latency: float
+    ok: bool
+
+
+@dataclass
+class Stage:
+    users: int
+    samples: List[Sample] = field(default_factory=list)
+    measure_from: float = 0.0
+    measure_until: float = 0.0
+
+
+class Session:
+    """One virtual user's authenticated HTTP session."""
+
+    def __init__(self, http: httpx.AsyncClient, stage: Stage, rng: random.Random, think_time: float):
+        self.http = http
+        self.stage = stage
+        self.rng = rng
+        self.think_time = think_time
+        self.token: Optional[str] = None
+        self.clients: List[dict] = []
+        self.work_orders: List[dict] = []
+
+    async def call(self, name: str, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        headers = kwargs.pop("headers", {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, path, headers=headers, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        finished = time.perf_counter()
+        self.stage.samples.append(Sample(finished, name, finished - started, ok))
+        return response
+
+    async def think(self):
+        await asyncio.sleep(self.rng.expovariate(1 / self.think_time) if self.think_time else 0)
+
+    async def login(self, username: str, password: str):
+        response = await self.call("login", "POST", "/api/auth/token", data={"username": username, "password": password})
+        if response is not None and response.status_code == 200:
+            self.token = response.json()["access_token"]
+
+    async def load_app(self):
+        # Same sequence as the fetchData effect in App.js
+        await self.call("auth_me", "GET", "/api/auth/me")
+        await self.call("dashboard", "GET", "/api/dashboard")
+        response = await self.call("list_clients", "GET", "/api/clients")
+        if response is not None and response.status_code == 200:
+            self.clients = response.json()
+        response = await self.call("list_work_orders", "GET", "/api/work-orders")
+        if response is not None and response.status_code == 200:
+            self.work_orders = response.json()
+        await self.call("list_invoices", "GET", "/api/invoices")
+        await self.call("list_resources", "GET", "/api/resources")
+        await self.call("list_inventory", "GET", "/api/inventory")
+
+    def pick_work_order(self, *statuses) -> Optional[dict]:
+        candidates = [wo for wo in self.work_orders if wo.get("status") in statuses]
+        return self.rng.choice(candidates) if candidates else None
+
+    async def create_work_order(self):
+        if not self.clients:
+            return
+        await self.call("create_work_order", "POST", "/api/work-orders", json={
+            "title": "Orden de prueba de carga",
+            "description": "Creada por load_test.py",
+            "client_id": self.rng.choice(self.clients)["id"],
+            "priority": self.rng.randint(1, 5),
+            "estimated_hours": self.rng.choice([1, 2, 4]),
+        })
+        await self.call("dashboard", "GET", "/api/dashboard")
+
+
+async def technician(session: Session, stop_at: float):
+    await session.load_app()
+    while time.perf_counter() < stop_at:
+        await session.think()
+        work_order = session.pick_work_order("pending", "in_progress")
+        if work_order is None:
+            await session.load_app()
+            continue
+        await session.call("get_work_order", "GET", f"/api/work-orders/{work_order['id']}")
+        await session.think()
+        next_status = "in_progress" if work_order["status"] == "pending" else "completed"
+        await session.call("update_work_order", "PUT", f"/api/work-orders/{work_order['id']}", json={"status": next_status})
+        work_order["status"] = next_status
+        if session.rng.random() < 0.2:
+            await session.load_app()
+
+
+async def dispatcher(session: Session, stop_at: float):
+    await session.load_app()
+    while time.perf_counter() < stop_at:
+        await session.think()
+        await session.call("dashboard", "GET", "/api/dashboard")
+        await session.call("list_work_orders_pending", "GET", "/api/work-orders", params={"status": "pending"})
+        await session.call("list_resources", "GET", "/api/resources", params={"status": "available"})
+        if session.rng.random() < 0.3:
+            await session.create_work_order()
+        if session.rng.random() < 0.1:
+            await session.load_app()
+
+
+async def accountant(session: Session, stop_at: float):
+    await session.load_app()
+    while time.perf_counter() < stop_at:
+        await session.think()
+        await session.call("list_invoices", "GET", "/api/invoices")
+        await session.call("list_clients", "GET", "/api/clients")
+        completed = [wo for wo in session.work_orders if wo.get("status") == "completed" and not wo.get("invoiced")]
+        if completed and session.rng.random() < 0.5:
+            work_order = session.rng.choice(completed)
+            response = await session.call("create_invoice", "POST", "/api/invoices", json={
+                "client_id": work_order["client_id"],
+                "work_order_ids": [work_order["id"]],
+                "items": [{"description": work_order["title"], "quantity": work_order.get("estimated_hours") or 1,
+                           "unit_price": 1500}],
+            })
+            work_order["invoiced"] = True
+            if response is not None and response.status_code == 200:
+                await session.call("dashboard", "GET", "/api/dashboard")
+        if session.rng.random() < 0.1:
+            await session.load_app()
+
+
+PERSONAS = {"technician": technician, "dispatcher": dispatcher, "accountant": accountant}
+
+
+def assign_personas(users: int, mix: Dict[str, int]) -> List[str]:
+    """Spread personas over users in proportion to the mix weights."""
+    total = sum(mix.values())
+    names = []
+    for index in range(users):
+        position = (index + 0.5) * total / users
+        for name, weight in mix.items():
+            if position < weight:
+                names.append(name)
+                break
+            position -= weight
+    return names
+
+
+async def run_stage(args, users: int, credentials: List[tuple]) -> Stage:
+    stage = Stage(users=users)
+    limits = httpx.Limits(max_connections=users * 2, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as http:
+        started = time.perf_counter()
+        stop_at = started + args.ramp_up + args.duration
+        stage.measure_from = started + args.ramp_up
+        stage.measure_until = stop_at
+
+        async def user(index: int, persona: str):
+            await asyncio.sleep(args.ramp_up * index / users)
+            session = Session(http, stage, random.Random(args.seed * 100003 + index), args.think_time)
+            username, password = credentials[index % len(credentials)]
+            await session.login(username, password)
+            await PERSONAS[persona](session, stop_at)
+
+        await asyncio.gather(*[user(i, persona) for i, persona in enumerate(assign_personas(users, args.mix))])
+    return stage
+
+
+def summarize(stage: Stage) -> dict:
+    window = stage.measure_until - stage.measure_from
+    samples = [s for s in stage.samples if stage.measure_from <= s.finished <= stage.measure_until]
+
+    def stats(selected: List[Sample]) -> dict:
+        if not selected:
+            return {"requests": 0}
+        latencies = np.array([s.latency for s in selected]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            "requests": len(selected),
+            "errors": sum(not s.ok for s in selected),
+            "throughput_rps": round(len(selected) / window, 2),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(latencies.max()), 2),
+        }
+
+    by_name: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        by_name.setdefault(sample.name, []).append(sample)
+    return {
+        "users": stage.users,
+        "overall": stats(samples),
+        "endpoints": {name: stats(selected) for name, selected in sorted(by_name.items())},
+    }
+
+
+def find_saturation(stages: List[dict]) -> Optional[dict]:
+    """First stage whose throughput grew less than SATURATION_GAIN over the previous one."""
+    for previous, current in zip(stages, stages[1:]):
+        before = previous["overall"].get("throughput_rps", 0)
+        now = current["overall"].get("throughput_rps", 0)
+        if before and (now - before) / before < SATURATION_GAIN:
+            return {
+                "users": previous["users"],
+                "throughput_rps": before,
+                "p99_ms": previous["overall"].get("p99_ms"),
+            }
+    return None
+
+
+async def prepare_credentials(args) -> List[tuple]:
+    if not args.register:
+        return [(args.username, args.password)]
+    credentials = []
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as http:
+        for index in range(max(args.steps)):
+            username = f"load-{uuid.uuid4().hex[:10]}"
+            password = uuid.uuid4().hex
+            response = await http.post("/api/auth/register", json={
+                "username": username,
+                "email": f"{username}@example.com",
+                "full_name": f"Load Test {index}",
+                "password": password,
+            })
+            response.raise_for_status()
+            credentials.append((username, password))
+    return credentials
+
+
+async def main(args) -> int:
+    credentials = await prepare_credentials(args)
+    stages = []
+    for users in args.steps:
+        print(f"Stage: {users} users ({args.ramp_up}s ramp-up, {args.duration}s measured)", flush=True)
+        summary = summarize(await run_stage(args, users, credentials))
+        overall = summary["overall"]
+        print(
+            f"  {overall.get('throughput_rps', 0):8.1f} req/s  p50 {overall.get('p50_ms', 0):8.1f} ms"
+            f"  p95 {overall.get('p95_ms', 0):8.1f} ms  p99 {overall.get('p99_ms', 0):8.1f} ms"
+            f"  errors {overall.get('errors', 0)}/{overall.get('requests', 0)}",
+            flush=True,
+        )
+        stages.append(summary)
+
+    saturation = find_saturation(stages)
+    if saturation:
+        print(
+            f"\nSaturation at ~{saturation['users']} users: {saturation['throughput_rps']} req/s, "
+            f"p99 {saturation['p99_ms']} ms"
+        )
+    else:
+        print("\nThroughput was still growing at the last stage; add larger --steps to find saturation")
+
+    report = {
+        "base_url": args.base_url,
+        "mix": args.mix,
+        "think_time": args.think_time,
+        "ramp_up": args.ramp_up,
+        "duration": args.duration,
+        "stages": stages,
+        "saturation": saturation,
+    }
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.output}")
+    return 0
+
+
+def parse_mix(values: List[str]) -> Dict[str, int]:
+    mix = {}
+    for value in values:
+        name, _, weight = value.partition("=")
+        if name not in PERSONAS:
+            raise argparse.ArgumentTypeError(f"Unknown persona {name!r}; choose from {', '.join(PERSONAS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8080", help="nginx front end (see nginx.conf)")
+    parser.add_argument("--steps", type=int, nargs="+", default=[10], help="Concurrent users per stage")
+    parser.add_argument("--mix", nargs="+", default=["technician=6", "dispatcher=3", "accountant=1"])
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="Seconds to start all users of a stage")
+    parser.add_argument("--duration", type=float, default=60.0, help="Measured seconds per stage after ramp-up")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean pause between user actions")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--register", action="store_true", help="Register one account per virtual user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args(argv)
+    args.mix = parse_mix(args.mix)
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
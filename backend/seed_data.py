@@ -0,0 +1,493 @@
+"""Generate realistic, production-scale synthetic data.
+
+Writes clients with valid Uruguayan RUTs, a client -> work order -> invoice
+graph where work orders per client follow a Zipf distribution, resources,
+and inventory items with long stock movement histories. Documents match the
+Pydantic models in server.py (a sample of each collection is validated
+against them) and include the derived fields the API maintains, such as
+search_terms, the low-stock flags and each resource's open assignments.
+
+Generation is deterministic for a given --seed and --anchor, and documents
+are written with concurrent insert_many batches.
+
+    python seed_data.py --mongo-url mongodb://localhost:27017 --db-name capacity \\
+        --clients 100000 --work-orders 2000000 --inventory 20000 --drop
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+import server  # noqa: E402
+
+RUT_WEIGHTS = (4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+
+FIRST_NAMES = ["José", "María", "Martín", "Lucía", "Sebastián", "Sofía", "Joaquín", "Valentina",
+               "Matías", "Camila", "Nicolás", "Florencia", "Agustín", "Inés", "Andrés", "Belén"]
+LAST_NAMES = ["Rodríguez", "González", "Fernández", "Pérez", "Martínez", "García", "López",
+              "Sánchez", "Núñez", "Méndez", "Silva", "Píriz", "Olivera", "Suárez", "Acosta"]
+BUSINESS_WORDS = ["Construcciones", "Servicios", "Eléctrica", "Refrigeración", "Logística",
+                  "Agropecuaria", "Inmobiliaria", "Sanitaria", "Metalúrgica", "Distribuidora"]
+BUSINESS_SUFFIXES = ["S.A.", "S.R.L.", "S.A.S.", "Ltda."]
+STREETS = ["18 de Julio", "Bulevar Artigas", "Rambla República de México", "Av. Italia",
+           "Colonia", "Rivera", "Agraciada", "8 de Octubre", "Millán", "Camino Maldonado"]
+WORK_TITLES = ["Instalación eléctrica", "Mantenimiento preventivo", "Reparación de bomba",
+               "Cambio de cañería", "Revisión de aire acondicionado", "Pintura exterior",
+               "Instalación de cámaras", "Reparación de portón", "Impermeabilización"]
+SPECIALTIES = ["electricidad", "sanitaria", "refrigeración", "albañilería", "soldadura", "pintura"]
+# Work orders still holding their assigned personnel
+OPEN_STATUSES = {"pending", "in_progress"}
+INVENTORY_NAMES = ["Cable", "Caño PVC", "Tornillo", "Llave térmica", "Cinta aisladora",
+                   "Pintura látex", "Membrana", "Taladro", "Disco de corte", "Gas refrigerante"]
+
+# Montevideo area, used for coordinates
+CENTER_LON, CENTER_LAT = -56.1645, -34.9011
+
+
+def rut_check_digit(first_digits: str) -> Optional[int]:
+    """Check digit for the first 11 digits of a RUT, or None if no valid digit exists."""
+    total = sum(int(digit) * weight for digit, weight in zip(first_digits, RUT_WEIGHTS))
+    check = 11 - total % 11
+    if check == 11:
+        return 0
+    if check == 10:
+        return None
+    return check
+
+
+def is_valid_rut(rut: str) -> bool:
+    digits = "".join(ch for ch in rut if ch.isdigit())
+    if len(digits) != 12 or not 1 <= int(digits[:2]) <= 21 or digits[8:10] != "00":
+        return False
+    return rut_check_digit(digits[:11]) == int(digits[11])
+
+
+def generate_rut(rng: random.Random) -> str:
+    while True:
+        first_digits = f"{rng.randint(1, 21):02d}{rng.randint(0, 999999):06d}00{rng.randint(1, 9)}"
+        check = rut_check_digit(first_digits)
+        if check is not None:
+            return first_digits + str(check)
+
+
+def zipf_counts(total: int, buckets: int, exponent: float, rng: np.random.Generator) -> np.ndarray:
+    """Split ``total`` over ``buckets`` with Zipfian weights in random bucket order."""
+    if buckets == 0:
+        return np.zeros(0, dtype=np.int64)
+    weights = 1.0 / np.arange(1, buckets + 1) ** exponent
+    rng.shuffle(weights)
+    return rng.multinomial(total, weights / weights.sum())
+
+
+@dataclass
+class SeedConfig:
+    clients: int = 1000
+    work_orders: int = 20000
+    invoice_ratio: float = 0.8  # Share of completed work orders that get invoiced
+    inventory: int = 1000
+    history_mean: int = 200  # Mean stock movements per inventory item
+    resources: int = 100
+    zipf_exponent: float = 1.1
+    days: int = 3 * 365  # How far back the data goes
+    seed: int = 42
+    anchor: datetime = field(default_factory=lambda: datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0))
+    batch_size: int = 1000
+    parallelism: int = 8
+    validate_sample: int = 100
+
+
+@dataclass
+class SeedSummary:
+    counts: Counter
+    sample_ids: Dict[str, List[str]]
+    seconds: float
+
+
+class BatchWriter:
+    """Buffer documents per collection and write them with concurrent insert_many calls."""
+
+    def __init__(self, db, batch_size: int, parallelism: int, sample_size: int = 1000):
+        self.db = db
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(parallelism)
+        self.sample_size = sample_size
+        self.buffers: Dict[str, list] = {}
+        self.tasks: List[asyncio.Task] = []
+        self.counts: Counter = Counter()
+        self.sample_ids: Dict[str, List[str]] = {}
+
+    async def add(self, collection: str, doc: dict):
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.append(doc)
+        sample = self.sample_ids.setdefault(collection, [])
+        if len(sample) < self.sample_size:
+            sample.append(doc["id"])
+        if len(buffer) >= self.batch_size:
+            await self.flush(collection)
+
+    async def flush(self, collection: str):
+        docs = self.buffers.pop(collection, None)
+        if not docs:
+            return
+        await self.semaphore.acquire()
+        self.tasks.append(asyncio.create_task(self._insert(collection, docs)))
+
+    async def _insert(self, collection: str, docs: list):
+        try:
+            await self.db[collection].insert_many(docs, ordered=False)
+            self.counts[collection] += len(docs)
+        finally:
+            self.semaphore.release()
+
+    async def close(self):
+        for collection in list(self.buffers):
+            await self.flush(collection)
+        await asyncio.gather(*self.tasks)
+
+
+class DatasetGenerator:
+    def __init__(self, config: SeedConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.np_rng = np.random.default_rng(config.seed)
+        self.invoice_sequence = 0
+
+    def new_id(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def past_datetime(self, max_days: Optional[int] = None) -> datetime:
+        seconds = self.rng.randint(0, (max_days or self.config.days) * 86400)
+        return self.config.anchor - timedelta(seconds=seconds)
+
+    def point(self, spread: float = 0.12) -> dict:
+        return {
+            "type": "Point",
+            "coordinates": [
+                round(CENTER_LON + self.rng.uniform(-spread, spread), 6),
+                round(CENTER_LAT + self.rng.uniform(-spread / 2, spread / 2), 6),
+            ],
+        }
+
+    def client(self) -> dict:
+        rng = self.rng
+        person = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        business = f"{rng.choice(BUSINESS_WORDS)} {rng.choice(LAST_NAMES)} {rng.choice(BUSINESS_SUFFIXES)}"
+        created_at = self.past_datetime()
+        doc = {
+            "id": self.new_id(),
+            "created_at": created_at,
+            "updated_at": created_at,
+            "version": 1,
+            "name": business.rsplit(" ", 1)[0],
+            "rut": generate_rut(rng),
+            "business_name": business,
+            "address": f"{rng.choice(STREETS)} {rng.randint(100, 4999)}, Montevideo",
+            "email": f"contacto{rng.randint(1, 10 ** 6)}@example.com.uy",
+            "phone": f"09{rng.randint(1000000, 9999999)}",
+            "contact_person": person,
+        }
+        doc["search_terms"] = server.build_search_terms("clients", doc)
+        return doc
+
+    def work_order(self, client_id: str, resource_ids: List[str]) -> dict:
+        rng = self.rng
+        scheduled = self.past_datetime()
+        age_days = (self.config.anchor - scheduled).days
+        # Older work is almost always closed; recent work is mostly open
+        if age_days > 30:
+            status = rng.choices(["completed", "cancelled", "in_progress"], [0.9, 0.08, 0.02])[0]
+        else:
+            status = rng.choices(["pending", "in_progress", "completed", "cancelled"], [0.45, 0.25, 0.25, 0.05])[0]
+        estimated_hours = rng.choice([1, 2, 2, 3, 4, 6, 8])
+        completed_date = scheduled + timedelta(hours=estimated_hours * rng.uniform(0.8, 1.6)) if status == "completed" else None
+        assigned = rng.sample(resource_ids, k=min(len(resource_ids), rng.randint(1, 2))) if resource_ids and status != "pending" else []
+        doc = {
+            "id": self.new_id(),
+            "created_at": scheduled - timedelta(days=rng.randint(0, 14)),
+            "updated_at": completed_date or scheduled,
+            "version": 1,
+            "title": rng.choice(WORK_TITLES),
+            "description": "Trabajo generado para pruebas de carga",
+            "client_id": client_id,
+            "status": status,
+            "scheduled_date": scheduled,
+            "location": f"{rng.choice(STREETS)} {rng.randint(100, 4999)}, Montevideo",
+            "coordinates": self.point(),
+            "priority": rng.choices([1, 2, 3, 4, 5], [0.1, 0.2, 0.4, 0.2, 0.1])[0],
+            "estimated_hours": estimated_hours,
+            "assigned_personnel": assigned,
+            "required_specialties": [rng.choice(SPECIALTIES)] if rng.random() < 0.3 else [],
+            "completed_date": completed_date,
+            "materials_used": [],
+            "comment_count": 0,
+            "last_comment": None,
+            "attachments": [],
+            "invoiced": False,
+            "invoice_id": None,
+        }
+        doc["search_terms"] = server.build_search_terms("work_orders", doc)
+        return doc
+
+    def invoice(self, client_id: str, work_orders: List[dict]) -> dict:
+        rng = self.rng
+        self.invoice_sequence += 1
+        issue_date = max(wo["completed_date"] for wo in work_orders) + timedelta(days=rng.randint(0, 10))
+        items = [
+            {
+                "description": wo["title"],
+                "quantity": float(wo["estimated_hours"]),
+                "unit_price": float(rng.choice([900, 1200, 1500, 1800])),
+                "tax_rate": 22.0,
+            }
+            for wo in work_orders
+        ]
+        subtotal = sum(item["quantity"] * item["unit_price"] for item in items)
+        tax_amount = sum(item["quantity"] * item["unit_price"] * item["tax_rate"] / 100 for item in items)
+        age_days = (self.config.anchor - issue_date).days
+        status = "paid" if age_days > 60 and rng.random() < 0.95 else rng.choice(
+            ["draft", "pending_dgi", "validated_dgi", "sent", "paid"]
+        )
+        paid = status == "paid"
+        return {
+            "id": self.new_id(),
+            "created_at": issue_date,
+            "updated_at": issue_date,
+            "version": 1,
+            "client_id": client_id,
+            "issue_date": issue_date,
+            "due_date": issue_date + timedelta(days=30),
+            "invoice_type": rng.choice(["e-Ticket", "e-Factura"]),
+            "work_order_ids": [wo["id"] for wo in work_orders],
+            "items": items,
+            "notes": None,
+            "payment_terms": "30 días",
+            "status": status,
+            "invoice_number": f"A-{issue_date.year}-{self.invoice_sequence:05d}",
+            "subtotal": subtotal,
+            "tax_amount": tax_amount,
+            "total_amount": subtotal + tax_amount,
+            "paid_amount": subtotal + tax_amount if paid else 0,
+            "paid_date": issue_date + timedelta(days=rng.randint(1, 45)) if paid else None,
+        }
+
+    def resource(self) -> dict:
+        rng = self.rng
+        resource_type = rng.choices(["personnel", "vehicle", "equipment"], [0.6, 0.25, 0.15])[0]
+        created_at = self.past_datetime()
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" if resource_type == "personnel" else \
+            f"{resource_type.title()} {rng.randint(1, 999)}"
+        return {
+            "id": self.new_id(),
+            "created_at": created_at,
+            "updated_at": created_at,
+            "version": 1,
+            "name": name,
+            "type": resource_type,
+            # seed_database marks resources holding open work orders as assigned
+            "status": rng.choices(["available", "maintenance"], [0.95, 0.05])[0],
+            "description": None,
+            "identification": f"SBA{rng.randint(1000, 9999)}" if resource_type == "vehicle" else None,
+            "hourly_cost": round(rng.uniform(400, 1500), 2) if resource_type == "personnel" else None,
+            "specialties": rng.sample(SPECIALTIES, k=rng.randint(1, 3)) if resource_type == "personnel" else [],
+            "notes": None,
+            "assigned_work_orders": [],
+            "current_location": None,
+            "current_coordinates": self.point(),
+            "availability_schedule": None,
+            "last_maintenance_date": None,
+            "next_maintenance_date": None,
+        }
+
+    def inventory_item(self) -> dict:
+        rng = self.rng
+        created_at = self.past_datetime()
+        minimum_stock = rng.choice([None, 5, 10, 20, 50])
+        stock = rng.randint(0, 200)
+        history = []
+        last_restock = last_use = None
+        movements = int(self.np_rng.poisson(self.config.history_mean))
+        span = max((self.config.anchor - created_at).total_seconds(), 1)
+        for when in sorted(created_at + timedelta(seconds=rng.uniform(0, span)) for _ in range(movements)):
+            change = rng.randint(10, 100) if stock < 20 or rng.random() < 0.2 else -rng.randint(1, min(stock, 15))
+            history.append({
+                "date": when,
+                "previous_stock": stock,
+                "new_stock": stock + change,
+                "change": change,
+                "reason": "Reposición" if change > 0 else "Uso en obra",
+            })
+            stock += change
+            if change > 0:
+                last_restock = when
+            else:
+                last_use = when
+        doc = {
+            "id": self.new_id(),
+            "created_at": created_at,
+            "updated_at": history[-1]["date"] if history else created_at,
+            "version": 1,
+            "name": f"{rng.choice(INVENTORY_NAMES)} {rng.randint(1, 500)}",
+            "category": rng.choice(["material", "tool", "spare_part", "consumable"]),
+            "description": None,
+            "unit": rng.choice(["unidad", "m", "kg", "l"]),
+            "unit_cost": round(rng.uniform(10, 5000), 2),
+            "minimum_stock": minimum_stock,
+            "current_stock": stock,
+            "location": f"Depósito {rng.randint(1, 5)}",
+            "supplier_id": None,
+            "image_url": None,
+            "last_restock_date": last_restock,
+            "last_use_date": last_use,
+            "stock_movement_history": history,
+            **server.low_stock_fields(stock, minimum_stock),
+        }
+        doc["search_terms"] = server.build_search_terms("inventory", doc)
+        return doc
+
+
+MODELS = {
+    "clients": server.Client,
+    "work_orders": server.WorkOrder,
+    "invoices": server.Invoice,
+    "resources": server.Resource,
+    "inventory": server.InventoryItem,
+}
+
+
+def validate(collection: str, doc: dict):
+    model = MODELS[collection]
+    model(**doc)
+
+
+async def seed_database(db, config: SeedConfig, progress: bool = False) -> SeedSummary:
+    started = time.perf_counter()
+    generator = DatasetGenerator(config)
+    writer = BatchWriter(db, config.batch_size, config.parallelism)
+    validated: Counter = Counter()
+
+    async def write(collection: str, doc: dict):
+        if validated[collection] < config.validate_sample:
+            validate(collection, doc)
+            validated[collection] += 1
+        await writer.add(collection, doc)
+
+    # Resources are written last, once their open work orders are known
+    resources = {resource["id"]: resource for resource in (generator.resource() for _ in range(config.resources))}
+    personnel_ids = [resource["id"] for resource in resources.values() if resource["type"] == "personnel"]
+
+    per_client = zipf_counts(config.work_orders, config.clients, config.zipf_exponent, generator.np_rng)
+    for index, work_order_count in enumerate(per_client):
+        client = generator.client()
+        await write("clients", client)
+
+        to_invoice = []
+        for _ in range(int(work_order_count)):
+            work_order = generator.work_order(client["id"], personnel_ids)
+            if work_order["status"] in OPEN_STATUSES:
+                for resource_id in work_order["assigned_personnel"]:
+                    resources[resource_id]["assigned_work_orders"].append(work_order["id"])
+            if work_order["status"] == "completed" and generator.rng.random() < config.invoice_ratio:
+                to_invoice.append(work_order)
+            else:
+                await write("work_orders", work_order)
+
+        # Invoice completed work in groups of one to five work orders
+        to_invoice.sort(key=lambda wo: wo["completed_date"])
+        while to_invoice:
+            group_size = generator.rng.randint(1, 5)
+            group, to_invoice = to_invoice[:group_size], to_invoice[group_size:]
+            invoice = generator.invoice(client["id"], group)
+            for work_order in group:
+                work_order["invoiced"] = True
+                work_order["invoice_id"] = invoice["id"]
+                await write("work_orders", work_order)
+            await write("invoices", invoice)
+
+        if progress and (index + 1) % 1000 == 0:
+            print(f"  {index + 1}/{config.clients} clients, {dict(writer.counts)}", flush=True)
+
+    for resource in resources.values():
+        if resource["assigned_work_orders"]:
+            resource["status"] = "assigned"
+        await write("resources", resource)
+
+    for _ in range(config.inventory):
+        await write("inventory", generator.inventory_item())
+
+    await writer.close()
+    # Invoices created through the API continue the seeded numbering
+    await db.counters.update_one(
+        {"_id": "invoice_number"}, {"$max": {"seq": generator.invoice_sequence}}, upsert=True
+    )
+    return SeedSummary(counts=writer.counts, sample_ids=writer.sample_ids, seconds=time.perf_counter() - started)
+
+
+async def main(args) -> int:
+    mongo_url = args.mongo_url or os.environ.get("MONGO_URL")
+    database = AsyncIOMotorClient(mongo_url)[args.db_name]
+    if args.drop:
+        for collection in MODELS:
+            await database.drop_collection(collection)
+
+    config = SeedConfig(
+        clients=args.clients,
+        work_orders=args.work_orders,
+        invoice_ratio=args.invoice_ratio,
+        inventory=args.inventory,
+        history_mean=args.history_mean,
+        resources=args.resources,
+        zipf_exponent=args.zipf_exponent,
+        days=args.days,
+        seed=args.seed,
+        batch_size=args.batch_size,
+        parallelism=args.parallelism,
+        validate_sample=args.validate_sample,
+    )
+    if args.anchor:
+        config.anchor = datetime.fromisoformat(args.anchor)
+
+    summary = await seed_database(database, config, progress=True)
+    total = sum(summary.counts.values())
+    print(f"Inserted {total} documents in {summary.seconds:.1f}s ({total / summary.seconds:.0f} docs/s)")
+    for collection, count in sorted(summary.counts.items()):
+        print(f"  {collection}: {count}")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", help="Defaults to the MONGO_URL environment variable")
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME", "work_management"))
+    parser.add_argument("--drop", action="store_true", help="Drop the seeded collections first")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--work-orders", type=int, default=20000)
+    parser.add_argument("--invoice-ratio", type=float, default=0.8)
+    parser.add_argument("--inventory", type=int, default=1000)
+    parser.add_argument("--history-mean", type=int, default=200)
+    parser.add_argument("--resources", type=int, default=100)
+    parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    parser.add_argument("--days", type=int, default=3 * 365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--anchor", help="ISO datetime the data is generated relative to (default: today)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--parallelism", type=int, default=8, help="Concurrent insert_many batches")
+    parser.add_argument("--validate-sample", type=int, default=100,
+                        help="Documents per collection validated against the API models")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -1,13 +1,40 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, Body, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Body, Depends, File, Header, Request, UploadFile, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from gridfs.errors import NoFile
+from pymongo import ASCENDING, GEOSPHERE, TEXT, ReplaceOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, PyMongoError
+import pymongo
+from pymongo.read_preferences import SecondaryPreferred
+import numpy as np
+import asyncio
+import base64
+import functools
+import hashlib
+import json
 import os
+import re
+import sys
+import time
 import logging
+import math
+import multiprocessing
+import threading
+import traceback
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any, Union
+from pydantic import BaseModel, ConfigDict, Field, EmailStr, model_validator
+from typing import ClassVar, List, Optional, Dict, Any, Literal, Tuple, Union
+import urllib.parse
 import uuid
 from datetime import datetime, date, timedelta
 from enum import Enum
@@ -15,14 +42,611 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 import secrets
 
+from external_integrations import geocoding
+import thumbnails
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+# Metrics (Prometheus text format, exposed at /metrics)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+# With several gunicorn workers behind one port a scrape reaches any one of
+# them, so each worker writes its metrics to METRICS_DIR and /metrics adds
+# up every worker's file. Unset, /metrics reports this process only
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_SNAPSHOT_SECONDS = float(os.environ.get("METRICS_SNAPSHOT_SECONDS", 5))
+
+metrics_registry: list = []
+
+
+def _format_labels(labelnames, labels) -> str:
+    if not labelnames:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labelnames, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, labels: tuple = (), value: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def merge(self, snapshots: Dict[int, list]) -> Dict[tuple, float]:
+        # Workers that exited still count, or the totals would go backwards
+        values: Dict[tuple, float] = {}
+        for snapshot in snapshots.values():
+            for labels, value in snapshot:
+                values[tuple(labels)] = values.get(tuple(labels), 0) + value
+        return values
+
+    def render(self, values: Optional[Dict[tuple, float]] = None) -> List[str]:
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._values.setdefault(labels, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), list(series)] for labels, series in self._values.items()]
+
+    def merge(self, snapshots: Dict[int, list]) -> Dict[tuple, list]:
+        values: Dict[tuple, list] = {}
+        for snapshot in snapshots.values():
+            for labels, series in snapshot:
+                total = values.setdefault(tuple(labels), [0] * len(series))
+                for i, value in enumerate(series):
+                    total[i] += value
+        return values
+
+    def render(self, values: Optional[Dict[tuple, list]] = None) -> List[str]:
+        if values is None:
+            with self._lock:
+                values = {labels: list(series) for labels, series in self._values.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        labelnames = self.labelnames + ("le",)
+        for labels, series in values.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(labelnames, labels + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labelnames, labels + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time."""
+
+    def __init__(self, name: str, documentation: str, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        metrics_registry.append(self)
+
+    def snapshot(self) -> float:
+        return self.callback()
+
+    def merge(self, snapshots: Dict[int, float]) -> Dict[tuple, float]:
+        # Gauges describe a live process, so they are reported per worker
+        return {(str(pid),): value for pid, value in snapshots.items() if process_alive(pid)}
+
+    def render(self, values: Optional[Dict[tuple, float]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if values is None:
+            return lines + [f"{self.name} {self.callback()}"]
+        return lines + [f"{self.name}{_format_labels(('worker',), labels)} {value}" for labels, value in values.items()]
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_metrics_snapshot():
+    """Publish this worker's metrics to METRICS_DIR."""
+    snapshot = {metric.name: metric.snapshot() for metric in metrics_registry}
+    path = Path(METRICS_DIR) / f"{os.getpid()}.json"
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(snapshot))
+    os.replace(temporary, path)
+
+
+def render_metrics() -> str:
+    if not METRICS_DIR:
+        return "\n".join(line for metric in metrics_registry for line in metric.render()) + "\n"
+
+    write_metrics_snapshot()
+    workers: Dict[int, dict] = {}
+    for path in Path(METRICS_DIR).glob("*.json"):
+        try:
+            workers[int(path.stem)] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue  # Being replaced; the next scrape picks it up
+    lines = []
+    for metric in metrics_registry:
+        snapshots = {pid: snapshot[metric.name] for pid, snapshot in workers.items() if metric.name in snapshot}
+        lines += metric.render(metric.merge(snapshots))
+    return "\n".join(lines) + "\n"
+
+
+async def publish_metrics_periodically():
+    while True:
+        await asyncio.sleep(METRICS_SNAPSHOT_SECONDS)
+        try:
+            await run_in_threadpool(write_metrics_snapshot)
+        except OSError:
+            logger.warning("Could not write metrics snapshot", exc_info=True)
+
+
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_response_bytes_total = Counter(
+    "http_response_bytes_total", "Response body bytes sent", ("method", "route"))
+http_request_mongo_commands = Histogram(
+    "http_request_mongo_commands", "Mongo commands issued per request", ("method", "route"), buckets=COUNT_BUCKETS)
+http_request_mongo_seconds_total = Counter(
+    "http_request_mongo_seconds_total", "Time spent in Mongo commands", ("method", "route"))
+http_request_mongo_documents_total = Counter(
+    "http_request_mongo_documents_total", "Documents returned by Mongo", ("method", "route"))
+mongo_commands_total = Counter(
+    "mongo_commands_total", "Mongo commands by name and outcome", ("command", "outcome"))
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "Mongo command round-trip time", ("command",))
+
+
+class RequestStats:
+    __slots__ = ("mongo_commands", "mongo_seconds", "mongo_documents", "response_bytes")
+
+    def __init__(self):
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.mongo_documents = 0
+        self.response_bytes = 0
+
+
+# Motor copies the context into its executor threads, so the command
+# listener sees the stats of the request that issued the command
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+def _documents_in_reply(reply) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if reply.get("value") is not None:  # findAndModify
+        return 1
+    return 0
+
+
+# Event loop lag: how late a periodic sleep wakes up, i.e. how long ready
+# callbacks (requests, Mongo replies) currently wait for the loop
+EVENT_LOOP_LAG_INTERVAL = float(os.environ.get("EVENT_LOOP_LAG_INTERVAL_SECONDS", 0.5))
+# A loop that misses its heartbeat by this much is blocked; 0 disables stack sampling
+BLOCKING_CALL_THRESHOLD_MS = float(os.environ.get("BLOCKING_CALL_THRESHOLD_MS", 100))
+BLOCKING_CALL_MAX_STACKS = int(os.environ.get("BLOCKING_CALL_MAX_STACKS", 200))
+BLOCKING_CALL_STACK_DEPTH = 20
+
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds", "Delay between a timer's deadline and its callback running",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+event_loop_blocked_total = Counter(
+    "event_loop_blocked_total", "Times a blocked event loop was caught by the watchdog")
+event_loop_blocked_seconds_total = Counter(
+    "event_loop_blocked_seconds_total", "Time the event loop spent blocked")
+
+
+class EventLoopLagMonitor:
+    """Samples loop lag and, from a watchdog thread, the stack of whatever blocks the loop.
+
+    The loop side records a heartbeat after every sleep. The watchdog checks
+    the heartbeat every ``threshold`` and, once it is overdue, grabs the loop
+    thread's current frame; that stack is the code holding the loop. Stacks
+    are grouped like the slow-query shapes so repeated offenders add up.
+    """
+
+    def __init__(self, interval: float, threshold_ms: float, max_stacks: int, window: int = 120):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.max_stacks = max_stacks
+        self.last_lag = 0.0
+        self._recent = deque(maxlen=window)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stacks: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def max_recent_lag(self) -> float:
+        return max(self._recent, default=0.0)
+
+    @property
+    def current_lag(self) -> float:
+        """The last sample, or how overdue the heartbeat is if the loop is stuck now."""
+        overdue = time.monotonic() - self._heartbeat - self.interval
+        return max(self.last_lag, overdue, 0.0)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        if self.threshold > 0:
+            self._stopped.clear()
+            threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                started = loop.time()
+                await asyncio.sleep(self.interval)
+                self.last_lag = max(loop.time() - started - self.interval, 0.0)
+                self._heartbeat = time.monotonic()
+                self._recent.append(self.last_lag)
+                event_loop_lag.observe((), self.last_lag)
+        finally:
+            self._stopped.set()
+
+    def _watch(self):
+        blocked = None  # (stack key, blocked since) of the episode in progress
+        while not self._stopped.wait(self.threshold):
+            overdue_since = self._heartbeat + self.interval
+            now = time.monotonic()
+            if now - overdue_since > self.threshold:
+                if blocked is None or blocked[1] != overdue_since:
+                    blocked = (self._sample_stack(), overdue_since)
+            elif blocked is not None:
+                self._record(blocked[0], now - blocked[1])
+                blocked = None
+
+    def _sample_stack(self) -> Optional[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        return "".join(traceback.format_stack(frame, limit=BLOCKING_CALL_STACK_DEPTH))
+
+    def _record(self, stack: Optional[str], duration: float):
+        event_loop_blocked_total.inc()
+        event_loop_blocked_seconds_total.inc((), duration)
+        stack = stack or "<stack unavailable>"
+        logger.warning("Event loop blocked for %.0f ms in:\n%s", duration * 1000, stack)
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._stacks.get(stack)
+            if entry is None:
+                if len(self._stacks) >= self.max_stacks:
+                    return
+                entry = self._stacks[stack] = {
+                    "stack": stack, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "first_seen": now
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration * 1000
+            entry["max_ms"] = max(entry["max_ms"], duration * 1000)
+            entry["last_seen"] = now
+
+    def top(self, limit: int, sort_by: str = "total_ms") -> List[dict]:
+        with self._lock:
+            entries = [dict(entry) for entry in self._stacks.values()]
+        return sorted(entries, key=lambda entry: entry[sort_by], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+
+
+event_loop_lag_monitor = EventLoopLagMonitor(EVENT_LOOP_LAG_INTERVAL, BLOCKING_CALL_THRESHOLD_MS, BLOCKING_CALL_MAX_STACKS)
+Gauge("event_loop_lag_max_seconds", "Largest event loop lag over the last 120 samples",
+      lambda: event_loop_lag_monitor.max_recent_lag)
+
+
+# Slow operation log
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100))  # 0 disables the log
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "false").lower() in ("1", "true", "yes")
+SLOW_QUERY_MAX_SHAPES = int(os.environ.get("SLOW_QUERY_MAX_SHAPES", 1000))
+
+# command name -> (field with the filter, whether it is a list of statements)
+SHAPED_COMMANDS = {
+    "find": ("filter", False),
+    "aggregate": ("pipeline", False),
+    "count": ("query", False),
+    "distinct": ("query", False),
+    "findAndModify": ("query", False),
+    "update": ("updates", True),
+    "delete": ("deletes", True),
+}
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+
+
+def query_shape(value):
+    """Replace literal values with "?" so queries differing only in values group together."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, (dict, list)) for item in value):
+            return [query_shape(item) for item in value]
+        return ["?"] if value else []
+    return "?"
+
+
+def _statement_filter(command_name: str, command) -> Any:
+    field, is_statement_list = SHAPED_COMMANDS[command_name]
+    value = command.get(field) or {}
+    if is_statement_list:
+        # update/delete carry their filters in a list of statements
+        return value[0].get("q", {}) if value else {}
+    return value
+
+
+def _contains_collscan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_contains_collscan(item) for item in plan.values())
+    if isinstance(plan, list):
+        return any(_contains_collscan(item) for item in plan)
+    return False
+
+
+def _winning_plans(explain_result):
+    if isinstance(explain_result, dict):
+        for key, value in explain_result.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from _winning_plans(value)
+    elif isinstance(explain_result, list):
+        for item in explain_result:
+            yield from _winning_plans(item)
+
+
+class SlowQueryLog:
+    """Aggregate Mongo operations slower than a threshold by query shape.
+
+    The first time a shape is seen it is logged and, when explain is enabled,
+    explained once in the background to flag collection scans.
+    """
+
+    def __init__(self, threshold_ms: float, explain: bool, max_shapes: int):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.max_shapes = max_shapes
+        self.loop: Optional[asyncio.AbstractEventLoop] = None  # Set at startup for explain
+        self._shapes: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def record(self, database: str, command_name: str, command, duration_ms: float):
+        collection = command.get(command_name)
+        statement_filter = _statement_filter(command_name, command)
+        shape = json.dumps(query_shape(statement_filter), default=str)
+        key = f"{database}.{collection}:{command_name}:{shape}"
+        now = datetime.utcnow()
+
+        with self._lock:
+            entry = self._shapes.get(key)
+            is_new = entry is None
+            if is_new:
+                if len(self._shapes) >= self.max_shapes:
+                    # Drop the least costly shape to stay bounded
+                    cheapest = min(self._shapes, key=lambda k: self._shapes[k]["total_ms"])
+                    del self._shapes[cheapest]
+                entry = self._shapes[key] = {
+                    "database": database,
+                    "collection": str(collection),
+                    "command": command_name,
+                    "shape": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "first_seen": now,
+                    "sample": json.dumps(statement_filter, default=str)[:2000],
+                    "collection_scan": None,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_seen"] = now
+
+        if is_new:
+            logger.warning(
+                "Slow Mongo %s on %s.%s took %.1f ms: %s",
+                command_name, database, collection, duration_ms, entry["sample"][:500]
+            )
+            if self.explain and self.loop is not None and command_name in EXPLAINABLE_COMMANDS:
+                explainable = {k: v for k, v in command.items() if not k.startswith("$") and k not in ("lsid", "txnNumber")}
+                asyncio.run_coroutine_threadsafe(self._explain(key, database, explainable), self.loop)
+
+    async def _explain(self, key: str, database: str, command):
+        try:
+            result = await client[database].command({"explain": command, "verbosity": "queryPlanner"})
+        except Exception as exc:
+            logger.info("Could not explain slow query %s: %s", key, exc)
+            return
+        collection_scan = any(_contains_collscan(plan) for plan in _winning_plans(result))
+        with self._lock:
+            if key in self._shapes:
+                self._shapes[key]["collection_scan"] = collection_scan
+        if collection_scan:
+            logger.warning("Slow query shape %s uses a collection scan", key)
+
+    def top(self, limit: int, sort_by: str = "total_ms") -> List[dict]:
+        with self._lock:
+            entries = [dict(entry) for entry in self._shapes.values()]
+        return sorted(entries, key=lambda entry: entry[sort_by], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN, SLOW_QUERY_MAX_SHAPES)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        # (connection, request id) -> (database, command) for in-flight shaped commands
+        self._in_flight: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        if slow_query_log.enabled and event.command_name in SHAPED_COMMANDS:
+            self._in_flight[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_commands_total.inc((event.command_name, "success"))
+        mongo_command_duration.observe((event.command_name,), seconds)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.mongo_commands += 1
+            stats.mongo_seconds += seconds
+            stats.mongo_documents += _documents_in_reply(event.reply)
+        self._check_slow(event, seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_commands_total.inc((event.command_name, "failure"))
+        mongo_command_duration.observe((event.command_name,), seconds)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.mongo_commands += 1
+            stats.mongo_seconds += seconds
+        self._check_slow(event, seconds)
+
+    def _check_slow(self, event, seconds: float):
+        in_flight = self._in_flight.pop((event.connection_id, event.request_id), None)
+        if in_flight and seconds * 1000 >= slow_query_log.threshold_ms:
+            database, command = in_flight
+            slow_query_log.record(database, event.command_name, command, seconds * 1000)
+
+
+mongo_command_listener = MongoCommandListener()
+
 # MongoDB connection
+# Pool and timeout settings; unset variables leave the driver (or URL) defaults
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", int),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", int),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", int),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", int),
+    # Client-side operation timeout: bounds each operation, retries included
+    "timeoutMS": ("MONGO_TIMEOUT_MS", int),
+    "compressors": ("MONGO_COMPRESSORS", str),  # e.g. "zstd,snappy,zlib"
+}
+
+
+def mongo_client_options() -> Dict[str, Any]:
+    options = {}
+    for option, (env_name, cast) in MONGO_CLIENT_OPTIONS.items():
+        value = os.environ.get(env_name)
+        if value:
+            options[option] = cast(value)
+    return options
+
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_command_listener], **mongo_client_options())
 db = client[os.environ.get('DB_NAME', 'work_management')]
 
+# Dashboard, report and search reads may come from a secondary that lags by
+# at most READ_MAX_STALENESS_SECONDS (the driver's minimum is 90). A client
+# that wrote within the last READ_YOUR_WRITES_SECONDS carries a cookie that
+# keeps its reads on the primary so it sees its own changes.
+READ_MAX_STALENESS_SECONDS = int(os.environ.get("READ_MAX_STALENESS_SECONDS", 90))
+READ_YOUR_WRITES_SECONDS = int(os.environ.get("READ_YOUR_WRITES_SECONDS", READ_MAX_STALENESS_SECONDS))
+READ_YOUR_WRITES_COOKIE = "primary_reads_until"
+reporting_read_preference = SecondaryPreferred(max_staleness=READ_MAX_STALENESS_SECONDS)
+
+
+def get_read_db(request: Request):
+    """Database handle for staleness-tolerant reads."""
+    try:
+        primary_until = float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0))
+    except ValueError:
+        primary_until = 0
+    if primary_until > time.time():
+        return db
+    return db.with_options(read_preference=reporting_read_preference)
+
+
+# Dashboard, report and search reads scan more than the CRUD paths, so each
+# request gets a tighter budget than MONGO_TIMEOUT_MS
+REPORT_TIMEOUT_MS = int(os.environ.get("REPORT_TIMEOUT_MS", 5000))
+
+
+def report_timeout(endpoint):
+    """Bound every Mongo operation of an endpoint by REPORT_TIMEOUT_MS, answering 503 past it."""
+    @functools.wraps(endpoint)
+    async def bounded(*args, **kwargs):
+        try:
+            with pymongo.timeout(REPORT_TIMEOUT_MS / 1000):
+                return await endpoint(*args, **kwargs)
+        except PyMongoError as e:
+            if not e.timeout:
+                raise
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Query took too long, try again later",
+                headers={"Retry-After": "5"}
+            )
+    return bounded
+
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -74,6 +698,11 @@ class InventoryCategory(str, Enum):
     consumable = "consumable"
 
 
+class DispatchProposalStatus(str, Enum):
+    proposed = "proposed"
+    accepted = "accepted"
+
+
 class UserRole(str, Enum):
     admin = "admin"
     manager = "manager"
@@ -130,11 +759,95 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     return user
 
 
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    if current_user.get("role") != UserRole.admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required"
+        )
+    return current_user
+
+
 # Base Models
 class BaseDBModel(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 1  # Incremented by every write; sent as the ETag
+
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Version an If-Match header requires, or None when any version will do."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip().removeprefix("W/").strip('"')
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='If-Match must be a version ETag such as "3"')
+
+
+def version_filter(expected: Optional[int]) -> dict:
+    """Filter matching documents at the expected version."""
+    if expected is None:
+        return {}
+    if expected == 1:
+        # Documents written before versioning count as version 1
+        return {"version": {"$in": [1, None]}}
+    return {"version": expected}
+
+
+def etag(doc: dict) -> str:
+    return f'"{doc.get("version", 1)}"'
+
+
+def version_conflict(model, current: dict) -> HTTPException:
+    """409 carrying the current state, so the client can merge and retry."""
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={"message": "Document was changed by someone else", "current": jsonable_encoder(model(**current))},
+        headers={"ETag": etag(current)}
+    )
+
+
+class PartialUpdate(BaseModel):
+    """PATCH body: only the fields sent are written and null clears a field.
+
+    Fields outside the model, such as server-managed arrays echoed back by
+    clients, are dropped rather than rewritten.
+    """
+    model_config = ConfigDict(extra="ignore")
+    required_fields: ClassVar[set] = set()  # May be changed but not cleared
+
+    @model_validator(mode="after")
+    def check_required_not_cleared(self):
+        cleared = sorted(field for field in self.required_fields & self.model_fields_set if getattr(self, field) is None)
+        if cleared:
+            raise ValueError(f"Fields cannot be cleared: {', '.join(cleared)}")
+        return self
+
+    def changes(self) -> Dict[str, Any]:
+        return self.model_dump(exclude_unset=True)
+
+
+def plan_update(changes: Dict[str, Any], current: dict) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Minimal $set and $unset for changes, leaving out values that are already stored."""
+    set_fields = {field: value for field, value in changes.items() if value is not None and current.get(field) != value}
+    unset_fields = {field: "" for field, value in changes.items() if value is None and current.get(field) is not None}
+    return set_fields, unset_fields
+
+
+class GeoPoint(BaseModel):
+    type: Literal["Point"] = "Point"
+    coordinates: List[float] = Field(min_length=2, max_length=2)  # [longitude, latitude]
+
+    @model_validator(mode="after")
+    def check_range(self):
+        # The 2dsphere indexes reject anything else, which would surface as a 500
+        longitude, latitude = self.coordinates
+        if not -180 <= longitude <= 180 or not -90 <= latitude <= 90:
+            raise ValueError("Coordinates must be [longitude, latitude] within [-180, 180] and [-90, 90]")
+        return self
 
 
 # User Models
@@ -186,6 +899,49 @@ class Client(ClientBase, BaseDBModel):
     pass
 
 
+class ClientSummary(BaseModel):
+    id: str
+    name: str
+    business_name: str
+    rut: str
+
+
+# Comment Models
+COMMENT_PREVIEW_LENGTH = 200
+
+
+class CommentCreate(BaseModel):
+    text: str = Field(..., min_length=1, max_length=5000)
+
+
+class Comment(BaseDBModel):
+    work_order_id: str
+    author_id: Optional[str] = None
+    author_name: Optional[str] = None
+    text: str
+
+
+class CommentPreview(BaseModel):
+    id: str
+    author_name: Optional[str] = None
+    text: str  # First COMMENT_PREVIEW_LENGTH characters
+    created_at: datetime
+
+
+class CommentPage(BaseModel):
+    items: List[Comment]
+    next_cursor: Optional[str] = None
+
+
+def comment_preview(comment: Comment) -> CommentPreview:
+    return CommentPreview(
+        id=comment.id,
+        author_name=comment.author_name,
+        text=comment.text[:COMMENT_PREVIEW_LENGTH],
+        created_at=comment.created_at
+    )
+
+
 # Work Order Models
 class WorkOrderBase(BaseModel):
     title: str
@@ -194,24 +950,59 @@ class WorkOrderBase(BaseModel):
     status: WorkOrderStatus = WorkOrderStatus.pending
     scheduled_date: Optional[datetime] = None
     location: Optional[str] = None
+    coordinates: Optional[GeoPoint] = None  # Geocoded from location when not provided
     priority: Optional[int] = 3  # 1-5 scale, 5 being highest
     estimated_hours: Optional[float] = None
     assigned_personnel: Optional[List[str]] = []  # List of personnel IDs
+    required_specialties: Optional[List[str]] = []  # Used by the dispatch optimizer
 
 
 class WorkOrderCreate(WorkOrderBase):
     pass
 
 
+class WorkOrderUpdate(PartialUpdate):
+    required_fields: ClassVar[set] = {"title", "description", "client_id", "status"}
+
+    title: Optional[str] = None
+    description: Optional[str] = None
+    client_id: Optional[str] = None
+    status: Optional[WorkOrderStatus] = None
+    scheduled_date: Optional[datetime] = None
+    location: Optional[str] = None
+    coordinates: Optional[GeoPoint] = None
+    priority: Optional[int] = None
+    estimated_hours: Optional[float] = None
+    assigned_personnel: Optional[List[str]] = None
+    required_specialties: Optional[List[str]] = None
+    materials_used: Optional[List[Dict[str, Any]]] = None
+
+
 class WorkOrder(WorkOrderBase, BaseDBModel):
     completed_date: Optional[datetime] = None
     materials_used: Optional[List[Dict[str, Any]]] = []
-    comments: Optional[List[Dict[str, Any]]] = []
+    comment_count: int = 0  # Denormalized from work_order_comments
+    last_comment: Optional[CommentPreview] = None
     attachments: Optional[List[str]] = []
     invoiced: bool = False
     invoice_id: Optional[str] = None
 
 
+class Attachment(BaseModel):
+    id: str
+    work_order_id: str
+    filename: str
+    content_type: Optional[str] = None
+    length: int
+    uploaded_at: datetime
+    uploaded_by: Optional[str] = None
+    has_thumbnail: bool = False
+
+
+class WorkOrderWithClient(WorkOrder):
+    client: Optional[ClientSummary] = None  # Filled in with expand=client
+
+
 # Invoice Models
 class InvoiceItem(BaseModel):
     description: str
@@ -245,6 +1036,10 @@ class Invoice(InvoiceBase, BaseDBModel):
     paid_date: Optional[datetime] = None
 
 
+class InvoiceWithClient(Invoice):
+    client: Optional[ClientSummary] = None  # Filled in with expand=client
+
+
 # Dashboard Stats Models
 class DashboardStats(BaseModel):
     active_work_orders: int
@@ -272,9 +1067,28 @@ class ResourceCreate(ResourceBase):
     pass
 
 
+class ResourceUpdate(PartialUpdate):
+    required_fields: ClassVar[set] = {"name", "type", "status"}
+
+    name: Optional[str] = None
+    type: Optional[ResourceType] = None
+    status: Optional[ResourceStatus] = None
+    description: Optional[str] = None
+    identification: Optional[str] = None
+    hourly_cost: Optional[float] = None
+    specialties: Optional[List[str]] = None
+    notes: Optional[str] = None
+    current_location: Optional[str] = None
+    current_coordinates: Optional[GeoPoint] = None
+    availability_schedule: Optional[Dict[str, Any]] = None
+    last_maintenance_date: Optional[datetime] = None
+    next_maintenance_date: Optional[datetime] = None
+
+
 class Resource(ResourceBase, BaseDBModel):
     assigned_work_orders: List[str] = []  # List of work order IDs
     current_location: Optional[str] = None
+    current_coordinates: Optional[GeoPoint] = None
     availability_schedule: Optional[Dict[str, Any]] = None
     last_maintenance_date: Optional[datetime] = None
     next_maintenance_date: Optional[datetime] = None
@@ -298,10 +1112,855 @@ class InventoryItemCreate(InventoryItemBase):
     pass
 
 
+class InventoryItemUpdate(PartialUpdate):
+    required_fields: ClassVar[set] = {"name", "category", "unit", "unit_cost", "current_stock"}
+
+    name: Optional[str] = None
+    category: Optional[InventoryCategory] = None
+    description: Optional[str] = None
+    unit: Optional[str] = None
+    unit_cost: Optional[float] = None
+    minimum_stock: Optional[int] = None
+    current_stock: Optional[int] = None
+    location: Optional[str] = None
+    supplier_id: Optional[str] = None
+    image_url: Optional[str] = None
+    movement_reason: Optional[str] = None  # Recorded in stock_movement_history, not stored on the item
+
+
 class InventoryItem(InventoryItemBase, BaseDBModel):
     last_restock_date: Optional[datetime] = None
     last_use_date: Optional[datetime] = None
     stock_movement_history: List[Dict[str, Any]] = []
+    is_low_stock: bool = False  # Derived: current_stock <= minimum_stock
+    stock_deficit: int = 0  # Derived: units missing to reach minimum_stock
+
+
+class LowStockItem(BaseModel):
+    id: str
+    name: str
+    unit: str = "unidad"
+    current_stock: int
+    minimum_stock: Optional[int] = None
+    stock_deficit: int
+
+
+class LowStockCategorySummary(BaseModel):
+    category: InventoryCategory
+    count: int
+    total_deficit: int
+    top_items: List[LowStockItem]
+
+
+class LowStockSummary(BaseModel):
+    total_count: int
+    categories: List[LowStockCategorySummary]
+
+
+# Admin Models
+class BlockingCallStack(BaseModel):
+    worker: int  # Process id of the worker that observed it
+    stack: str
+    count: int
+    total_ms: float
+    max_ms: float
+    avg_ms: float
+    first_seen: datetime
+    last_seen: datetime
+
+
+class SlowQueryShape(BaseModel):
+    worker: int  # Process id of the worker that observed it
+    database: str
+    collection: str
+    command: str
+    shape: str
+    count: int
+    total_ms: float
+    max_ms: float
+    avg_ms: float
+    first_seen: datetime
+    last_seen: datetime
+    sample: str
+    collection_scan: Optional[bool] = None  # None until explained
+
+
+# Dispatch Models
+class DispatchOptimizeRequest(BaseModel):
+    work_order_ids: Optional[List[str]] = None  # Defaults to every unassigned pending work order
+    resource_ids: Optional[List[str]] = None  # Defaults to every available personnel resource
+    max_hours_per_resource: float = 8.0  # Per resource per scheduled day
+    time_budget_ms: int = 500
+
+
+class DispatchAssignment(BaseModel):
+    work_order_id: str
+    resource_id: str
+    priority: int
+    estimated_hours: float
+    cost: float
+
+
+class DispatchProposal(BaseDBModel):
+    status: DispatchProposalStatus = DispatchProposalStatus.proposed
+    assignments: List[DispatchAssignment] = []
+    unassigned_work_order_ids: List[str] = []
+    total_hours: float = 0
+    total_cost: float = 0
+    solver_time_ms: float = 0
+
+
+class DispatchAcceptRequest(BaseModel):
+    work_order_ids: Optional[List[str]] = None  # Accept only part of the proposal
+
+
+class DispatchAcceptResult(BaseModel):
+    proposal_id: str
+    applied_work_order_ids: List[str]
+    skipped_work_order_ids: List[str]
+
+
+# Routing Models
+class RouteStop(BaseModel):
+    work_order_id: str
+    title: str
+    location: Optional[str] = None
+    coordinates: GeoPoint
+    distance_from_previous_km: float
+
+
+class RoutePlan(BaseModel):
+    resource_id: str
+    date: date
+    start: Optional[GeoPoint] = None
+    stops: List[RouteStop]
+    total_distance_km: float
+    unlocated_work_order_ids: List[str]
+
+
+class NearbyResource(Resource):
+    distance_km: float
+
+
+# Search Models
+class SearchHit(BaseModel):
+    type: str  # Collection the hit comes from: clients, work_orders or inventory
+    id: str
+    title: str
+    subtitle: Optional[str] = None
+    score: float
+
+
+class SearchResults(BaseModel):
+    query: str
+    mode: str
+    skip: int
+    limit: int
+    results: List[SearchHit]
+
+
+# Sync Models
+class SyncTombstone(BaseModel):
+    collection: str
+    id: str
+    deleted_at: datetime
+
+
+class SyncPage(BaseModel):
+    changes: Dict[str, List[Dict[str, Any]]]
+    tombstones: List[SyncTombstone]
+    cursor: str  # Pass back to continue from this page
+    has_more: bool
+
+
+class SyncChange(BaseModel):
+    collection: str
+    id: str
+    base_updated_at: datetime  # updated_at of the version the client edited
+    fields: Dict[str, Any]
+
+
+class SyncUpload(BaseModel):
+    changes: List[SyncChange] = Field(..., max_length=500)
+
+
+class SyncChangeResult(BaseModel):
+    collection: str
+    id: str
+    status: Literal["applied", "conflict", "not_found", "rejected"]
+    detail: Optional[str] = None
+    document: Optional[Dict[str, Any]] = None  # Current server version
+
+
+async def geocode_location(location: Optional[str]) -> Optional[GeoPoint]:
+    if not location or not geocoding.is_enabled():
+        return None
+    coordinates = await run_in_threadpool(geocoding.geocode_address, location)
+    if coordinates:
+        return GeoPoint(coordinates=list(coordinates))
+    return None
+
+
+# Search terms are normalized (lowercase, accents stripped) tokens stored on
+# each document and indexed for prefix lookups. RUTs are also stored as bare
+# digits so "21.234.567" and "21234567" both match.
+SEARCH_FIELDS = {
+    "clients": ["name", "business_name", "rut", "contact_person"],
+    "work_orders": ["title", "location"],
+    "inventory": ["name"],
+}
+DIGIT_SEARCH_FIELDS = {"rut"}
+
+
+def normalize_text(value: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def tokenize(value: str) -> List[str]:
+    return [token for token in re.split(r"[^0-9a-z]+", normalize_text(value)) if token]
+
+
+def build_search_terms(collection_name: str, doc: dict) -> List[str]:
+    terms = set()
+    for field in SEARCH_FIELDS[collection_name]:
+        value = doc.get(field)
+        if not value:
+            continue
+        terms.update(tokenize(str(value)))
+        if field in DIGIT_SEARCH_FIELDS:
+            digits = re.sub(r"\D", "", str(value))
+            if digits:
+                terms.add(digits)
+    return sorted(terms)
+
+
+# Client summaries: reference cache and expand=client
+EXPANDABLE_FIELDS = {"client"}
+CLIENT_SUMMARY_PROJECTION = {"_id": 0, "id": 1, "name": 1, "business_name": 1, "rut": 1}
+
+
+def parse_expand(expand: Optional[str] = None) -> set:
+    fields = {field.strip() for field in (expand or "").split(",") if field.strip()}
+    unknown = fields - EXPANDABLE_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot expand: {', '.join(sorted(unknown))}")
+    return fields
+
+
+client_ref_cache_hits_total = Counter("client_ref_cache_hits_total", "Client reference cache hits")
+client_ref_cache_misses_total = Counter("client_ref_cache_misses_total", "Client reference cache misses")
+
+
+class ClientRefCache:
+    """Bounded LRU of client summaries for existence checks and expansion.
+
+    Only clients that exist are cached, so a client created elsewhere is
+    found on the next lookup; entries expire after ``ttl`` seconds and
+    client writes must call ``invalidate``.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, ClientSummary]]" = OrderedDict()
+
+    def get(self, client_id: str) -> Optional[ClientSummary]:
+        entry = self._entries.get(client_id)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(client_id, None)
+            client_ref_cache_misses_total.inc()
+            return None
+        self._entries.move_to_end(client_id)
+        client_ref_cache_hits_total.inc()
+        return entry[1]
+
+    def put(self, summary: ClientSummary):
+        self._entries[summary.id] = (time.monotonic() + self.ttl, summary)
+        self._entries.move_to_end(summary.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, client_id: Optional[str] = None):
+        if client_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(client_id, None)
+
+    async def get_summary(self, client_id: str) -> Optional[ClientSummary]:
+        summary = self.get(client_id)
+        if summary is None:
+            doc = await db.clients.find_one({"id": client_id}, CLIENT_SUMMARY_PROJECTION)
+            if doc:
+                summary = ClientSummary(**doc)
+                self.put(summary)
+        return summary
+
+    async def exists(self, client_id: str) -> bool:
+        return await self.get_summary(client_id) is not None
+
+
+client_ref_cache = ClientRefCache(
+    max_size=int(os.environ.get("CLIENT_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("CLIENT_CACHE_TTL_SECONDS", 300))
+)
+
+
+# Cross-worker invalidation: each worker keeps its own caches, so writers bump
+# a version stamp in Mongo and every worker polls the stamps
+class VersionStamps:
+    """Named counters in ``db.cache_versions`` that trigger local callbacks when they move."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._seen: Dict[str, int] = {}
+        self._callbacks: Dict[str, list] = {}
+
+    def on_change(self, name: str, callback):
+        self._callbacks.setdefault(name, []).append(callback)
+
+    def _observe(self, name: str, version: int, expected: Optional[int]):
+        previous = self._seen.get(name)
+        self._seen[name] = version
+        if previous is not None and version != expected:
+            for callback in self._callbacks.get(name, []):
+                callback()
+
+    async def bump(self, name: str):
+        """Announce a change; the caller has already updated its own state."""
+        doc = await db.cache_versions.find_one_and_update(
+            {"_id": name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        # Anything other than our own increment means another worker changed it too
+        previous = self._seen.get(name)
+        self._observe(name, doc["version"], previous + 1 if previous is not None else None)
+
+    async def sync(self):
+        docs = await db.cache_versions.find({"_id": {"$in": list(self._callbacks)}}).to_list(None)
+        versions = {doc["_id"]: doc["version"] for doc in docs}
+        for name in self._callbacks:
+            # A stamp nobody has bumped yet counts as version 0
+            self._observe(name, versions.get(name, 0), self._seen.get(name))
+
+    async def run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception:
+                logger.warning("Version stamp sync failed", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+
+version_stamps = VersionStamps(interval=float(os.environ.get("CACHE_SYNC_INTERVAL_SECONDS", 2)))
+version_stamps.on_change("clients", client_ref_cache.invalidate)
+version_stamps.on_change("slow_queries", slow_query_log.reset)
+version_stamps.on_change("blocking_calls", event_loop_lag_monitor.reset)
+
+
+# Audit trail: every domain write records who changed which fields. Events
+# are buffered in memory and written in batches by a background task to a
+# capped collection, so auditing adds no round trip to the request
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.environ.get("AUDIT_FLUSH_INTERVAL_SECONDS", 1))
+AUDIT_FLUSH_SIZE = int(os.environ.get("AUDIT_FLUSH_SIZE", 200))
+AUDIT_MAX_BUFFER = int(os.environ.get("AUDIT_MAX_BUFFER", 10000))
+AUDIT_CAPPED_BYTES = int(os.environ.get("AUDIT_CAPPED_BYTES", 256 * 1024 * 1024))
+# Bookkeeping and derived fields that would only add noise to the diffs
+AUDIT_IGNORED_FIELDS = {"_id", "updated_at", "version", "search_terms", "stock_movement_history", "hashed_password"}
+
+audit_events_total = Counter("audit_events_total", "Audit events by outcome", ("outcome",))
+
+
+def token_subject(token: Optional[str]) -> Optional[str]:
+    """Username in a bearer token, without the users lookup get_current_user does."""
+    if not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub") or None
+    except JWTError:
+        return None
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if authorization and authorization[:7].lower() == "bearer ":
+        return authorization[7:]
+    return None
+
+
+class AuditContext:
+    __slots__ = ("token", "client_ip", "method", "path", "_actor")
+
+    def __init__(self, token: Optional[str], client_ip: Optional[str], method: str, path: str):
+        self.token = token
+        self.client_ip = client_ip
+        self.method = method
+        self.path = path
+        self._actor = None
+
+    @property
+    def actor(self) -> Optional[str]:
+        if self._actor is None:
+            self._actor = token_subject(self.token) or ""
+        return self._actor or None
+
+
+current_audit_context: ContextVar[Optional[AuditContext]] = ContextVar("current_audit_context", default=None)
+
+
+def diff_documents(before: Optional[dict], after: Optional[dict]) -> Dict[str, Dict[str, Any]]:
+    before, after = before or {}, after or {}
+    changes = {}
+    for field in (before.keys() | after.keys()) - AUDIT_IGNORED_FIELDS:
+        old, new = before.get(field), after.get(field)
+        if old != new:
+            changes[field] = {"before": old, "after": new}
+    return changes
+
+
+class AuditLog:
+    def __init__(self, flush_interval: float, flush_size: int, max_buffer: int):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_buffer = max_buffer
+        self._buffer: List[dict] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def record(
+        self,
+        action: str,
+        collection_name: str,
+        doc_id: str,
+        before: Optional[dict],
+        after: Optional[dict],
+        actor: Optional[str] = None
+    ):
+        """Buffer an event; actor defaults to the caller of the current request."""
+        changes = diff_documents(before, after)
+        if not changes and action == "update":
+            return
+        context = current_audit_context.get()
+        self._buffer.append({
+            # Assigned here so a retried insert cannot write an event twice
+            "_id": ObjectId(),
+            "timestamp": datetime.utcnow(),
+            "action": action,
+            "collection": collection_name,
+            "document_id": doc_id,
+            "actor": actor or (context.actor if context else None),
+            "client_ip": context.client_ip if context else None,
+            "request": f"{context.method} {context.path}" if context else None,
+            "changes": jsonable_encoder(changes),
+        })
+        if len(self._buffer) > self.max_buffer:
+            # Mongo is unreachable for long; keep the newest events
+            dropped = len(self._buffer) - self.max_buffer
+            del self._buffer[:dropped]
+            audit_events_total.inc(("dropped",), dropped)
+        if len(self._buffer) >= self.flush_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        events, self._buffer = self._buffer, []
+        try:
+            await db.audit_events.insert_many(events, ordered=False)
+            failed = []
+        except BulkWriteError as e:
+            # Duplicate keys were written by an earlier attempt
+            failed = [events[error["index"]] for error in e.details["writeErrors"] if error["code"] != 11000]
+        except Exception:
+            failed = events
+        audit_events_total.inc(("written",), len(events) - len(failed))
+        if failed:
+            logger.warning("Could not write %d audit events, will retry", len(failed))
+            self._buffer[:0] = failed
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+
+audit_log = AuditLog(AUDIT_FLUSH_INTERVAL_SECONDS, AUDIT_FLUSH_SIZE, AUDIT_MAX_BUFFER)
+Gauge("audit_events_pending", "Audit events buffered and not yet written", lambda: audit_log.pending)
+
+
+# Transactional outbox: a write records the side effects it implies as
+# outbox events in the same transaction, and a background dispatcher
+# applies them in batches. Handlers must be idempotent, since an event is
+# retried until its handler succeeds
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.environ.get("OUTBOX_POLL_INTERVAL_SECONDS", 2))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 10))
+OUTBOX_LOCK_SECONDS = int(os.environ.get("OUTBOX_LOCK_SECONDS", 60))
+OUTBOX_RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", 7))
+
+outbox_events_total = Counter("outbox_events_total", "Outbox events dispatched by type and outcome", ("type", "outcome"))
+
+# Multi-document transactions need a replica set or a sharded cluster; a
+# standalone mongod gets the writes in sequence instead
+transactions_supported = False
+
+
+async def detect_transaction_support() -> bool:
+    try:
+        hello = await db.command("hello")
+    except Exception:
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+
+async def run_in_transaction(operation):
+    """Await operation(session) inside a transaction when the deployment has them."""
+    if not transactions_supported:
+        return await operation(None)
+    async with await db.client.start_session() as session:
+        return await session.with_transaction(operation)
+
+
+class Outbox:
+    def __init__(self, batch_size: int, poll_interval: float, max_attempts: int, lock_seconds: int):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lock_seconds = lock_seconds
+        self.handlers: Dict[str, Any] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def handler(self, event_type: str):
+        def register(func):
+            self.handlers[event_type] = func
+            return func
+        return register
+
+    async def publish(self, event_type: str, payload: dict, session=None):
+        now = datetime.utcnow()
+        await db.outbox.insert_one({
+            "id": str(uuid.uuid4()),
+            "type": event_type,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now,
+        }, session=session)
+
+    def notify(self):
+        """Dispatch right away instead of at the next poll; call once the write has committed."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def dispatch_batch(self) -> int:
+        now = datetime.utcnow()
+        # Events left in processing by a worker that died are claimed again
+        claimable = {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "processing", "locked_until": {"$lte": now}},
+        ]}
+        candidates = await db.outbox.find(claimable, {"_id": 0, "id": 1}).sort("created_at", ASCENDING).limit(
+            self.batch_size
+        ).to_list(self.batch_size)
+        if not candidates:
+            return 0
+
+        claim = str(uuid.uuid4())
+        await db.outbox.update_many(
+            {"id": {"$in": [event["id"] for event in candidates]}, **claimable},
+            {"$set": {"status": "processing", "claimed_by": claim, "locked_until": now + timedelta(seconds=self.lock_seconds)}}
+        )
+        events = await db.outbox.find({"claimed_by": claim}).sort("created_at", ASCENDING).to_list(None)
+
+        updates = []
+        for event in events:
+            try:
+                handler = self.handlers.get(event["type"])
+                if handler is None:
+                    raise LookupError(f"No outbox handler for {event['type']}")
+                await handler(event["payload"])
+            except Exception as e:
+                attempts = event.get("attempts", 0) + 1
+                failed = attempts >= self.max_attempts
+                logger.warning("Outbox event %s (%s) failed, attempt %d", event["id"], event["type"], attempts, exc_info=True)
+                outbox_events_total.inc((event["type"], "failed" if failed else "retried"))
+                updates.append(UpdateOne({"id": event["id"], "claimed_by": claim}, {
+                    "$set": {
+                        "status": "failed" if failed else "pending",
+                        "attempts": attempts,
+                        "last_error": str(e),
+                        "next_attempt_at": datetime.utcnow() + timedelta(seconds=min(2 ** attempts, 3600)),
+                    },
+                    "$unset": {"claimed_by": "", "locked_until": ""},
+                }))
+            else:
+                outbox_events_total.inc((event["type"], "done"))
+                updates.append(UpdateOne({"id": event["id"], "claimed_by": claim}, {
+                    "$set": {"status": "done", "processed_at": datetime.utcnow()},
+                    "$unset": {"claimed_by": "", "locked_until": ""},
+                }))
+        if updates:
+            await db.outbox.bulk_write(updates, ordered=False)
+        return len(candidates)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            try:
+                while await self.dispatch_batch() >= self.batch_size:
+                    pass
+            except Exception:
+                logger.warning("Outbox dispatch failed", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+outbox = Outbox(OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL_SECONDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_LOCK_SECONDS)
+
+
+# Rate limiting: a token bucket per caller and route template. Callers are
+# identified by the subject of their bearer token (the user get_current_user
+# would load, without the lookup) or, anonymously, by client address.
+# RATE_LIMIT_ROUTES overrides the default per route, e.g.
+#   {"GET /api/dashboard": {"rate": 1, "burst": 5}}
+# Buckets live in each worker's memory unless RATE_LIMIT_BACKEND=mongo,
+# which shares them between workers at the cost of one round trip
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DEFAULT = {
+    "rate": float(os.environ.get("RATE_LIMIT_RATE", 20)),  # Tokens per second
+    "burst": float(os.environ.get("RATE_LIMIT_BURST", 60)),
+}
+RATE_LIMIT_ROUTES = {
+    "GET /api/work-orders": {"rate": 5, "burst": 20},
+    "GET /api/dashboard": {"rate": 2, "burst": 10},
+    "GET /api/search": {"rate": 5, "burst": 20},
+    "POST /api/auth/token": {"rate": 0.5, "burst": 10},
+    **json.loads(os.environ.get("RATE_LIMIT_ROUTES", "{}")),
+}
+RATE_LIMIT_EXEMPT_ROUTES = {"/api/health", "/api/health/ready", "/api/health/live"}
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", 100000))
+
+rate_limited_requests_total = Counter(
+    "rate_limited_requests_total", "Requests rejected by the rate limiter", ("method", "route")
+)
+
+
+class TokenBuckets:
+    """In-memory token buckets, least recently used evicted first."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token; return 0 if one was available, else seconds until there is."""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class MongoTokenBuckets:
+    """Token buckets in the rate_limits collection, refilled by an atomic pipeline update."""
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        pipeline = [
+            {"$set": {"tokens": refilled, "updated_at": "$$NOW"}},
+            {"$set": {
+                "allowed": {"$gte": ["$tokens", 1]},
+                "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+            }},
+        ]
+        try:
+            bucket = await db.rate_limits.find_one_and_update(
+                {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another worker created the bucket first
+            bucket = await db.rate_limits.find_one_and_update(
+                {"_id": key}, pipeline, return_document=ReturnDocument.AFTER
+            )
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / rate
+
+
+rate_limit_buckets = MongoTokenBuckets() if RATE_LIMIT_BACKEND == "mongo" else TokenBuckets(RATE_LIMIT_MAX_BUCKETS)
+
+
+async def enforce_rate_limit(request: Request):
+    route = request.scope.get("route")
+    if not RATE_LIMIT_ENABLED or route is None or route.path in RATE_LIMIT_EXEMPT_ROUTES:
+        return
+    route_key = f"{request.method} {route.path}"
+    limit = RATE_LIMIT_ROUTES.get(route_key, RATE_LIMIT_DEFAULT)
+    # Behind nginx, request.client is the X-Forwarded-For address; uvicorn
+    # only honours that header from FORWARDED_ALLOW_IPS (entrypoint.sh)
+    subject = token_subject(bearer_token(request.headers.get("authorization")))
+    caller = f"user:{subject}" if subject else f"ip:{request.client.host if request.client else ''}"
+    try:
+        wait = await rate_limit_buckets.take(f"{caller}|{route_key}", limit["rate"], limit["burst"])
+    except Exception:
+        # The limiter protects the backend; it should never take it down
+        logger.warning("Rate limiter unavailable, letting request through", exc_info=True)
+        return
+    if wait:
+        rate_limited_requests_total.inc((request.method, route.path))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+
+class ClientLoader:
+    """Per-request loader that resolves client summaries in batched $in queries."""
+
+    def __init__(self):
+        self._loaded: Dict[str, Optional[ClientSummary]] = {}
+
+    async def load_many(self, client_ids) -> Dict[str, Optional[ClientSummary]]:
+        client_ids = set(client_ids)
+        for client_id in client_ids:
+            if client_id not in self._loaded:
+                cached = client_ref_cache.get(client_id)
+                if cached:
+                    self._loaded[client_id] = cached
+        missing = [client_id for client_id in client_ids if client_id not in self._loaded]
+        if missing:
+            docs = await db.clients.find({"id": {"$in": missing}}, CLIENT_SUMMARY_PROJECTION).to_list(None)
+            found = {doc["id"]: ClientSummary(**doc) for doc in docs}
+            for summary in found.values():
+                client_ref_cache.put(summary)
+            for client_id in missing:
+                self._loaded[client_id] = found.get(client_id)
+        return {client_id: self._loaded[client_id] for client_id in client_ids}
+
+
+def get_client_loader() -> ClientLoader:
+    # FastAPI caches dependencies per request, so each request gets one loader
+    return ClientLoader()
+
+
+async def expand_clients(items: list, expand: set, loader: ClientLoader) -> list:
+    if "client" in expand and items:
+        clients = await loader.load_many(item.client_id for item in items)
+        for item in items:
+            item.client = clients.get(item.client_id)
+    return items
+
+
+# Keyset pagination: opaque cursors holding (timestamp, id) positions, so
+# pages stay stable while documents are inserted
+def encode_cursor(positions: Dict[str, Tuple[datetime, str]]) -> str:
+    raw = json.dumps({name: [ts.isoformat(), doc_id] for name, (ts, doc_id) in positions.items()})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Dict[str, Tuple[datetime, str]]:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {name: (datetime.fromisoformat(ts), doc_id) for name, (ts, doc_id) in raw.items()}
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def after_position(
+    field: str, position: Optional[Tuple[datetime, str]], until: Optional[datetime] = None, descending: bool = False
+) -> dict:
+    """Documents past (timestamp, id) in (field, id) order, up to ``until``."""
+    conditions = [{field: {"$lte": until}}] if until else []
+    if position is not None:
+        ts, doc_id = position
+        op = "$lt" if descending else "$gt"
+        conditions.append({"$or": [{field: {op: ts}}, {field: ts, "id": {op: doc_id}}]})
+    return {"$and": conditions} if conditions else {}
+
+
+# Idempotency keys: a retried POST carrying the same Idempotency-Key replays
+# the stored response instead of creating a second document
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+IDEMPOTENCY_LOCK_SECONDS = 60  # a "processing" entry older than this was abandoned
+
+
+def request_fingerprint(payload: BaseModel) -> str:
+    # Only fields the client sent, so defaults such as issue_date do not differ between retries
+    body = json.dumps(payload.model_dump(mode="json", exclude_unset=True), sort_keys=True)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+async def run_idempotent(key: Optional[str], route: str, payload: BaseModel, handler):
+    """Run ``handler`` at most once per (key, route) and replay its response afterwards."""
+    if key is None:
+        return await handler()
+    if not startup_checks["idempotency_index"]:
+        # Without the unique index two retries could both run the handler
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Idempotent requests are not available yet",
+            headers={"Retry-After": "5"}
+        )
+
+    entry_filter = {"key": key, "route": route}
+    fingerprint = request_fingerprint(payload)
+    now = datetime.utcnow()
+    try:
+        await db.idempotency_keys.insert_one({
+            **entry_filter, "fingerprint": fingerprint, "status": "processing", "created_at": now
+        })
+    except DuplicateKeyError:
+        abandoned = await db.idempotency_keys.find_one_and_update(
+            {**entry_filter, "fingerprint": fingerprint, "status": "processing",
+             "created_at": {"$lt": now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+            {"$set": {"created_at": now}}
+        )
+        if abandoned is None:
+            existing = await db.idempotency_keys.find_one(entry_filter)
+            if existing is None or existing["status"] == "processing":
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still being processed",
+                    headers={"Retry-After": "1"}
+                )
+            if existing["fingerprint"] != fingerprint:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used with a different request body"
+                )
+            return JSONResponse(
+                existing["response"], status_code=existing["status_code"], headers={"Idempotent-Replayed": "true"}
+            )
+
+    try:
+        result = await handler()
+    except Exception:
+        # Failed requests are not stored, so the client may retry with the same key
+        await db.idempotency_keys.delete_one({**entry_filter, "status": "processing"})
+        raise
+    await db.idempotency_keys.update_one(entry_filter, {"$set": {
+        "status": "completed", "status_code": 200, "response": jsonable_encoder(result)
+    }})
+    return result
 
 
 # API Routes for Clients
@@ -310,7 +1969,10 @@ async def create_client(client: ClientCreate):
     client_dict = client.model_dump()
     client_obj = Client(**client_dict)
     client_data = client_obj.model_dump()
+    client_data["search_terms"] = build_search_terms("clients", client_data)
     result = await db.clients.insert_one(client_data)
+    audit_log.record("create", "clients", client_obj.id, None, client_data)
+    # Nothing to invalidate: misses are not cached, so no worker holds a stale entry
     return client_obj
 
 
@@ -321,32 +1983,49 @@ async def get_clients():
 
 
 @api_router.get("/clients/{client_id}", response_model=Client)
-async def get_client(client_id: str):
+async def get_client(client_id: str, response: Response):
     client = await db.clients.find_one({"id": client_id})
     if client:
+        response.headers["ETag"] = etag(client)
         return Client(**client)
     raise HTTPException(status_code=404, detail="Client not found")
 
 
 # API Routes for Work Orders
 @api_router.post("/work-orders", response_model=WorkOrder)
-async def create_work_order(work_order: WorkOrderCreate):
+async def create_work_order(
+    work_order: WorkOrderCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    return await run_idempotent(
+        idempotency_key, "POST /work-orders", work_order, lambda: insert_work_order(work_order)
+    )
+
+
+async def insert_work_order(work_order: WorkOrderCreate) -> WorkOrder:
     # Validate client exists
-    client = await db.clients.find_one({"id": work_order.client_id})
-    if not client:
+    if not await client_ref_cache.exists(work_order.client_id):
         raise HTTPException(status_code=404, detail="Client not found")
     
+    if work_order.location and not work_order.coordinates:
+        work_order.coordinates = await geocode_location(work_order.location)
+    
     work_order_dict = work_order.model_dump()
     work_order_obj = WorkOrder(**work_order_dict)
     work_order_data = work_order_obj.model_dump()
+    work_order_data["search_terms"] = build_search_terms("work_orders", work_order_data)
     result = await db.work_orders.insert_one(work_order_data)
+    audit_log.record("create", "work_orders", work_order_obj.id, None, work_order_data)
     return work_order_obj
 
 
-@api_router.get("/work-orders", response_model=List[WorkOrder])
+@api_router.get("/work-orders", response_model=List[WorkOrderWithClient])
 async def get_work_orders(
     status: Optional[WorkOrderStatus] = None,
-    client_id: Optional[str] = None
+    client_id: Optional[str] = None,
+    include_archived: bool = False,
+    expand: set = Depends(parse_expand),
+    client_loader: ClientLoader = Depends(get_client_loader)
 ):
     filter_query = {}
     if status:
@@ -355,44 +2034,449 @@ async def get_work_orders(
         filter_query["client_id"] = client_id
     
     work_orders = await db.work_orders.find(filter_query).to_list(1000)
-    return [WorkOrder(**wo) for wo in work_orders]
-
-
-@api_router.get("/work-orders/{work_order_id}", response_model=WorkOrder)
-async def get_work_order(work_order_id: str):
+    if include_archived:
+        work_orders += await db.work_orders_archive.find(filter_query).to_list(1000)
+    return await expand_clients([WorkOrderWithClient(**wo) for wo in work_orders], expand, client_loader)
+
+
+@api_router.get("/work-orders/{work_order_id}", response_model=WorkOrderWithClient)
+async def get_work_order(
+    work_order_id: str,
+    response: Response,
+    include_archived: bool = False,
+    expand: set = Depends(parse_expand),
+    client_loader: ClientLoader = Depends(get_client_loader)
+):
     work_order = await db.work_orders.find_one({"id": work_order_id})
+    if not work_order and include_archived:
+        work_order = await db.work_orders_archive.find_one({"id": work_order_id})
     if work_order:
-        return WorkOrder(**work_order)
+        response.headers["ETag"] = etag(work_order)
+        return (await expand_clients([WorkOrderWithClient(**work_order)], expand, client_loader))[0]
     raise HTTPException(status_code=404, detail="Work order not found")
 
 
-@api_router.put("/work-orders/{work_order_id}", response_model=WorkOrder)
-async def update_work_order(work_order_id: str, work_order_update: dict = Body(...)):
-    # Update the updated_at field
-    work_order_update["updated_at"] = datetime.utcnow()
+@api_router.patch("/work-orders/{work_order_id}", response_model=WorkOrder)
+@api_router.put("/work-orders/{work_order_id}", response_model=WorkOrder, include_in_schema=False)
+async def update_work_order(
+    work_order_id: str,
+    work_order_update: WorkOrderUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    expected_version = parse_if_match(if_match)
+    changes = work_order_update.changes()
+    if changes.get("client_id") and not await client_ref_cache.exists(changes["client_id"]):
+        raise HTTPException(status_code=404, detail="Client not found")
     
-    # If status is being changed to completed, set completed_date
-    if work_order_update.get("status") == "completed":
-        work_order_update["completed_date"] = datetime.utcnow()
+    current = await db.work_orders.find_one({"id": work_order_id}, {"_id": 0, "search_terms": 0})
+    if not current:
+        raise HTTPException(status_code=404, detail="Work order not found")
+    if expected_version is not None and current.get("version", 1) != expected_version:
+        raise version_conflict(WorkOrder, current)
     
-    result = await db.work_orders.update_one(
-        {"id": work_order_id},
-        {"$set": work_order_update}
-    )
+    set_fields, unset_fields = plan_update(changes, current)
+    if not set_fields and not unset_fields:
+        response.headers["ETag"] = etag(current)
+        return WorkOrder(**current)
     
-    if result.modified_count:
+    # Keep coordinates in sync with a changed location
+    # Clients echoing the whole document send the old coordinates along
+    if set_fields.get("location") and "coordinates" not in set_fields:
+        coordinates = await geocode_location(set_fields["location"])
+        if coordinates:
+            set_fields["coordinates"] = coordinates.model_dump()
+    
+    if any(field in set_fields or field in unset_fields for field in SEARCH_FIELDS["work_orders"]):
+        set_fields["search_terms"] = build_search_terms(
+            "work_orders", {**current, **set_fields, **dict.fromkeys(unset_fields)}
+        )
+    
+    completing = set_fields.get("status") == WorkOrderStatus.completed
+    update = {"$set": set_fields, "$inc": {"version": 1}}
+    if unset_fields:
+        update["$unset"] = unset_fields
+    
+    async def write(session):
+        # Stamped right before the write: a sync pull that has already read
+        # past this time would otherwise never see the change
+        now = datetime.utcnow()
+        set_fields["updated_at"] = now
+        if completing:
+            set_fields["completed_date"] = now
+        previous = await db.work_orders.find_one_and_update(
+            {"id": work_order_id, **version_filter(expected_version)}, update, session=session
+        )
+        if previous and set_fields.get("status") == WorkOrderStatus.completed and previous.get("status") != WorkOrderStatus.completed:
+            await outbox.publish("work_order.completed", {"work_order_id": work_order_id}, session=session)
+        return previous
+    
+    previous = await run_in_transaction(write)
+    
+    if previous:
+        outbox.notify()
         updated_work_order = await db.work_orders.find_one({"id": work_order_id})
+        audit_log.record("update", "work_orders", work_order_id, previous, updated_work_order)
+        response.headers["ETag"] = etag(updated_work_order)
         return WorkOrder(**updated_work_order)
     
+    # Changed or deleted since it was read
+    current = await db.work_orders.find_one({"id": work_order_id})
+    if current:
+        raise version_conflict(WorkOrder, current)
     raise HTTPException(status_code=404, detail="Work order not found")
 
 
+@outbox.handler("work_order.completed")
+async def release_completed_work_order(payload: dict):
+    """Free the resources a completed work order was holding."""
+    work_order_id = payload["work_order_id"]
+    now = datetime.utcnow()
+    projection = {"_id": 0, "id": 1, "status": 1, "assigned_work_orders": 1}
+    before = await db.resources.find({"assigned_work_orders": work_order_id}, projection).to_list(None)
+    if not before:
+        return
+    resource_ids = [resource["id"] for resource in before]
+    await db.resources.update_many(
+        {"id": {"$in": resource_ids}},
+        {"$pull": {"assigned_work_orders": work_order_id}, "$set": {"updated_at": now}, "$inc": {"version": 1}}
+    )
+    await db.resources.update_many(
+        {"id": {"$in": resource_ids}, "status": ResourceStatus.assigned, "assigned_work_orders": {"$size": 0}},
+        {"$set": {"status": ResourceStatus.available, "updated_at": now}, "$inc": {"version": 1}}
+    )
+    after = {
+        resource["id"]: resource
+        for resource in await db.resources.find({"id": {"$in": resource_ids}}, projection).to_list(None)
+    }
+    for resource in before:
+        audit_log.record("update", "resources", resource["id"], resource, after.get(resource["id"]), actor="outbox")
+
+
+# Work Order Comments
+@api_router.post("/work-orders/{work_order_id}/comments", response_model=Comment)
+async def create_comment(
+    work_order_id: str,
+    comment_create: CommentCreate,
+    current_user: dict = Depends(get_current_user)
+):
+    if not await db.work_orders.find_one({"id": work_order_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Work order not found")
+
+    comment = Comment(
+        work_order_id=work_order_id,
+        author_id=current_user.get("id"),
+        author_name=current_user.get("full_name") or current_user.get("username"),
+        text=comment_create.text
+    )
+    await db.work_order_comments.insert_one(comment.model_dump())
+    audit_log.record("create", "work_order_comments", comment.id, None, comment.model_dump())
+    await db.work_orders.update_one(
+        {"id": work_order_id},
+        {
+            "$inc": {"comment_count": 1, "version": 1},
+            "$set": {"last_comment": comment_preview(comment).model_dump(), "updated_at": comment.created_at}
+        }
+    )
+    return comment
+
+
+@api_router.get("/work-orders/{work_order_id}/comments", response_model=CommentPage)
+async def get_comments(
+    work_order_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    order: Literal["asc", "desc"] = "asc"
+):
+    """Comments oldest first (or newest first with order=desc), one page at a time."""
+    position = decode_cursor(cursor).get("comments") if cursor else None
+    descending = order == "desc"
+    direction = -1 if descending else ASCENDING
+    comments = await db.work_order_comments.find({
+        "work_order_id": work_order_id,
+        **after_position("created_at", position, descending=descending)
+    }).sort([("created_at", direction), ("id", direction)]).limit(limit + 1).to_list(limit + 1)
+
+    items = [Comment(**comment) for comment in comments[:limit]]
+    next_cursor = None
+    if len(comments) > limit:
+        next_cursor = encode_cursor({"comments": (comments[limit - 1]["created_at"], comments[limit - 1]["id"])})
+    return CommentPage(items=items, next_cursor=next_cursor)
+
+
+@api_router.delete("/work-orders/{work_order_id}/comments/{comment_id}")
+async def delete_comment(work_order_id: str, comment_id: str, current_user: dict = Depends(get_current_user)):
+    comment = await db.work_order_comments.find_one({"id": comment_id, "work_order_id": work_order_id})
+    if not comment:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    if comment.get("author_id") != current_user.get("id") and current_user.get("role") != UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the author can delete a comment")
+
+    result = await db.work_order_comments.delete_one({"id": comment_id})
+    if result.deleted_count:
+        audit_log.record("delete", "work_order_comments", comment_id, comment, None)
+        await record_tombstones("work_order_comments", [comment_id])
+        latest = await db.work_order_comments.find(
+            {"work_order_id": work_order_id}
+        ).sort([("created_at", -1), ("id", -1)]).limit(1).to_list(1)
+        await db.work_orders.update_one(
+            {"id": work_order_id},
+            {
+                "$inc": {"comment_count": -1, "version": 1},
+                "$set": {
+                    "last_comment": comment_preview(Comment(**latest[0])).model_dump() if latest else None,
+                    "updated_at": datetime.utcnow()
+                }
+            }
+        )
+    return {"status": "ok"}
+
+
+# Work Order Attachments: contents in GridFS, ids listed on the work order
+ATTACHMENT_MAX_BYTES = int(os.environ.get("ATTACHMENT_MAX_BYTES", 25 * 1024 * 1024))
+ATTACHMENT_CHUNK_BYTES = 255 * 1024  # GridFS default chunk size
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", 320))
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 2))
+
+thumbnail_executor: Optional[ProcessPoolExecutor] = None
+
+
+def attachments_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name="attachments")
+
+
+def thumbnails_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name="attachment_thumbnails")
+
+
+def get_thumbnail_executor() -> ProcessPoolExecutor:
+    global thumbnail_executor
+    if thumbnail_executor is None:
+        # spawn: forking a process that runs Motor and watchdog threads is unsafe
+        thumbnail_executor = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return thumbnail_executor
+
+
+def attachment_from_file(file_doc: dict) -> Attachment:
+    metadata = file_doc.get("metadata") or {}
+    return Attachment(
+        id=str(file_doc["_id"]),
+        work_order_id=metadata.get("work_order_id", ""),
+        filename=file_doc.get("filename") or "",
+        content_type=metadata.get("content_type"),
+        length=file_doc["length"],
+        uploaded_at=file_doc["uploadDate"],
+        uploaded_by=metadata.get("uploaded_by"),
+        has_thumbnail=bool(metadata.get("thumbnail_id"))
+    )
+
+
+def parse_object_id(value: str, detail: str) -> ObjectId:
+    if not ObjectId.is_valid(value):
+        raise HTTPException(status_code=404, detail=detail)
+    return ObjectId(value)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single-range ``bytes=`` header; None serves the whole file."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(end_text), 0), size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+async def generate_thumbnail(file_id: ObjectId, filename: str):
+    grid_out = await attachments_bucket().open_download_stream(file_id)
+    data = await grid_out.read()
+    try:
+        thumbnail, content_type = await asyncio.get_running_loop().run_in_executor(
+            get_thumbnail_executor(), thumbnails.make_thumbnail, data, THUMBNAIL_SIZE
+        )
+    except Exception as e:
+        logger.warning("Could not make a thumbnail of %s (%s): %s", file_id, filename, e)
+        return
+    thumbnail_id = await thumbnails_bucket().upload_from_stream(
+        f"thumbnail-{filename}", thumbnail, metadata={"content_type": content_type, "thumbnail_of": file_id}
+    )
+    await db["attachments.files"].update_one({"_id": file_id}, {"$set": {"metadata.thumbnail_id": thumbnail_id}})
+
+
+async def stream_grid_out(grid_out, start: int, end: int):
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await grid_out.read(min(ATTACHMENT_CHUNK_BYTES, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def grid_file_response(grid_out, range_header: Optional[str], disposition: str) -> Response:
+    metadata = grid_out.metadata or {}
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{grid_out._id}"',  # Stored files never change
+        "Content-Disposition": f"{disposition}; filename*=UTF-8''{urllib.parse.quote(grid_out.filename or '')}",
+    }
+    byte_range = parse_range(range_header, grid_out.length)
+    if byte_range is None:
+        start, end, status_code = 0, grid_out.length - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{grid_out.length}"
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+    return StreamingResponse(
+        stream_grid_out(grid_out, start, end),
+        status_code=status_code,
+        media_type=metadata.get("content_type") or "application/octet-stream",
+        headers=headers
+    )
+
+
+@api_router.post("/work-orders/{work_order_id}/attachments", response_model=Attachment)
+async def upload_attachment(
+    work_order_id: str,
+    file: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    if not await db.work_orders.find_one({"id": work_order_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Work order not found")
+
+    filename = file.filename or "attachment"
+    content_type = file.content_type or "application/octet-stream"
+    grid_in = attachments_bucket().open_upload_stream(filename, chunk_size_bytes=ATTACHMENT_CHUNK_BYTES, metadata={
+        "work_order_id": work_order_id,
+        "content_type": content_type,
+        "uploaded_by": current_user.get("username"),
+    })
+    # Copy chunk by chunk so large files never sit in memory whole
+    size = 0
+    try:
+        while chunk := await file.read(ATTACHMENT_CHUNK_BYTES):
+            size += len(chunk)
+            if size > ATTACHMENT_MAX_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Attachments are limited to {ATTACHMENT_MAX_BYTES} bytes"
+                )
+            await grid_in.write(chunk)
+    except BaseException:
+        await grid_in.abort()
+        raise
+    await grid_in.close()
+
+    await db.work_orders.update_one(
+        {"id": work_order_id},
+        {"$push": {"attachments": str(grid_in._id)}, "$set": {"updated_at": datetime.utcnow()}, "$inc": {"version": 1}}
+    )
+    audit_log.record(
+        "create", "attachments", str(grid_in._id), None,
+        {"work_order_id": work_order_id, "filename": filename, "content_type": content_type, "length": size},
+        actor=current_user.get("username")
+    )
+    if thumbnails.is_enabled() and content_type in thumbnails.THUMBNAIL_CONTENT_TYPES:
+        start_background_task(generate_thumbnail(grid_in._id, filename))
+
+    file_doc = await db["attachments.files"].find_one({"_id": grid_in._id})
+    return attachment_from_file(file_doc)
+
+
+@api_router.get("/work-orders/{work_order_id}/attachments", response_model=List[Attachment])
+async def get_attachments(work_order_id: str):
+    files = await db["attachments.files"].find(
+        {"metadata.work_order_id": work_order_id}
+    ).sort("uploadDate", ASCENDING).to_list(1000)
+    return [attachment_from_file(file_doc) for file_doc in files]
+
+
+@api_router.get("/attachments/{attachment_id}")
+async def download_attachment(
+    attachment_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    download: bool = False
+):
+    """File contents, honouring single byte ranges for resumable downloads and media seeking."""
+    file_id = parse_object_id(attachment_id, "Attachment not found")
+    try:
+        grid_out = await attachments_bucket().open_download_stream(file_id)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return await grid_file_response(grid_out, range_header, "attachment" if download else "inline")
+
+
+@api_router.get("/attachments/{attachment_id}/thumbnail")
+async def download_thumbnail(attachment_id: str):
+    file_id = parse_object_id(attachment_id, "Attachment not found")
+    file_doc = await db["attachments.files"].find_one({"_id": file_id}, {"metadata.thumbnail_id": 1})
+    thumbnail_id = ((file_doc or {}).get("metadata") or {}).get("thumbnail_id")
+    if not thumbnail_id:
+        raise HTTPException(status_code=404, detail="Thumbnail not available")
+    try:
+        grid_out = await thumbnails_bucket().open_download_stream(thumbnail_id)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Thumbnail not available")
+    return await grid_file_response(grid_out, None, "inline")
+
+
+@api_router.delete("/work-orders/{work_order_id}/attachments/{attachment_id}")
+async def delete_attachment(work_order_id: str, attachment_id: str, current_user: dict = Depends(get_current_user)):
+    file_id = parse_object_id(attachment_id, "Attachment not found")
+    file_doc = await db["attachments.files"].find_one({"_id": file_id, "metadata.work_order_id": work_order_id})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    await attachments_bucket().delete(file_id)
+    thumbnail_id = (file_doc.get("metadata") or {}).get("thumbnail_id")
+    if thumbnail_id:
+        try:
+            await thumbnails_bucket().delete(thumbnail_id)
+        except NoFile:
+            pass
+    await db.work_orders.update_one(
+        {"id": work_order_id},
+        {"$pull": {"attachments": attachment_id}, "$set": {"updated_at": datetime.utcnow()}, "$inc": {"version": 1}}
+    )
+    audit_log.record(
+        "delete", "attachments", attachment_id,
+        {"work_order_id": work_order_id, "filename": file_doc.get("filename"), "length": file_doc.get("length")}, None,
+        actor=current_user.get("username")
+    )
+    return {"status": "ok"}
+
+
 # API Routes for Invoices
 @api_router.post("/invoices", response_model=Invoice)
-async def create_invoice(invoice_create: InvoiceCreate):
+async def create_invoice(
+    invoice_create: InvoiceCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    return await run_idempotent(
+        idempotency_key, "POST /invoices", invoice_create, lambda: insert_invoice(invoice_create)
+    )
+
+
+async def insert_invoice(invoice_create: InvoiceCreate) -> Invoice:
     # Validate client exists
-    client = await db.clients.find_one({"id": invoice_create.client_id})
-    if not client:
+    if not await client_ref_cache.exists(invoice_create.client_id):
         raise HTTPException(status_code=404, detail="Client not found")
     
     # Validate work orders exist and update them
@@ -410,10 +2494,13 @@ async def create_invoice(invoice_create: InvoiceCreate):
     tax_amount = sum(item.quantity * item.unit_price * (item.tax_rate / 100) for item in invoice_create.items)
     total_amount = subtotal + tax_amount
     
-    # Create invoice number (simplified for simulation)
+    # Create invoice number (simplified for simulation). The counter survives
+    # archival, which a count of the invoices collection would not
     current_year = datetime.now().year
-    invoice_count = await db.invoices.count_documents({})
-    invoice_number = f"A-{current_year}-{invoice_count + 1:05d}"
+    counter = await db.counters.find_one_and_update(
+        {"_id": "invoice_number"}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    invoice_number = f"A-{current_year}-{counter['seq']:05d}"
     
     # Create invoice object
     invoice_dict = invoice_create.model_dump()
@@ -425,24 +2512,47 @@ async def create_invoice(invoice_create: InvoiceCreate):
         total_amount=total_amount
     )
     
-    # Store in database
+    # Store in database. Claiming the work orders is what keeps them from
+    # being billed twice, so it is part of the same write
     invoice_data = invoice_obj.model_dump()
-    await db.invoices.insert_one(invoice_data)
+    work_order_ids = list(dict.fromkeys(invoice_create.work_order_ids))
+    now = datetime.utcnow()
     
-    # Update work orders as invoiced
-    for wo_id in invoice_create.work_order_ids:
-        await db.work_orders.update_one(
-            {"id": wo_id},
-            {"$set": {"invoiced": True, "invoice_id": invoice_obj.id}}
+    async def write(session):
+        if work_order_ids:
+            claimed = await db.work_orders.update_many(
+                {"id": {"$in": work_order_ids}, "invoiced": {"$ne": True}},
+                {"$set": {"invoiced": True, "invoice_id": invoice_obj.id, "updated_at": now}, "$inc": {"version": 1}},
+                session=session
+            )
+            if claimed.modified_count != len(work_order_ids):
+                if session is None:
+                    # No transaction to abort; give back what this invoice took
+                    await db.work_orders.update_many(
+                        {"invoice_id": invoice_obj.id},
+                        {"$set": {"invoiced": False, "invoice_id": None, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}}
+                    )
+                raise HTTPException(status_code=400, detail="Some work orders were invoiced meanwhile")
+        await db.invoices.insert_one(invoice_data, session=session)
+    
+    await run_in_transaction(write)
+    audit_log.record("create", "invoices", invoice_obj.id, None, invoice_data)
+    for wo_id in work_order_ids:
+        audit_log.record(
+            "update", "work_orders", wo_id,
+            {"invoiced": False, "invoice_id": None}, {"invoiced": True, "invoice_id": invoice_obj.id}
         )
     
     return invoice_obj
 
 
-@api_router.get("/invoices", response_model=List[Invoice])
+@api_router.get("/invoices", response_model=List[InvoiceWithClient])
 async def get_invoices(
     status: Optional[InvoiceStatus] = None,
-    client_id: Optional[str] = None
+    client_id: Optional[str] = None,
+    include_archived: bool = False,
+    expand: set = Depends(parse_expand),
+    client_loader: ClientLoader = Depends(get_client_loader)
 ):
     filter_query = {}
     if status:
@@ -451,19 +2561,36 @@ async def get_invoices(
         filter_query["client_id"] = client_id
     
     invoices = await db.invoices.find(filter_query).to_list(1000)
-    return [Invoice(**invoice) for invoice in invoices]
-
-
-@api_router.get("/invoices/{invoice_id}", response_model=Invoice)
-async def get_invoice(invoice_id: str):
+    if include_archived:
+        invoices += await db.invoices_archive.find(filter_query).to_list(1000)
+    return await expand_clients([InvoiceWithClient(**invoice) for invoice in invoices], expand, client_loader)
+
+
+@api_router.get("/invoices/{invoice_id}", response_model=InvoiceWithClient)
+async def get_invoice(
+    invoice_id: str,
+    response: Response,
+    include_archived: bool = False,
+    expand: set = Depends(parse_expand),
+    client_loader: ClientLoader = Depends(get_client_loader)
+):
     invoice = await db.invoices.find_one({"id": invoice_id})
+    if not invoice and include_archived:
+        invoice = await db.invoices_archive.find_one({"id": invoice_id})
     if invoice:
-        return Invoice(**invoice)
+        response.headers["ETag"] = etag(invoice)
+        return (await expand_clients([InvoiceWithClient(**invoice)], expand, client_loader))[0]
     raise HTTPException(status_code=404, detail="Invoice not found")
 
 
 @api_router.put("/invoices/{invoice_id}/status", response_model=Invoice)
-async def update_invoice_status(invoice_id: str, status: InvoiceStatus):
+async def update_invoice_status(
+    invoice_id: str,
+    status: InvoiceStatus,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    expected_version = parse_if_match(if_match)
     update_data = {
         "status": status,
         "updated_at": datetime.utcnow()
@@ -478,21 +2605,27 @@ async def update_invoice_status(invoice_id: str, status: InvoiceStatus):
         update_data["paid_date"] = datetime.utcnow()
         update_data["paid_amount"] = invoice.get("total_amount", 0)
     
-    result = await db.invoices.update_one(
-        {"id": invoice_id},
-        {"$set": update_data}
+    previous = await db.invoices.find_one_and_update(
+        {"id": invoice_id, **version_filter(expected_version)},
+        {"$set": update_data, "$inc": {"version": 1}}
     )
     
-    if result.modified_count:
+    if previous:
         updated_invoice = await db.invoices.find_one({"id": invoice_id})
+        audit_log.record("update", "invoices", invoice_id, previous, updated_invoice)
+        response.headers["ETag"] = etag(updated_invoice)
         return Invoice(**updated_invoice)
     
+    current = await db.invoices.find_one({"id": invoice_id})
+    if current:
+        raise version_conflict(Invoice, current)
     raise HTTPException(status_code=404, detail="Invoice not found")
 
 
 # Dashboard API
 @api_router.get("/dashboard", response_model=DashboardStats)
-async def get_dashboard_stats():
+@report_timeout
+async def get_dashboard_stats(db=Depends(get_read_db)):
     # Count work orders by status
     pipeline = [
         {"$group": {"_id": "$status", "count": {"$sum": 1}}}
@@ -530,6 +2663,17 @@ async def get_dashboard_stats():
     total_invoiced_amount = total_invoiced[0]["total"] if total_invoiced else 0
     total_paid_amount = total_paid[0]["total"] if total_paid else 0
     
+    # Add what archival moved out of the hot collections
+    archived = await db.archive_stats.find_one({"_id": "totals"}) or {}
+    for status_name, count in (archived.get("work_orders_by_status") or {}).items():
+        work_orders_by_status[status_name] = work_orders_by_status.get(status_name, 0) + count
+    completed_work_orders = work_orders_by_status.get(WorkOrderStatus.completed, 0)
+    for status_name, totals in (archived.get("invoices_by_status") or {}).items():
+        total_invoiced_amount += totals.get("total_amount", 0)
+        if status_name == InvoiceStatus.paid:
+            paid_invoices += totals.get("count", 0)
+            total_paid_amount += totals.get("total_amount", 0)
+    
     return DashboardStats(
         active_work_orders=active_work_orders,
         completed_work_orders=completed_work_orders,
@@ -547,6 +2691,42 @@ async def health_check():
     return {"status": "ok", "timestamp": datetime.utcnow()}
 
 
+READINESS_TIMEOUT_SECONDS = float(os.environ.get("READINESS_TIMEOUT_SECONDS", 2))
+LIVENESS_MAX_LAG_SECONDS = float(os.environ.get("LIVENESS_MAX_LAG_SECONDS", 5))
+
+
+@api_router.get("/health/ready")
+async def readiness_check():
+    """Ready once Mongo answers and startup provisioning has finished."""
+    checks = dict(startup_checks)
+    try:
+        await asyncio.wait_for(db.command("ping"), READINESS_TIMEOUT_SECONDS)
+        checks["mongo"] = True
+    except Exception as e:
+        logger.warning("Readiness ping failed: %s", e)
+        checks["mongo"] = False
+    ready = all(checks.values())
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", "checks": checks},
+        status_code=200 if ready else 503
+    )
+
+
+@api_router.get("/health/live")
+async def liveness_check():
+    """Alive while the event loop keeps up; a blocked loop cannot answer at all.
+
+    Only the current lag counts, so one stall that has already passed does
+    not keep failing the probe; the recent worst is in /metrics.
+    """
+    lag = event_loop_lag_monitor.current_lag
+    alive = lag <= LIVENESS_MAX_LAG_SECONDS
+    return JSONResponse(
+        {"status": "alive" if alive else "stalled", "event_loop_lag_seconds": round(lag, 4)},
+        status_code=200 if alive else 503
+    )
+
+
 # Authentication API Routes
 @api_router.post("/auth/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
@@ -597,6 +2777,7 @@ async def register_user(user: UserCreate):
     )
     
     await db.users.insert_one(user_in_db.model_dump())
+    audit_log.record("create", "users", user_in_db.id, None, user_in_db.model_dump(), actor=user_in_db.username)
     
     # Return the user without the hashed password
     return User(**user_data, id=user_in_db.id, created_at=user_in_db.created_at, updated_at=user_in_db.updated_at)
@@ -614,6 +2795,7 @@ async def create_resource(resource: ResourceCreate):
     resource_obj = Resource(**resource_dict)
     resource_data = resource_obj.model_dump()
     result = await db.resources.insert_one(resource_data)
+    audit_log.record("create", "resources", resource_obj.id, None, resource_data)
     return resource_obj
 
 
@@ -633,36 +2815,76 @@ async def get_resources(
 
 
 @api_router.get("/resources/{resource_id}", response_model=Resource)
-async def get_resource(resource_id: str):
+async def get_resource(resource_id: str, response: Response):
     resource = await db.resources.find_one({"id": resource_id})
     if resource:
+        response.headers["ETag"] = etag(resource)
         return Resource(**resource)
     raise HTTPException(status_code=404, detail="Resource not found")
 
 
-@api_router.put("/resources/{resource_id}", response_model=Resource)
-async def update_resource(resource_id: str, resource_update: dict = Body(...)):
-    resource_update["updated_at"] = datetime.utcnow()
+@api_router.patch("/resources/{resource_id}", response_model=Resource)
+@api_router.put("/resources/{resource_id}", response_model=Resource, include_in_schema=False)
+async def update_resource(
+    resource_id: str,
+    resource_update: ResourceUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    expected_version = parse_if_match(if_match)
+    changes = resource_update.changes()
+    current = await db.resources.find_one({"id": resource_id}, {"_id": 0})
+    if not current:
+        raise HTTPException(status_code=404, detail="Resource not found")
+    if expected_version is not None and current.get("version", 1) != expected_version:
+        raise version_conflict(Resource, current)
     
-    result = await db.resources.update_one(
-        {"id": resource_id},
-        {"$set": resource_update}
-    )
+    set_fields, unset_fields = plan_update(changes, current)
+    if not set_fields and not unset_fields:
+        response.headers["ETag"] = etag(current)
+        return Resource(**current)
     
-    if result.modified_count:
+    set_fields["updated_at"] = datetime.utcnow()
+    
+    if set_fields.get("current_location") and "current_coordinates" not in set_fields:
+        coordinates = await geocode_location(set_fields["current_location"])
+        if coordinates:
+            set_fields["current_coordinates"] = coordinates.model_dump()
+    
+    update = {"$set": set_fields, "$inc": {"version": 1}}
+    if unset_fields:
+        update["$unset"] = unset_fields
+    
+    previous = await db.resources.find_one_and_update({"id": resource_id, **version_filter(expected_version)}, update)
+    
+    if previous:
         updated_resource = await db.resources.find_one({"id": resource_id})
+        audit_log.record("update", "resources", resource_id, previous, updated_resource)
+        response.headers["ETag"] = etag(updated_resource)
         return Resource(**updated_resource)
     
+    current = await db.resources.find_one({"id": resource_id})
+    if current:
+        raise version_conflict(Resource, current)
     raise HTTPException(status_code=404, detail="Resource not found")
 
 
 # Inventory API Routes
+def low_stock_fields(current_stock: Optional[int], minimum_stock: Optional[int]) -> dict:
+    """Derived low-stock fields; every stock write path must store these."""
+    current = current_stock or 0
+    minimum = minimum_stock or 0
+    return {"is_low_stock": current <= minimum, "stock_deficit": max(minimum - current, 0)}
+
+
 @api_router.post("/inventory", response_model=InventoryItem)
 async def create_inventory_item(item: InventoryItemCreate):
     item_dict = item.model_dump()
-    item_obj = InventoryItem(**item_dict)
+    item_obj = InventoryItem(**item_dict, **low_stock_fields(item.current_stock, item.minimum_stock))
     item_data = item_obj.model_dump()
+    item_data["search_terms"] = build_search_terms("inventory", item_data)
     result = await db.inventory.insert_one(item_data)
+    audit_log.record("create", "inventory", item_obj.id, None, item_data)
     return item_obj
 
 
@@ -677,68 +2899,1069 @@ async def get_inventory_items(
     
     # Add low stock filter if requested
     if low_stock:
-        filter_query["$expr"] = {
-            "$lte": ["$current_stock", {"$ifNull": ["$minimum_stock", 0]}]
-        }
+        filter_query["is_low_stock"] = True
     
     items = await db.inventory.find(filter_query).to_list(1000)
     return [InventoryItem(**item) for item in items]
 
 
+@api_router.get("/inventory/low-stock/summary", response_model=LowStockSummary)
+@report_timeout
+async def get_low_stock_summary(top: int = Query(5, ge=0, le=50), db=Depends(get_read_db)):
+    # Counts and top deficits are both answered from the
+    # (is_low_stock, category, stock_deficit) index
+    counts = await db.inventory.aggregate([
+        {"$match": {"is_low_stock": True}},
+        {"$group": {"_id": "$category", "count": {"$sum": 1}, "total_deficit": {"$sum": "$stock_deficit"}}}
+    ]).to_list(None)
+    counts = {item["_id"]: item for item in counts}
+
+    categories = [category for category in InventoryCategory if category.value in counts]
+    top_items = await asyncio.gather(*[
+        db.inventory.find(
+            {"is_low_stock": True, "category": category},
+            {"_id": 0, "id": 1, "name": 1, "unit": 1, "current_stock": 1, "minimum_stock": 1, "stock_deficit": 1}
+        ).sort("stock_deficit", -1).limit(top).to_list(top)
+        for category in categories
+    ]) if top else [[] for _ in categories]
+
+    summaries = [
+        LowStockCategorySummary(
+            category=category,
+            count=counts[category.value]["count"],
+            total_deficit=counts[category.value]["total_deficit"],
+            top_items=[LowStockItem(**item) for item in items]
+        )
+        for category, items in zip(categories, top_items)
+    ]
+    return LowStockSummary(total_count=sum(summary.count for summary in summaries), categories=summaries)
+
+
 @api_router.get("/inventory/{item_id}", response_model=InventoryItem)
-async def get_inventory_item(item_id: str):
+async def get_inventory_item(item_id: str, response: Response):
     item = await db.inventory.find_one({"id": item_id})
     if item:
+        response.headers["ETag"] = etag(item)
         return InventoryItem(**item)
     raise HTTPException(status_code=404, detail="Inventory item not found")
 
 
-@api_router.put("/inventory/{item_id}", response_model=InventoryItem)
-async def update_inventory_item(item_id: str, item_update: dict = Body(...)):
-    item_update["updated_at"] = datetime.utcnow()
+@api_router.patch("/inventory/{item_id}", response_model=InventoryItem)
+@api_router.put("/inventory/{item_id}", response_model=InventoryItem, include_in_schema=False)
+async def update_inventory_item(
+    item_id: str,
+    item_update: InventoryItemUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    expected_version = parse_if_match(if_match)
+    changes = item_update.changes()
+    movement_reason = changes.pop("movement_reason", None)
+    current = await db.inventory.find_one({"id": item_id}, {"_id": 0, "search_terms": 0, "stock_movement_history": 0})
+    if not current:
+        raise HTTPException(status_code=404, detail="Inventory item not found")
+    set_fields, unset_fields = plan_update(changes, current)
+    stale = expected_version is not None and current.get("version", 1) != expected_version
+    if stale or (not set_fields and not unset_fields):
+        # current leaves out the movement history, which the response needs
+        stored = await db.inventory.find_one({"id": item_id}, {"_id": 0, "search_terms": 0})
+        if not stored:
+            raise HTTPException(status_code=404, detail="Inventory item not found")
+        if stale:
+            raise version_conflict(InventoryItem, stored)
+        response.headers["ETag"] = etag(stored)
+        return InventoryItem(**stored)
+    
+    now = datetime.utcnow()
+    set_fields["updated_at"] = now
+    update = {"$set": set_fields, "$inc": {"version": 1}}
     
     # If stock is being updated, add to movement history
-    if "current_stock" in item_update:
-        current_item = await db.inventory.find_one({"id": item_id})
-        if current_item:
-            old_stock = current_item.get("current_stock", 0)
-            new_stock = item_update["current_stock"]
-            change = new_stock - old_stock
-            
-            movement = {
-                "date": datetime.utcnow(),
-                "previous_stock": old_stock,
-                "new_stock": new_stock,
-                "change": change,
-                "reason": item_update.get("movement_reason", "Manual update")
-            }
-            
-            await db.inventory.update_one(
-                {"id": item_id},
-                {"$push": {"stock_movement_history": movement}}
-            )
-            
-            # Update last_restock_date if stock increased
-            if change > 0:
-                item_update["last_restock_date"] = datetime.utcnow()
-            # Update last_use_date if stock decreased
-            elif change < 0:
-                item_update["last_use_date"] = datetime.utcnow()
+    if "current_stock" in set_fields:
+        old_stock = current.get("current_stock", 0)
+        new_stock = set_fields["current_stock"]
+        change = new_stock - old_stock
+        update["$push"] = {"stock_movement_history": {
+            "date": now,
+            "previous_stock": old_stock,
+            "new_stock": new_stock,
+            "change": change,
+            "reason": movement_reason or "Manual update"
+        }}
+        
+        # Update last_restock_date if stock increased
+        if change > 0:
+            set_fields["last_restock_date"] = now
+        # Update last_use_date if stock decreased
+        elif change < 0:
+            set_fields["last_use_date"] = now
     
-    result = await db.inventory.update_one(
-        {"id": item_id},
-        {"$set": item_update}
-    )
+    # Keep the indexed low-stock fields in sync with the stock levels
+    if "current_stock" in set_fields or "minimum_stock" in set_fields or "minimum_stock" in unset_fields:
+        set_fields.update(low_stock_fields(
+            set_fields.get("current_stock", current.get("current_stock")),
+            None if "minimum_stock" in unset_fields else set_fields.get("minimum_stock", current.get("minimum_stock"))
+        ))
     
-    if result.modified_count:
+    if any(field in set_fields or field in unset_fields for field in SEARCH_FIELDS["inventory"]):
+        set_fields["search_terms"] = build_search_terms(
+            "inventory", {**current, **set_fields, **dict.fromkeys(unset_fields)}
+        )
+    
+    if unset_fields:
+        update["$unset"] = unset_fields
+    
+    previous = await db.inventory.find_one_and_update({"id": item_id, **version_filter(expected_version)}, update)
+    
+    if previous:
         updated_item = await db.inventory.find_one({"id": item_id})
+        audit_log.record("update", "inventory", item_id, previous, updated_item)
+        response.headers["ETag"] = etag(updated_item)
         return InventoryItem(**updated_item)
     
+    # The stock movement was computed from a stock level that has since changed
+    current = await db.inventory.find_one({"id": item_id})
+    if current:
+        raise version_conflict(InventoryItem, current)
     raise HTTPException(status_code=404, detail="Inventory item not found")
 
 
+# Dispatch Optimizer
+DISPATCH_DEFAULT_HOURS = 1.0  # Used for work orders without estimated_hours
+
+
+def optimize_dispatch(jobs: List[dict], resources: List[dict], max_hours: float, time_budget: float) -> List[Optional[int]]:
+    """Assign jobs to resources, returning the resource index per job (or None).
+
+    Jobs are placed by descending priority on the cheapest resource that has
+    the required specialties and enough remaining hours. A local search then
+    fits leftover jobs by relocating a blocking job, and lowers the total cost
+    with relocate and swap moves until no move improves or the budget runs out.
+    """
+    deadline = time.perf_counter() + time_budget
+    rates = [resource["hourly_cost"] for resource in resources]
+    load = [resource["load"] for resource in resources]
+    hours = [job["hours"] for job in jobs]
+    candidates = [
+        [i for i, resource in enumerate(resources) if job["required"] <= resource["specialties"]]
+        for job in jobs
+    ]
+    assignment: List[Optional[int]] = [None] * len(jobs)
+    assigned_jobs = [set() for _ in resources]
+
+    def fits(j, i, freed=0.0):
+        return load[i] - freed + hours[j] <= max_hours + 1e-9
+
+    def move(j, i):
+        if assignment[j] is not None:
+            load[assignment[j]] -= hours[j]
+            assigned_jobs[assignment[j]].discard(j)
+        assignment[j] = i
+        load[i] += hours[j]
+        assigned_jobs[i].add(j)
+
+    order = sorted(range(len(jobs)), key=lambda j: (-jobs[j]["priority"], -hours[j]))
+
+    # Greedy construction
+    for j in order:
+        feasible = [i for i in candidates[j] if fits(j, i)]
+        if feasible:
+            move(j, min(feasible, key=lambda i: (rates[i], load[i])))
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+
+        # Fit unassigned jobs, relocating one job out of the way if needed
+        for j in order:
+            if assignment[j] is not None:
+                continue
+            if time.perf_counter() >= deadline:
+                break
+            for i in sorted(candidates[j], key=lambda i: rates[i]):
+                if fits(j, i):
+                    move(j, i)
+                    improved = True
+                    break
+                blocker = next(
+                    (
+                        (k, other)
+                        for k in assigned_jobs[i]
+                        if jobs[k]["priority"] <= jobs[j]["priority"] and fits(j, i, freed=hours[k])
+                        for other in candidates[k]
+                        if other != i and fits(k, other)
+                    ),
+                    None,
+                )
+                if blocker:
+                    move(blocker[0], blocker[1])
+                    move(j, i)
+                    improved = True
+                    break
+
+        # Relocate jobs to cheaper resources
+        for j in order:
+            if time.perf_counter() >= deadline:
+                break
+            current = assignment[j]
+            if current is None:
+                continue
+            cheaper = [i for i in candidates[j] if rates[i] < rates[current] and fits(j, i)]
+            if cheaper:
+                move(j, min(cheaper, key=lambda i: rates[i]))
+                improved = True
+
+        # Swap jobs between resources when it lowers the total cost
+        for j in order:
+            if time.perf_counter() >= deadline:
+                break
+            a = assignment[j]
+            if a is None:
+                continue
+            for k in order:
+                b = assignment[k]
+                if b is None or b == a or hours[j] == hours[k] or rates[a] == rates[b]:
+                    continue
+                if (hours[j] - hours[k]) * (rates[b] - rates[a]) >= 0:
+                    continue
+                if b in candidates[j] and a in candidates[k] and fits(j, b, freed=hours[k]) and fits(k, a, freed=hours[j]):
+                    move(j, b)
+                    move(k, a)
+                    improved = True
+                    break
+
+    return assignment
+
+
+def optimize_dispatch_by_day(jobs: List[dict], resources: List[dict], max_hours: float, time_budget: float) -> List[Optional[int]]:
+    """Run optimize_dispatch separately for each scheduled day.
+
+    ``max_hours`` is a daily cap, so each job's ``day`` is planned against the
+    hours its resources already have on that day (``resource["load"][day]``).
+    Unscheduled jobs (day None) are planned together as a day of their own.
+    The time budget is shared out by the number of jobs per day.
+    """
+    days: Dict[Optional[date], List[int]] = {}
+    for j, job in enumerate(jobs):
+        days.setdefault(job["day"], []).append(j)
+
+    assignment: List[Optional[int]] = [None] * len(jobs)
+    for day, indexes in days.items():
+        day_resources = [{**resource, "load": resource["load"].get(day, 0.0)} for resource in resources]
+        day_assignment = optimize_dispatch(
+            [jobs[j] for j in indexes], day_resources, max_hours, time_budget * len(indexes) / len(jobs)
+        )
+        for j, resource_index in zip(indexes, day_assignment):
+            assignment[j] = resource_index
+    return assignment
+
+
+def scheduled_day(work_order: dict) -> Optional[date]:
+    scheduled = work_order.get("scheduled_date")
+    return scheduled.date() if scheduled else None
+
+
+@api_router.post("/dispatch/optimize", response_model=DispatchProposal)
+async def create_dispatch_proposal(request: DispatchOptimizeRequest):
+    work_order_query = {"status": WorkOrderStatus.pending, "assigned_personnel.0": {"$exists": False}}
+    if request.work_order_ids is not None:
+        work_order_query["id"] = {"$in": request.work_order_ids}
+    work_orders = await db.work_orders.find(
+        work_order_query,
+        {"_id": 0, "id": 1, "priority": 1, "estimated_hours": 1, "required_specialties": 1, "scheduled_date": 1}
+    ).to_list(1000)
+
+    resource_query = {
+        "type": ResourceType.personnel,
+        "status": {"$in": [ResourceStatus.available, ResourceStatus.assigned]}
+    }
+    if request.resource_ids is not None:
+        resource_query["id"] = {"$in": request.resource_ids}
+    resources = await db.resources.find(
+        resource_query,
+        {"_id": 0, "id": 1, "hourly_cost": 1, "specialties": 1, "assigned_work_orders": 1}
+    ).to_list(1000)
+
+    # Hours already committed to open work orders count against each
+    # resource on the day those work orders are scheduled
+    committed_ids = [wo_id for resource in resources for wo_id in resource.get("assigned_work_orders") or []]
+    committed_hours = {}
+    if committed_ids:
+        committed = await db.work_orders.find(
+            {"id": {"$in": committed_ids}, "status": {"$in": [WorkOrderStatus.pending, WorkOrderStatus.in_progress]}},
+            {"_id": 0, "id": 1, "estimated_hours": 1, "scheduled_date": 1}
+        ).to_list(None)
+        committed_hours = {
+            wo["id"]: (scheduled_day(wo), wo.get("estimated_hours") or DISPATCH_DEFAULT_HOURS) for wo in committed
+        }
+
+    jobs = [
+        {
+            "priority": wo.get("priority") or 3,
+            "hours": wo.get("estimated_hours") or DISPATCH_DEFAULT_HOURS,
+            "required": set(wo.get("required_specialties") or []),
+            "day": scheduled_day(wo),
+        }
+        for wo in work_orders
+    ]
+    solver_resources = []
+    for resource in resources:
+        load: Dict[Optional[date], float] = {}
+        for wo_id in resource.get("assigned_work_orders") or []:
+            if wo_id in committed_hours:
+                day, hours = committed_hours[wo_id]
+                load[day] = load.get(day, 0.0) + hours
+        solver_resources.append({
+            "hourly_cost": resource.get("hourly_cost") or 0.0,
+            "specialties": set(resource.get("specialties") or []),
+            "load": load,
+        })
+
+    started = time.perf_counter()
+    assignment = await run_in_threadpool(
+        optimize_dispatch_by_day,
+        jobs,
+        solver_resources,
+        request.max_hours_per_resource,
+        request.time_budget_ms / 1000
+    )
+    solver_time_ms = (time.perf_counter() - started) * 1000
+
+    assignments = []
+    unassigned = []
+    for wo, job, resource_index in zip(work_orders, jobs, assignment):
+        if resource_index is None:
+            unassigned.append(wo["id"])
+            continue
+        assignments.append(DispatchAssignment(
+            work_order_id=wo["id"],
+            resource_id=resources[resource_index]["id"],
+            priority=job["priority"],
+            estimated_hours=job["hours"],
+            cost=job["hours"] * solver_resources[resource_index]["hourly_cost"]
+        ))
+
+    proposal = DispatchProposal(
+        assignments=assignments,
+        unassigned_work_order_ids=unassigned,
+        total_hours=sum(a.estimated_hours for a in assignments),
+        total_cost=sum(a.cost for a in assignments),
+        solver_time_ms=solver_time_ms
+    )
+    await db.dispatch_proposals.insert_one(proposal.model_dump())
+    return proposal
+
+
+@api_router.get("/dispatch/proposals/{proposal_id}", response_model=DispatchProposal)
+async def get_dispatch_proposal(proposal_id: str):
+    proposal = await db.dispatch_proposals.find_one({"id": proposal_id})
+    if proposal:
+        return DispatchProposal(**proposal)
+    raise HTTPException(status_code=404, detail="Dispatch proposal not found")
+
+
+@api_router.post("/dispatch/proposals/{proposal_id}/accept", response_model=DispatchAcceptResult)
+async def accept_dispatch_proposal(proposal_id: str, accept: DispatchAcceptRequest = Body(DispatchAcceptRequest())):
+    proposal = await db.dispatch_proposals.find_one({"id": proposal_id})
+    if not proposal:
+        raise HTTPException(status_code=404, detail="Dispatch proposal not found")
+    if proposal["status"] != DispatchProposalStatus.proposed:
+        raise HTTPException(status_code=400, detail="Dispatch proposal was already accepted")
+
+    assignments = [DispatchAssignment(**a) for a in proposal["assignments"]]
+    if accept.work_order_ids is not None:
+        wanted = set(accept.work_order_ids)
+        assignments = [a for a in assignments if a.work_order_id in wanted]
+
+    now = datetime.utcnow()
+    applied = []
+    if assignments:
+        # Only claim work orders nobody assigned since the proposal was made
+        await db.work_orders.bulk_write([
+            UpdateOne(
+                {"id": a.work_order_id, "status": WorkOrderStatus.pending, "assigned_personnel.0": {"$exists": False}},
+                {"$set": {"assigned_personnel": [a.resource_id], "updated_at": now}, "$inc": {"version": 1}}
+            )
+            for a in assignments
+        ], ordered=False)
+
+        claimed = await db.work_orders.find(
+            {"id": {"$in": [a.work_order_id for a in assignments]}},
+            {"_id": 0, "id": 1, "assigned_personnel": 1}
+        ).to_list(None)
+        claimed_by = {wo["id"]: wo.get("assigned_personnel") or [] for wo in claimed}
+        applied = [a for a in assignments if claimed_by.get(a.work_order_id) == [a.resource_id]]
+
+    for a in applied:
+        audit_log.record("update", "work_orders", a.work_order_id, {"assigned_personnel": []}, {"assigned_personnel": [a.resource_id]})
+
+    by_resource: Dict[str, List[str]] = {}
+    for a in applied:
+        by_resource.setdefault(a.resource_id, []).append(a.work_order_id)
+    if by_resource:
+        projection = {"_id": 0, "id": 1, "status": 1, "assigned_work_orders": 1}
+        resources_before = await db.resources.find({"id": {"$in": list(by_resource)}}, projection).to_list(None)
+        await db.resources.bulk_write([
+            UpdateOne(
+                {"id": resource_id},
+                {
+                    "$addToSet": {"assigned_work_orders": {"$each": wo_ids}},
+                    "$set": {"status": ResourceStatus.assigned, "updated_at": now},
+                    "$inc": {"version": 1}
+                }
+            )
+            for resource_id, wo_ids in by_resource.items()
+        ], ordered=False)
+        resources_after = {
+            resource["id"]: resource
+            for resource in await db.resources.find({"id": {"$in": list(by_resource)}}, projection).to_list(None)
+        }
+        for resource in resources_before:
+            audit_log.record("update", "resources", resource["id"], resource, resources_after.get(resource["id"]))
+
+    await db.dispatch_proposals.update_one(
+        {"id": proposal_id},
+        {"$set": {"status": DispatchProposalStatus.accepted, "updated_at": now}}
+    )
+
+    applied_ids = {a.work_order_id for a in applied}
+    return DispatchAcceptResult(
+        proposal_id=proposal_id,
+        applied_work_order_ids=[a.work_order_id for a in applied],
+        skipped_work_order_ids=[a.work_order_id for a in assignments if a.work_order_id not in applied_ids]
+    )
+
+
+# Routing
+EARTH_RADIUS_KM = 6371.0088
+ROUTE_MAX_2OPT_PASSES = 50
+
+
+def distance_matrix_km(points: np.ndarray) -> np.ndarray:
+    """Pairwise haversine distances for an (n, 2) array of [longitude, latitude]."""
+    lon, lat = np.radians(points).T
+    dlon = lon[:, None] - lon[None, :]
+    dlat = lat[:, None] - lat[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def order_route(dist: np.ndarray) -> np.ndarray:
+    """Order an open path starting at node 0 with nearest neighbour plus 2-opt."""
+    n = len(dist)
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[0] = False
+    path = [0]
+    for _ in range(n - 1):
+        nearest = int(np.where(unvisited, dist[path[-1]], np.inf).argmin())
+        path.append(nearest)
+        unvisited[nearest] = False
+    path = np.array(path)
+
+    # 2-opt: reverse path[i..j] when it shortens the route. The path is open,
+    # so reversing a tail only changes the edge entering it.
+    for _ in range(ROUTE_MAX_2OPT_PASSES):
+        improved = False
+        for i in range(1, n - 1):
+            js = np.arange(i + 1, n)
+            before, first, last = path[i - 1], path[i], path[js]
+            after = path[np.minimum(js + 1, n - 1)]
+            has_after = js + 1 < n
+            delta = (
+                dist[before, last] - dist[before, first]
+                + np.where(has_after, dist[first, after] - dist[last, after], 0)
+            )
+            best = int(delta.argmin())
+            if delta[best] < -1e-9:
+                j = js[best]
+                path[i:j + 1] = path[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return path
+
+
+@api_router.get("/resources/{resource_id}/route", response_model=RoutePlan)
+async def get_resource_route(resource_id: str, route_date: date = Query(..., alias="date")):
+    resource = await db.resources.find_one({"id": resource_id}, {"_id": 0, "id": 1, "current_coordinates": 1})
+    if not resource:
+        raise HTTPException(status_code=404, detail="Resource not found")
+
+    day_start = datetime.combine(route_date, datetime.min.time())
+    work_orders = await db.work_orders.find(
+        {
+            "assigned_personnel": resource_id,
+            "status": {"$in": [WorkOrderStatus.pending, WorkOrderStatus.in_progress]},
+            "scheduled_date": {"$gte": day_start, "$lt": day_start + timedelta(days=1)},
+        },
+        {"_id": 0, "id": 1, "title": 1, "location": 1, "coordinates": 1, "scheduled_date": 1}
+    ).sort("scheduled_date", 1).to_list(1000)
+
+    located = [wo for wo in work_orders if wo.get("coordinates")]
+    unlocated = [wo["id"] for wo in work_orders if not wo.get("coordinates")]
+    start = resource.get("current_coordinates")
+
+    # Node 0 is the technician's position, or the earliest scheduled job
+    points = [wo["coordinates"]["coordinates"] for wo in located]
+    if start:
+        points.insert(0, start["coordinates"])
+
+    stops = []
+    total_distance = 0.0
+    if points:
+        dist = distance_matrix_km(np.array(points, dtype=float))
+        path = order_route(dist)
+        offset = 1 if start else 0
+        previous = None
+        for node in path:
+            if node < offset:
+                previous = node
+                continue
+            wo = located[node - offset]
+            leg = float(dist[previous, node]) if previous is not None else 0.0
+            total_distance += leg
+            stops.append(RouteStop(
+                work_order_id=wo["id"],
+                title=wo["title"],
+                location=wo.get("location"),
+                coordinates=GeoPoint(**wo["coordinates"]),
+                distance_from_previous_km=round(leg, 3)
+            ))
+            previous = node
+
+    return RoutePlan(
+        resource_id=resource_id,
+        date=route_date,
+        start=GeoPoint(**start) if start else None,
+        stops=stops,
+        total_distance_km=round(total_distance, 3),
+        unlocated_work_order_ids=unlocated
+    )
+
+
+@api_router.get("/work-orders/{work_order_id}/nearest-resources", response_model=List[NearbyResource])
+async def get_nearest_resources(
+    work_order_id: str,
+    type: ResourceType = ResourceType.vehicle,
+    limit: int = Query(5, ge=1, le=50),
+    max_distance_km: Optional[float] = None
+):
+    work_order = await db.work_orders.find_one({"id": work_order_id}, {"_id": 0, "coordinates": 1})
+    if not work_order:
+        raise HTTPException(status_code=404, detail="Work order not found")
+    if not work_order.get("coordinates"):
+        raise HTTPException(status_code=400, detail="Work order has no coordinates")
+
+    geo_near = {
+        "near": work_order["coordinates"],
+        "key": "current_coordinates",
+        "distanceField": "distance_m",
+        "spherical": True,
+        "query": {"type": type, "status": ResourceStatus.available},
+    }
+    if max_distance_km is not None:
+        geo_near["maxDistance"] = max_distance_km * 1000
+
+    resources = await db.resources.aggregate([
+        {"$geoNear": geo_near},
+        {"$limit": limit},
+        {"$project": {"_id": 0}}
+    ]).to_list(limit)
+    return [
+        NearbyResource(**resource, distance_km=round(resource["distance_m"] / 1000, 3))
+        for resource in resources
+    ]
+
+
+# Search API
+SEARCH_DISPLAY = {
+    # collection: (title field, subtitle fields)
+    "clients": ("name", ["business_name", "rut"]),
+    "work_orders": ("title", ["status", "location"]),
+    "inventory": ("name", ["category"]),
+}
+
+
+SEARCH_PREFIX_CANDIDATES = 200  # Prefix matches ranked per collection and page
+
+
+async def search_collection(
+    database, collection_name: str, q: str, tokens: List[str], mode: str, fetch: int
+) -> List[SearchHit]:
+    """Best ``fetch`` hits of one collection, best first and in a stable order.
+
+    Text scores are divided by the collection's best score, so hits from
+    different collections can be merged by score.
+    """
+    title_field, subtitle_fields = SEARCH_DISPLAY[collection_name]
+    projection = {"_id": 1, "id": 1, title_field: 1, **{field: 1 for field in subtitle_fields}}
+    collection = database[collection_name]
+
+    if mode == "text":
+        docs = await collection.find(
+            {"$text": {"$search": q}},
+            {**projection, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"}), ("_id", ASCENDING)]).limit(fetch).to_list(fetch)
+        best = docs[0]["score"] if docs else 1.0
+        scored = [(doc["score"] / best, doc) for doc in docs]
+    else:
+        # Documents with every token as a whole term rank first, so they are
+        # fetched on their own; prefix-only matches fill the rest. Both are
+        # read in _id order, which keeps equal scores stable across pages.
+        # Anchored regexes on the normalized terms are answered from the index
+        exact = {"$and": [{"search_terms": token} for token in tokens]}
+        docs = await collection.find(exact, projection).sort("_id", ASCENDING).limit(fetch).to_list(fetch)
+        scored = [(float(len(tokens)), doc) for doc in docs]
+        if len(scored) < fetch:
+            prefix = {"$and": [
+                *({"search_terms": {"$regex": f"^{re.escape(token)}"}} for token in tokens),
+                {"$nor": [exact]}
+            ]}
+            candidates = max(fetch - len(scored), SEARCH_PREFIX_CANDIDATES)
+            docs = await collection.find(prefix, {**projection, "search_terms": 1}).sort(
+                "_id", ASCENDING
+            ).limit(candidates).to_list(candidates)
+            # Whole-term matches rank above prefix matches; the sort is
+            # stable, so equal scores keep their _id order
+            partial = []
+            for doc in docs:
+                terms = set(doc.get("search_terms") or [])
+                partial.append((sum(1.0 if token in terms else 0.5 for token in tokens), doc))
+            scored += sorted(partial, key=lambda pair: -pair[0])
+
+    return [
+        SearchHit(
+            type=collection_name,
+            id=doc["id"],
+            title=str(doc.get(title_field) or ""),
+            subtitle=" · ".join(str(doc[field]) for field in subtitle_fields if doc.get(field)) or None,
+            score=score
+        )
+        for score, doc in scored[:fetch]
+    ]
+
+
+@api_router.get("/search", response_model=SearchResults)
+@report_timeout
+async def search(
+    q: str = Query(..., min_length=1),
+    types: str = ",".join(SEARCH_FIELDS),
+    mode: Literal["auto", "text", "prefix"] = "auto",
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db=Depends(get_read_db)
+):
+    """Search clients, work orders and inventory.
+
+    ``prefix`` mode matches the start of normalized words (and RUT digits) and
+    suits autocomplete; ``text`` mode uses the text indexes and ranks by
+    relevance. ``auto`` uses prefix for single words and text otherwise.
+    """
+    collection_names = [name.strip() for name in types.split(",") if name.strip()]
+    unknown = [name for name in collection_names if name not in SEARCH_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown search types: {', '.join(unknown)}")
+
+    tokens = tokenize(q)
+    if mode == "auto":
+        mode = "prefix" if len(tokens) <= 1 else "text"
+    if not tokens:
+        return SearchResults(query=q, mode=mode, skip=skip, limit=limit, results=[])
+
+    # Each collection returns its best skip + limit hits; the page is cut from the merge
+    hit_lists = await asyncio.gather(*[
+        search_collection(db, name, q, tokens, mode, skip + limit) for name in collection_names
+    ])
+    # Stable sort, so ties stay in collection order and then in each collection's order
+    hits = sorted((hit for hits in hit_lists for hit in hits), key=lambda hit: -hit.score)
+    return SearchResults(query=q, mode=mode, skip=skip, limit=limit, results=hits[skip:skip + limit])
+
+
+# Offline sync: clients pull documents changed since their watermark and
+# push edits made offline, which are applied only if nobody changed the
+# document in the meantime
+SYNC_SETTLE_SECONDS = float(os.environ.get("SYNC_SETTLE_SECONDS", 2))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get("SYNC_TOMBSTONE_RETENTION_DAYS", 30))
+
+# collection -> (model, fields clients may change through sync)
+SYNC_COLLECTIONS = {
+    "clients": (Client, {"name", "business_name", "address", "email", "phone", "contact_person"}),
+    "work_orders": (WorkOrder, {
+        "title", "description", "status", "scheduled_date", "location", "priority",
+        "estimated_hours", "assigned_personnel", "materials_used"
+    }),
+    "invoices": (Invoice, set()),
+    "resources": (Resource, {"status", "current_location", "notes"}),
+    "inventory": (InventoryItem, {"description", "location"}),
+    "work_order_comments": (Comment, set()),
+}
+
+
+async def record_tombstones(collection_name: str, doc_ids: List[str]):
+    """Tell sync clients that these documents left the collection."""
+    if doc_ids:
+        now = datetime.utcnow()
+        await db.sync_tombstones.insert_many([
+            {"collection": collection_name, "id": doc_id, "deleted_at": now} for doc_id in doc_ids
+        ])
+
+
+@api_router.get("/sync", response_model=SyncPage)
+async def sync_pull(
+    cursor: Optional[str] = None,
+    collections: str = ",".join(SYNC_COLLECTIONS),
+    limit: int = Query(200, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user)
+):
+    """Documents changed since ``cursor`` and tombstones of removed ones.
+
+    Without a cursor every document is returned (a full sync). Each
+    collection contributes at most ``limit`` documents per page; keep calling
+    with the returned cursor while ``has_more`` is true.
+    """
+    names = [name.strip() for name in collections.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SYNC_COLLECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sync collections: {', '.join(unknown)}")
+
+    # Writes carry their own timestamps, so a change stamped just before now
+    # may still be in flight; stopping short of now keeps it from being skipped
+    until = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    positions = decode_cursor(cursor) if cursor else {}
+    if "_tombstones" not in positions:
+        # Tombstones only matter from the start of the first sync onwards
+        positions["_tombstones"] = (until, "")
+    elif positions["_tombstones"][0] < until - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS):
+        raise HTTPException(status_code=410, detail="Sync cursor expired; start a full sync")
+
+    async def pull(name: str):
+        docs = await db[name].find(
+            after_position("updated_at", positions.get(name), until), {"_id": 0, "search_terms": 0}
+        ).sort([("updated_at", ASCENDING), ("id", ASCENDING)]).limit(limit).to_list(limit)
+        return name, docs
+
+    tombstone_query = {
+        **after_position("deleted_at", positions["_tombstones"], until),
+        "collection": {"$in": names}
+    }
+    pulled, tombstones = await asyncio.gather(
+        asyncio.gather(*[pull(name) for name in names]),
+        db.sync_tombstones.find(tombstone_query, {"_id": 0}).sort(
+            [("deleted_at", ASCENDING), ("id", ASCENDING)]
+        ).limit(limit).to_list(limit)
+    )
+
+    changes = {}
+    for name, docs in pulled:
+        model = SYNC_COLLECTIONS[name][0]
+        changes[name] = [model(**doc).model_dump(mode="json") for doc in docs]
+        if docs:
+            positions[name] = (docs[-1]["updated_at"], docs[-1]["id"])
+    if tombstones:
+        positions["_tombstones"] = (tombstones[-1]["deleted_at"], tombstones[-1]["id"])
+
+    return SyncPage(
+        changes=changes,
+        tombstones=[SyncTombstone(**tombstone) for tombstone in tombstones],
+        cursor=encode_cursor(positions),
+        has_more=len(tombstones) == limit or any(len(docs) == limit for _, docs in pulled)
+    )
+
+
+async def apply_sync_change(change: SyncChange) -> SyncChangeResult:
+    result = SyncChangeResult(collection=change.collection, id=change.id, status="applied")
+    if change.collection not in SYNC_COLLECTIONS:
+        return result.model_copy(update={"status": "rejected", "detail": "Unknown collection"})
+    model, writable = SYNC_COLLECTIONS[change.collection]
+    not_writable = sorted(set(change.fields) - writable)
+    if not_writable:
+        return result.model_copy(update={
+            "status": "rejected", "detail": f"Fields not writable through sync: {', '.join(not_writable)}"
+        })
+
+    collection = db[change.collection]
+    current = await collection.find_one({"id": change.id}, {"_id": 0, "search_terms": 0})
+    if current is None:
+        return result.model_copy(update={"status": "not_found"})
+    try:
+        merged = model(**{**current, **change.fields})
+    except ValueError as e:
+        return result.model_copy(update={"status": "rejected", "detail": str(e)})
+
+    # Validated values, as the model would store them
+    update = {field: getattr(merged, field) for field in change.fields}
+    update = {
+        field: value.model_dump() if isinstance(value, BaseModel) else value for field, value in update.items()
+    }
+    if change.collection == "work_orders":
+        if update.get("location") and update["location"] != current.get("location"):
+            coordinates = await geocode_location(update["location"])
+            if coordinates:
+                update["coordinates"] = coordinates.model_dump()
+    if change.collection == "resources" and update.get("current_location"):
+        coordinates = await geocode_location(update["current_location"])
+        if coordinates:
+            update["current_coordinates"] = coordinates.model_dump()
+    if change.collection in SEARCH_FIELDS and any(field in update for field in SEARCH_FIELDS[change.collection]):
+        update["search_terms"] = build_search_terms(change.collection, {**current, **update})
+
+    # Stored datetimes have millisecond precision
+    base = change.base_updated_at.replace(tzinfo=None)
+    base = base.replace(microsecond=base.microsecond // 1000 * 1000)
+    newly_completed = (
+        change.collection == "work_orders"
+        and update.get("status") == WorkOrderStatus.completed
+        and current.get("status") != WorkOrderStatus.completed
+    )
+
+    async def write(session):
+        # Stamped after geocoding, right before the write, so pulls never read past it
+        now = datetime.utcnow()
+        update["updated_at"] = now
+        if newly_completed:
+            update["completed_date"] = now
+        applied = await collection.update_one(
+            {"id": change.id, "updated_at": base}, {"$set": update, "$inc": {"version": 1}}, session=session
+        )
+        if applied.matched_count and newly_completed:
+            await outbox.publish("work_order.completed", {"work_order_id": change.id}, session=session)
+        return applied
+
+    applied = await run_in_transaction(write)
+    if applied.matched_count and newly_completed:
+        outbox.notify()
+    if applied.matched_count and change.collection == "clients":
+        client_ref_cache.invalidate(change.id)
+        await version_stamps.bump("clients")
+
+    previous = current
+    current = await collection.find_one({"id": change.id}, {"_id": 0, "search_terms": 0})
+    if current is None:
+        return result.model_copy(update={"status": "not_found"})
+    if applied.matched_count:
+        audit_log.record("update", change.collection, change.id, previous, current)
+    return result.model_copy(update={
+        "status": "applied" if applied.matched_count else "conflict",
+        "document": model(**current).model_dump(mode="json")
+    })
+
+
+@api_router.post("/sync", response_model=List[SyncChangeResult])
+async def sync_push(upload: SyncUpload, current_user: dict = Depends(get_current_user)):
+    """Apply offline edits in order.
+
+    A change applies only when ``base_updated_at`` still matches the stored
+    document; otherwise it is reported as a conflict together with the
+    current server version, for the client to merge and resubmit.
+    """
+    return [await apply_sync_change(change) for change in upload.changes]
+
+
+# Hot/cold archival: closed work orders and settled invoices move to
+# *_archive collections once they have been untouched for a while, keeping
+# the collections every list, dashboard and sync query scans small
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 180))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get("ARCHIVE_INTERVAL_HOURS", 24))  # 0 disables the periodic run
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_CLAIM_SECONDS = 300  # A claimed batch is free to take again after this
+
+ARCHIVE_COLLECTIONS = {"work_orders": "work_orders_archive", "invoices": "invoices_archive"}
+
+
+def archivable_filter(collection_name: str, cutoff: datetime) -> dict:
+    if collection_name == "work_orders":
+        # Completed work is archived only once invoiced, so it cannot be billed from the archive
+        return {"updated_at": {"$lt": cutoff}, "$or": [
+            {"status": WorkOrderStatus.cancelled},
+            {"status": WorkOrderStatus.completed, "invoiced": True},
+        ]}
+    return {"updated_at": {"$lt": cutoff}, "status": {"$in": [InvoiceStatus.paid, InvoiceStatus.cancelled]}}
+
+
+def archive_stats_increments(collection_name: str, docs: List[dict]) -> Dict[str, float]:
+    increments: Dict[str, float] = {}
+    for doc in docs:
+        if collection_name == "work_orders":
+            key = f"work_orders_by_status.{WorkOrderStatus(doc['status']).value}"
+            increments[key] = increments.get(key, 0) + 1
+        else:
+            prefix = f"invoices_by_status.{InvoiceStatus(doc['status']).value}"
+            increments[f"{prefix}.count"] = increments.get(f"{prefix}.count", 0) + 1
+            increments[f"{prefix}.total_amount"] = increments.get(f"{prefix}.total_amount", 0) + doc.get("total_amount", 0)
+    return increments
+
+
+async def archive_collection(collection_name: str, cutoff: datetime) -> int:
+    """Copy archivable documents to the archive, then remove them from the hot collection.
+
+    Each batch is first claimed, like outbox events, so concurrent archivers
+    in other workers never count the same document twice. The copy, the
+    removal and the archive_stats increment then happen together, inside a
+    transaction when the deployment has them. Removal is conditional on the
+    copied ``updated_at``, so a document edited meanwhile stays hot (and its
+    copy is dropped). Claims left by a worker that died expire.
+    """
+    hot, cold = db[collection_name], db[ARCHIVE_COLLECTIONS[collection_name]]
+    moved_total = 0
+    while True:
+        now = datetime.utcnow()
+        claimable = {"$or": [
+            {"archive_claimed_until": {"$exists": False}}, {"archive_claimed_until": {"$lte": now}}
+        ]}
+        candidates = await hot.find(
+            {"$and": [archivable_filter(collection_name, cutoff), claimable]}, {"_id": 0, "id": 1, "updated_at": 1}
+        ).sort("updated_at", ASCENDING).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not candidates:
+            break
+
+        claim = str(uuid.uuid4())
+        await hot.update_many(
+            {"$and": [claimable, {"$or": [{"id": doc["id"], "updated_at": doc["updated_at"]} for doc in candidates]}]},
+            {"$set": {"archive_claim": claim, "archive_claimed_until": now + timedelta(seconds=ARCHIVE_CLAIM_SECONDS)}}
+        )
+        docs = await hot.find({"archive_claim": claim}, {"_id": 0, "archive_claim": 0, "archive_claimed_until": 0}).to_list(None)
+        if not docs:
+            break
+        unchanged = {"$or": [{"id": doc["id"], "updated_at": doc["updated_at"]} for doc in docs]}
+
+        async def move(session):
+            archived_at = datetime.utcnow()
+            await cold.bulk_write([
+                ReplaceOne({"id": doc["id"]}, {**doc, "archived_at": archived_at}, upsert=True) for doc in docs
+            ], ordered=False, session=session)
+            await hot.delete_many({"archive_claim": claim, **unchanged}, session=session)
+            changed = {
+                doc["id"] for doc in await hot.find({"archive_claim": claim}, {"_id": 0, "id": 1}, session=session).to_list(None)
+            }
+            if changed:
+                await cold.delete_many({"id": {"$in": list(changed)}}, session=session)
+                await hot.update_many(
+                    {"archive_claim": claim}, {"$unset": {"archive_claim": "", "archive_claimed_until": ""}}, session=session
+                )
+            moved = [doc for doc in docs if doc["id"] not in changed]
+            if moved:
+                await db.archive_stats.update_one(
+                    {"_id": "totals"}, {"$inc": archive_stats_increments(collection_name, moved)}, upsert=True,
+                    session=session
+                )
+            return moved
+
+        moved = await run_in_transaction(move)
+        if not moved:
+            break
+        await record_tombstones(collection_name, [doc["id"] for doc in moved])
+        for doc in moved:
+            audit_log.record("archive", collection_name, doc["id"], {"archived": False}, {"archived": True}, actor="archival")
+        moved_total += len(moved)
+        logger.info("Archived %d %s", len(moved), collection_name)
+    return moved_total
+
+
+async def archive_closed_records(older_than_days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, int]:
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    return {name: await archive_collection(name, cutoff) for name in ARCHIVE_COLLECTIONS}
+
+
+async def run_archival_periodically():
+    while True:
+        try:
+            await archive_closed_records()
+        except Exception:
+            logger.warning("Archival run failed", exc_info=True)
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+# Admin API Routes
+@api_router.get("/admin/slow-queries", response_model=List[SlowQueryShape])
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=500),
+    sort_by: Literal["total_ms", "max_ms", "count"] = "total_ms",
+    current_user: dict = Depends(require_admin)
+):
+    """Slow query shapes seen by the worker answering this request.
+
+    Each gunicorn worker keeps its own log, so with several workers this is
+    one worker's view, labelled with its process id. Resetting clears them all.
+    """
+    return [
+        SlowQueryShape(**entry, worker=os.getpid(), avg_ms=entry["total_ms"] / entry["count"])
+        for entry in slow_query_log.top(limit, sort_by)
+    ]
+
+
+@api_router.delete("/admin/slow-queries")
+async def reset_slow_queries(current_user: dict = Depends(require_admin)):
+    slow_query_log.reset()
+    await version_stamps.bump("slow_queries")
+    return {"status": "ok"}
+
+
+@api_router.get("/admin/audit-events")
+async def get_audit_events(
+    collection: Optional[str] = None,
+    document_id: Optional[str] = None,
+    actor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(require_admin)
+):
+    """Most recent audit events first."""
+    filter_query = {}
+    if collection:
+        filter_query["collection"] = collection
+    if document_id:
+        filter_query["document_id"] = document_id
+    if actor:
+        filter_query["actor"] = actor
+    events = await db.audit_events.find(filter_query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    return jsonable_encoder(events)
+
+
+@api_router.get("/admin/outbox")
+async def get_outbox_events(
+    status: Literal["pending", "processing", "done", "failed"] = "failed",
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(require_admin)
+):
+    """Outbox events in a given state, oldest first; failed events need attention."""
+    events = await db.outbox.find({"status": status}, {"_id": 0}).sort("created_at", ASCENDING).limit(limit).to_list(limit)
+    return jsonable_encoder(events)
+
+
+@api_router.post("/admin/archive")
+async def run_archival(
+    older_than_days: int = Query(ARCHIVE_AFTER_DAYS, ge=0),
+    current_user: dict = Depends(require_admin)
+):
+    """Archive now instead of waiting for the periodic run; returns the documents moved."""
+    return await archive_closed_records(older_than_days)
+
+
+@api_router.get("/admin/blocking-calls", response_model=List[BlockingCallStack])
+async def get_blocking_calls(
+    limit: int = Query(20, ge=1, le=500),
+    sort_by: Literal["total_ms", "max_ms", "count"] = "total_ms",
+    current_user: dict = Depends(require_admin)
+):
+    """Blocking call stacks seen by the worker answering this request.
+
+    Like the slow query log this is per worker and labelled with its process
+    id; resetting clears every worker's stacks.
+    """
+    return [
+        BlockingCallStack(**entry, worker=os.getpid(), avg_ms=entry["total_ms"] / entry["count"])
+        for entry in event_loop_lag_monitor.top(limit, sort_by)
+    ]
+
+
+@api_router.delete("/admin/blocking-calls")
+async def reset_blocking_calls(current_user: dict = Depends(require_admin)):
+    event_loop_lag_monitor.reset()
+    await version_stamps.bump("blocking_calls")
+    return {"status": "ok"}
+
+
 # Include the router in the main app
-app.include_router(api_router)
+app.include_router(api_router, dependencies=[Depends(enforce_rate_limit)])
 
 app.add_middleware(
     CORSMiddleware,
@@ -746,15 +3969,351 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+
+class RequestMetricsMiddleware:
+    """Record latency, Mongo usage and response size per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_stats(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                stats.response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            # The router stores the matched route in the scope; unmatched
+            # paths share one label to keep cardinality bounded
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            http_requests_total.inc(labels + (str(status_code),))
+            http_request_duration.observe(labels, elapsed)
+            http_response_bytes_total.inc(labels, stats.response_bytes)
+            http_request_mongo_commands.observe(labels, stats.mongo_commands)
+            http_request_mongo_seconds_total.inc(labels, stats.mongo_seconds)
+            http_request_mongo_documents_total.inc(labels, stats.mongo_documents)
+
+
+class ReadYourWritesMiddleware:
+    """Mark clients that just wrote so get_read_db keeps them on the primary."""
+
+    UNSAFE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in self.UNSAFE_METHODS or not READ_YOUR_WRITES_SECONDS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = (
+                    f"{READ_YOUR_WRITES_COOKIE}={time.time() + READ_YOUR_WRITES_SECONDS:.0f}; "
+                    f"Max-Age={READ_YOUR_WRITES_SECONDS}; Path=/api; HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+class AuditContextMiddleware:
+    """Expose the caller of a request to audit_log.record."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"authorization" and value[:7].lower() == b"bearer ":
+                token = value[7:].decode("latin-1")
+                break
+        client_address = scope.get("client")
+        context = AuditContext(token, client_address[0] if client_address else None, scope["method"], scope["path"])
+        reset_token = current_audit_context.set(context)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_audit_context.reset(reset_token)
+
+
+app.add_middleware(AuditContextMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Reads every worker's file when METRICS_DIR is set
+    return PlainTextResponse(await run_in_threadpool(render_metrics), media_type="text/plain; version=0.0.4")
+
+background_tasks = set()
+
+
+def _finish_background_task(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Background task %s failed", task.get_name(), exc_info=task.exception())
+
+
+def start_background_task(coro):
+    # Keep a reference so the task is not garbage collected while running
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_finish_background_task)
+    return task
+
+
+async def backfill_search_terms(batch_size: int = 500):
+    for collection_name, fields in SEARCH_FIELDS.items():
+        collection = db[collection_name]
+        while True:
+            docs = await collection.find(
+                {"search_terms": {"$exists": False}},
+                {"_id": 1, **{field: 1 for field in fields}}
+            ).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+            await collection.bulk_write([
+                UpdateOne({"_id": doc["_id"]}, {"$set": {"search_terms": build_search_terms(collection_name, doc)}})
+                for doc in docs
+            ], ordered=False)
+            logger.info("Backfilled search terms for %d %s", len(docs), collection_name)
+
+
+async def backfill_low_stock_fields():
+    # Same rule as low_stock_fields(), evaluated server-side
+    minimum = {"$ifNull": ["$minimum_stock", 0]}
+    current = {"$ifNull": ["$current_stock", 0]}
+    result = await db.inventory.update_many(
+        {"is_low_stock": {"$exists": False}},
+        [{"$set": {
+            "is_low_stock": {"$lte": [current, minimum]},
+            "stock_deficit": {"$max": [{"$subtract": [minimum, current]}, 0]}
+        }}]
+    )
+    if result.modified_count:
+        logger.info("Backfilled low-stock fields for %d inventory items", result.modified_count)
+
+
+VERSIONED_COLLECTIONS = ("clients", "work_orders", "invoices", "resources", "inventory", "work_order_comments")
+
+
+async def backfill_versions():
+    # Conditional updates match a missing version as 1 until this has run
+    for collection_name in VERSIONED_COLLECTIONS:
+        result = await db[collection_name].update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+        if result.modified_count:
+            logger.info("Backfilled version for %d %s", result.modified_count, collection_name)
+
+
+def embedded_comment(work_order_id: str, index: int, raw: Dict[str, Any], fallback_time: datetime) -> Comment:
+    """Convert a comment stored inside a work order, whatever keys the client used."""
+    return Comment(
+        # Derived ids keep a rerun of the migration from duplicating comments
+        id=str(raw.get("id") or uuid.uuid5(uuid.NAMESPACE_URL, f"work_orders/{work_order_id}/comments/{index}")),
+        work_order_id=work_order_id,
+        author_id=raw.get("author_id") or raw.get("user_id"),
+        author_name=raw.get("author_name") or raw.get("author") or raw.get("user"),
+        text=str(raw.get("text") or raw.get("comment") or raw.get("content") or ""),
+        created_at=raw.get("created_at") or raw.get("date") or fallback_time,
+        updated_at=raw.get("created_at") or raw.get("date") or fallback_time
+    )
+
+
+async def migrate_embedded_comments(batch_size: int = 100):
+    """Move comments embedded in work orders into work_order_comments."""
+    while True:
+        work_orders = await db.work_orders.find(
+            {"comments": {"$exists": True}}, {"_id": 1, "id": 1, "comments": 1, "updated_at": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not work_orders:
+            break
+        for work_order in work_orders:
+            comments = [
+                embedded_comment(work_order["id"], index, raw, work_order.get("updated_at") or datetime.utcnow())
+                for index, raw in enumerate(work_order.get("comments") or []) if isinstance(raw, dict)
+            ]
+            comments.sort(key=lambda comment: comment.created_at)
+            if comments:
+                await db.work_order_comments.bulk_write([
+                    UpdateOne({"id": comment.id}, {"$setOnInsert": comment.model_dump()}, upsert=True)
+                    for comment in comments
+                ], ordered=False)
+            await db.work_orders.update_one({"_id": work_order["_id"]}, {
+                "$unset": {"comments": ""},
+                "$set": {
+                    "comment_count": len(comments),
+                    "last_comment": comment_preview(comments[-1]).model_dump() if comments else None
+                }
+            })
+        logger.info("Moved embedded comments out of %d work orders", len(work_orders))
+
+
+async def warm_client_cache():
+    limit = min(CLIENT_CACHE_WARM_SIZE, client_ref_cache.max_size)
+    if not limit:
+        return
+    docs = await db.clients.find({}, CLIENT_SUMMARY_PROJECTION).sort("created_at", -1).limit(limit).to_list(limit)
+    for doc in docs:
+        client_ref_cache.put(ClientSummary(**doc))
+    logger.info("Warmed client cache with %d clients", len(docs))
+
+
+async def create_indexes():
+    await db.work_orders.create_index([("coordinates", GEOSPHERE)])
+    await db.resources.create_index([("current_coordinates", GEOSPHERE)])
+
+    # Search: one text index per collection plus the normalized prefix terms
+    await db.clients.create_index(
+        [("name", TEXT), ("business_name", TEXT), ("rut", TEXT), ("contact_person", TEXT)],
+        weights={"name": 10, "business_name": 10, "rut": 5, "contact_person": 2},
+        default_language="spanish",
+        name="text_search"
+    )
+    await db.work_orders.create_index(
+        [("title", TEXT), ("description", TEXT), ("location", TEXT)],
+        weights={"title": 10, "location": 3, "description": 1},
+        default_language="spanish",
+        name="text_search"
+    )
+    await db.inventory.create_index(
+        [("name", TEXT), ("description", TEXT)],
+        weights={"name": 10, "description": 1},
+        default_language="spanish",
+        name="text_search"
+    )
+    for collection_name in SEARCH_FIELDS:
+        await db[collection_name].create_index([("search_terms", ASCENDING)])
+
+    await db.inventory.create_index([("is_low_stock", ASCENDING), ("category", ASCENDING), ("stock_deficit", -1)])
+
+    await db["attachments.files"].create_index([("metadata.work_order_id", ASCENDING), ("uploadDate", ASCENDING)])
+
+    for collection_name in SYNC_COLLECTIONS:
+        await db[collection_name].create_index([("updated_at", ASCENDING), ("id", ASCENDING)])
+    await db.sync_tombstones.create_index([("deleted_at", ASCENDING), ("id", ASCENDING)])
+    await db.sync_tombstones.create_index(
+        "deleted_at", expireAfterSeconds=SYNC_TOMBSTONE_RETENTION_DAYS * 24 * 3600, name="deleted_at_ttl"
+    )
+
+    await db.outbox.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+    await db.outbox.create_index("claimed_by", sparse=True)
+    await db.outbox.create_index("processed_at", expireAfterSeconds=OUTBOX_RETENTION_DAYS * 24 * 3600)
+    if RATE_LIMIT_BACKEND == "mongo":
+        # A bucket idle this long has refilled anyway
+        await db.rate_limits.create_index("updated_at", expireAfterSeconds=3600)
+    if "audit_events" not in await db.list_collection_names():
+        try:
+            await db.create_collection("audit_events", capped=True, size=AUDIT_CAPPED_BYTES)
+        except CollectionInvalid:
+            pass  # Created by another worker
+    await db.audit_events.create_index([("collection", ASCENDING), ("document_id", ASCENDING), ("timestamp", -1)])
+    await db.audit_events.create_index([("timestamp", -1)])
+
+    await db.work_orders.create_index([("status", ASCENDING), ("updated_at", ASCENDING)])
+    await db.invoices.create_index([("status", ASCENDING), ("updated_at", ASCENDING)])
+    for collection_name, archive_name in ARCHIVE_COLLECTIONS.items():
+        await db[collection_name].create_index("archive_claim", sparse=True)
+        await db[archive_name].create_index("id", unique=True)
+        await db[archive_name].create_index([("client_id", ASCENDING), ("status", ASCENDING)])
+
+    # Invoice numbers continue from the invoices created before the counter existed
+    invoice_total = await db.invoices.count_documents({}) + await db.invoices_archive.count_documents({})
+    await db.counters.update_one({"_id": "invoice_number"}, {"$max": {"seq": invoice_total}}, upsert=True)
+
+    await db.work_order_comments.create_index(
+        [("work_order_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]
+    )
+
+
+async def create_idempotency_indexes():
+    # run_idempotent relies on the unique index and refuses keyed requests until it exists
+    await db.idempotency_keys.create_index([("key", ASCENDING), ("route", ASCENDING)], unique=True)
+    await db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+
+
+# Readiness requirements besides a Mongo ping, set by provision()
+startup_checks = {"idempotency_index": False, "indexes": False, "client_cache": False}
+CLIENT_CACHE_WARM_SIZE = int(os.environ.get("CLIENT_CACHE_WARM_SIZE", 1000))
+PROVISION_RETRY_SECONDS = 5
+
+
+async def provision():
+    """Create indexes and warm caches, retrying until Mongo is reachable."""
+    global transactions_supported
+    startup_checks.update(dict.fromkeys(startup_checks, False))
+    while not all(startup_checks.values()):
+        try:
+            if not startup_checks["idempotency_index"]:
+                await create_idempotency_indexes()
+                startup_checks["idempotency_index"] = True
+            if not startup_checks["indexes"]:
+                await create_indexes()
+                startup_checks["indexes"] = True
+            transactions_supported = await detect_transaction_support()
+            await warm_client_cache()
+            startup_checks["client_cache"] = True
+        except Exception:
+            logger.warning("Startup provisioning failed, retrying in %ss", PROVISION_RETRY_SECONDS, exc_info=True)
+            await asyncio.sleep(PROVISION_RETRY_SECONDS)
+
+    start_background_task(backfill_search_terms())
+    start_background_task(backfill_low_stock_fields())
+    start_background_task(backfill_versions())
+    start_background_task(migrate_embedded_comments())
+    start_background_task(outbox.run())
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        start_background_task(run_archival_periodically())
+
+
+@app.on_event("startup")
+async def start_background_work():
+    slow_query_log.loop = asyncio.get_running_loop()
+    # Provisioning runs in the background so liveness answers right away;
+    # /api/health/ready reports when it is done
+    start_background_task(provision())
+    start_background_task(version_stamps.run())
+    start_background_task(event_loop_lag_monitor.run())
+    start_background_task(audit_log.run())
+    if METRICS_DIR:
+        start_background_task(publish_metrics_periodically())
+
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in list(background_tasks):
+        task.cancel()
+    await audit_log.flush()
+    if METRICS_DIR:
+        # What this worker counted stays in the totals after it exits
+        write_metrics_snapshot()
+    if thumbnail_executor is not None:
+        thumbnail_executor.shutdown(wait=False, cancel_futures=True)
     client.close()
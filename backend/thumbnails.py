@@ -0,0 +1,31 @@
+"""Image thumbnails for attachments.
+
+Kept free of server imports so process-pool workers stay light. Pillow is
+optional; without it ``is_enabled()`` is false and no thumbnails are made.
+"""
+import io
+from typing import Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - depends on the deployment
+    Image = None
+
+THUMBNAIL_CONTENT_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff"}
+
+
+def is_enabled() -> bool:
+    return Image is not None
+
+
+def make_thumbnail(data: bytes, max_size: int) -> Tuple[bytes, str]:
+    """Return a JPEG (or PNG, for images with transparency) no larger than max_size on either side."""
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(output, format="PNG", optimize=True)
+            return output.getvalue(), "image/png"
+        image.convert("RGB").save(output, format="JPEG", quality=80, optimize=True)
+        return output.getvalue(), "image/jpeg"
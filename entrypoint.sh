@@ -4,25 +4,52 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
-echo "Starting FastAPI backend"
-# Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
-BACKEND_PID=$!
+echo "Starting FastAPI backend with ${WEB_CONCURRENCY:-1} worker(s)"
+# Every worker writes its metrics here so /metrics can add them up; start
+# from an empty directory so a previous run's counts are not carried over
+export METRICS_DIR="${METRICS_DIR:-/tmp/backend-metrics}"
+rm -rf "$METRICS_DIR"
+mkdir -p "$METRICS_DIR"
 
-echo "Waiting for backend to start..."
-sleep 30
+# Gunicorn supervises the Uvicorn workers: SIGHUP starts fresh workers and
+# lets the old ones finish in-flight requests within GRACEFUL_TIMEOUT seconds.
+# X-Forwarded-For is trusted only from nginx on FORWARDED_ALLOW_IPS
+gunicorn server:app \
+    --worker-class uvicorn.workers.UvicornWorker \
+    --workers "${WEB_CONCURRENCY:-1}" \
+    --bind 0.0.0.0:8001 \
+    --graceful-timeout "${GRACEFUL_TIMEOUT:-30}" \
+    --timeout "${WORKER_TIMEOUT:-60}" \
+    --keep-alive "${KEEP_ALIVE:-5}" \
+    --forwarded-allow-ips "${FORWARDED_ALLOW_IPS:-127.0.0.1}" \
+    --access-logfile - &
+BACKEND_PID=$!
 
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
-fi
+echo "Waiting for backend to become ready..."
+READY_TIMEOUT=${READY_TIMEOUT:-120}
+WAITED=0
+until wget -q -O /dev/null http://127.0.0.1:8001/api/health/ready 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$WAITED" -ge "$READY_TIMEOUT" ]; then
+        echo "Backend not ready after ${READY_TIMEOUT}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 1
+    WAITED=$((WAITED + 1))
+done
+echo "Backend ready after ${WAITED}s"
 
 # Start Nginx
 nginx -g 'daemon off;' &
 NGINX_PID=$!
 
-# Handle termination signals
+# Handle termination signals; SIGHUP reloads backend workers and nginx config
 trap 'kill $BACKEND_PID $NGINX_PID; exit 0' SIGTERM SIGINT
+trap 'echo "Reloading"; kill -HUP $BACKEND_PID $NGINX_PID' SIGHUP
 
 # Check if processes are still running
 while kill -0 $BACKEND_PID 2>/dev/null && kill -0 $NGINX_PID 2>/dev/null; do
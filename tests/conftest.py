@@ -0,0 +1,33 @@
+import os
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# server.py builds its Mongo client at import time; nothing connects until a query runs
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """An in-memory database in place of server.db."""
+    database = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+@pytest.fixture
+def api(db):
+    """An async HTTP client for server.app, signed in as an admin and not rate limited.
+
+    Startup provisioning does not run; tests set up what they rely on.
+    """
+    server.app.dependency_overrides[server.get_current_user] = lambda: {"username": "tester", "role": "admin"}
+    server.app.dependency_overrides[server.enforce_rate_limit] = lambda: None
+    yield httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://backend")
+    server.app.dependency_overrides.clear()
@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+
+OLD = datetime.utcnow() - timedelta(days=400)
+CUTOFF = datetime.utcnow() - timedelta(days=180)
+
+
+def invoice(status="paid", **fields):
+    items = [server.InvoiceItem(description="Servicio", quantity=1, unit_price=100)]
+    doc = server.Invoice(client_id="client-1", items=items, status=status, total_amount=122).model_dump()
+    return {**doc, "updated_at": OLD, **fields}
+
+
+def archive(db, docs):
+    async def run():
+        await db.invoices.insert_many(docs)
+        moved = await server.archive_collection("invoices", CUTOFF)
+        hot = await db.invoices.find({}, {"_id": 0}).to_list(None)
+        cold = await db.invoices_archive.find({}, {"_id": 0}).to_list(None)
+        return moved, hot, cold, await db.archive_stats.find_one({"_id": "totals"})
+    return asyncio.run(run())
+
+
+def test_closed_documents_move_with_their_stats(db):
+    paid, draft = invoice(), invoice(status="draft")
+    moved, hot, cold, stats = archive(db, [paid, dict(draft)])
+    assert moved == 1
+    assert [doc["id"] for doc in hot] == [draft["id"]]
+    assert [doc["id"] for doc in cold] == [paid["id"]]
+    assert "archive_claim" not in cold[0] and "archive_claimed_until" not in cold[0]
+    assert stats["invoices_by_status"]["paid"] == {"count": 1, "total_amount": 122}
+    tombstones = asyncio.run(db.sync_tombstones.find({}, {"_id": 0, "id": 1}).to_list(None))
+    assert tombstones == [{"id": paid["id"]}]
+
+
+def test_expired_claims_are_resumed_and_live_ones_left_alone(db):
+    now = datetime.utcnow()
+    abandoned = invoice(archive_claim="dead-worker", archive_claimed_until=now - timedelta(seconds=1))
+    in_progress = invoice(archive_claim="other-worker", archive_claimed_until=now + timedelta(minutes=5))
+    moved, hot, cold, _ = archive(db, [abandoned, dict(in_progress)])
+    assert moved == 1
+    assert [doc["id"] for doc in cold] == [abandoned["id"]]
+    assert [doc["id"] for doc in hot] == [in_progress["id"]]
+
+
+def test_document_edited_after_the_claim_stays_hot(db, monkeypatch):
+    edited, untouched = invoice(), invoice()
+    run_in_transaction = server.run_in_transaction
+
+    async def edit_first(operation):
+        await db.invoices.update_one({"id": edited["id"]}, {"$set": {"updated_at": datetime.utcnow()}})
+        return await run_in_transaction(operation)
+    monkeypatch.setattr(server, "run_in_transaction", edit_first)
+
+    moved, hot, cold, stats = archive(db, [dict(edited), untouched])
+    assert moved == 1
+    assert [doc["id"] for doc in cold] == [untouched["id"]]
+    assert [doc["id"] for doc in hot] == [edited["id"]]
+    assert "archive_claim" not in hot[0]
+    assert stats["invoices_by_status"]["paid"]["count"] == 1
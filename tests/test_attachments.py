@@ -0,0 +1,23 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def test_parse_range():
+    assert server.parse_range("bytes=0-99", 1000) == (0, 99)
+    assert server.parse_range("bytes=900-", 1000) == (900, 999)
+    assert server.parse_range("bytes=-100", 1000) == (900, 999)
+    assert server.parse_range("bytes=990-2000", 1000) == (990, 999)
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-1", "bytes=0-1,5-6", "bytes=a-b"])
+def test_parse_range_serves_whole_file(header):
+    assert server.parse_range(header, 1000) is None
+
+
+def test_parse_range_past_the_end():
+    with pytest.raises(HTTPException) as error:
+        server.parse_range("bytes=1000-", 1000)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1000"
@@ -0,0 +1,20 @@
+import asyncio
+
+
+def test_creating_a_client_keeps_every_client_cache(api, db):
+    async def run():
+        async with api:
+            created = await api.post(
+                "/api/clients", json={"name": "Luis", "business_name": "Luis SA", "rut": "2", "address": "x"}
+            )
+            work_order = await api.post(
+                "/api/work-orders", json={"title": "Bomba", "description": "d", "client_id": created.json()["id"]}
+            )
+        return created, work_order, await db.cache_versions.count_documents({})
+
+    created, work_order, stamps = asyncio.run(run())
+    assert created.status_code == 200
+    # A miss is never cached, so the new client is found straight away
+    assert work_order.status_code == 200
+    # No clients version bump, which would make every worker drop its cache
+    assert stamps == 0
@@ -0,0 +1,66 @@
+from datetime import date
+
+import numpy as np
+
+import server
+
+
+def job(hours, priority=3, required=(), day=None):
+    return {"hours": hours, "priority": priority, "required": set(required), "day": day}
+
+
+def resource(rate, specialties=(), load=0.0):
+    return {"hourly_cost": rate, "specialties": set(specialties), "load": load}
+
+
+def test_jobs_go_to_the_cheapest_qualified_resource():
+    jobs = [job(2, required={"electrical"}), job(2)]
+    resources = [resource(50, {"electrical"}), resource(20)]
+    assert server.optimize_dispatch(jobs, resources, 8, 0.1) == [0, 1]
+
+
+def test_daily_cap_leaves_lowest_priority_job_unassigned():
+    jobs = [job(5, priority=1), job(5, priority=5)]
+    resources = [resource(20, load=2)]
+    assert server.optimize_dispatch(jobs, resources, 8, 0.1) == [None, 0]
+
+
+def test_blocking_job_is_relocated_to_fit_another():
+    # The plumbing job only fits on resource 0, which the greedy pass fills
+    # first with the longer job of the same priority
+    jobs = [job(6, priority=4), job(4, priority=4, required={"plumbing"})]
+    resources = [resource(10, {"plumbing"}), resource(30)]
+    assert server.optimize_dispatch(jobs, resources, 8, 0.1) == [1, 0]
+
+
+def test_committed_hours_only_count_on_their_own_day():
+    monday, tuesday = date(2026, 10, 19), date(2026, 10, 20)
+    jobs = [job(6, day=monday), job(6, day=tuesday)]
+    resources = [resource(20, load={monday: 4.0})]
+    assert server.optimize_dispatch_by_day(jobs, resources, 8, 0.1) == [None, 0]
+
+
+def test_each_day_has_its_own_cap():
+    monday, tuesday = date(2026, 10, 19), date(2026, 10, 20)
+    jobs = [job(6, day=monday), job(6, day=tuesday), job(6, day=tuesday)]
+    resources = [resource(20, load={})]
+    assert server.optimize_dispatch_by_day(jobs, resources, 8, 0.1) in ([0, 0, None], [0, None, 0])
+
+
+def test_route_visits_points_on_a_line_in_order():
+    points = np.array([0.0, 3.0, 1.0, 4.0, 2.0])
+    dist = np.abs(points[:, None] - points[None, :])
+    assert server.order_route(dist).tolist() == [0, 2, 4, 1, 3]
+
+
+def test_two_opt_removes_a_crossing():
+    # Nearest neighbour goes 0 -> 1 -> 3 -> 2 here; 2-opt uncrosses it
+    coords = np.array([[0.0, 0.0], [1.0, 0.0], [2.0, 1.0], [1.6, 1.0], [3.0, 1.0]])
+    dist = np.linalg.norm(coords[:, None] - coords[None, :], axis=2)
+    path = server.order_route(dist)
+    length = sum(dist[a, b] for a, b in zip(path, path[1:]))
+    assert path[0] == 0 and sorted(path.tolist()) == list(range(5))
+    assert length <= min(
+        sum(dist[a, b] for a, b in zip(order, order[1:]))
+        for order in ([0, 1, 3, 2, 4], [0, 1, 2, 3, 4], [0, 3, 1, 2, 4])
+    ) + 1e-9
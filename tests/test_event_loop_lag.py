@@ -0,0 +1,18 @@
+import time
+
+import server
+
+
+def test_past_stall_does_not_count_as_current_lag():
+    monitor = server.EventLoopLagMonitor(0.5, 0, 10)
+    monitor._recent.extend([0.001, 6.0, 0.002])
+    monitor.last_lag = 0.002
+    monitor._heartbeat = time.monotonic()
+    assert monitor.max_recent_lag == 6.0
+    assert monitor.current_lag < 0.5
+
+
+def test_overdue_heartbeat_counts_as_current_lag():
+    monitor = server.EventLoopLagMonitor(0.5, 0, 10)
+    monitor._heartbeat = time.monotonic() - 10
+    assert monitor.current_lag > 9
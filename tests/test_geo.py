@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+import server
+
+
+@pytest.mark.parametrize("point", [
+    {"type": "Foo", "coordinates": [-56.16, -34.9]},
+    {"coordinates": [500, 500]},
+    {"coordinates": [-56.16, -91]},
+    {"coordinates": [181, 0]},
+])
+def test_invalid_geo_points_are_rejected(point):
+    with pytest.raises(ValidationError):
+        server.GeoPoint(**point)
+
+
+def test_geo_point_bounds_are_inclusive():
+    assert server.GeoPoint(coordinates=[-180, 90]).coordinates == [-180, 90]
+
+
+def test_patch_with_invalid_coordinates_is_a_422(api, db):
+    doc = server.WorkOrder(title="Bomba", description="Cambio de bomba", client_id="client-1").model_dump()
+
+    async def run():
+        await db.work_orders.insert_one(dict(doc))
+        async with api:
+            response = await api.patch(
+                f"/api/work-orders/{doc['id']}", json={"coordinates": {"type": "Foo", "coordinates": [500, 500]}}
+            )
+        return response, await db.work_orders.find_one({"id": doc["id"]})
+
+    response, stored = asyncio.run(run())
+    assert response.status_code == 422
+    assert stored["coordinates"] == doc["coordinates"]
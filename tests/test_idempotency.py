@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def keyed(api, db, monkeypatch):
+    """The api client with the idempotency index in place and one client to reference."""
+    async def setup():
+        await server.create_idempotency_indexes()
+        await db.clients.insert_one(server.Client(name="Ana", business_name="Ana SRL", rut="1", address="x").model_dump())
+        return (await db.clients.find_one({}))["id"]
+    client_id = asyncio.run(setup())
+    monkeypatch.setitem(server.startup_checks, "idempotency_index", True)
+    return api, client_id
+
+
+def post_twice(api, first, second, key="key-1"):
+    async def run():
+        async with api:
+            return [
+                await api.post("/api/work-orders", json=body, headers={"Idempotency-Key": key})
+                for body in (first, second)
+            ]
+    return asyncio.run(run())
+
+
+def test_replay_returns_the_stored_response(keyed, db):
+    api, client_id = keyed
+    body = {"title": "Bomba", "description": "Cambio de bomba", "client_id": client_id}
+    first, replay = post_twice(api, body, body)
+    assert first.status_code == replay.status_code == 200
+    assert replay.json() == first.json()
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert asyncio.run(db.work_orders.count_documents({})) == 1
+
+
+def test_same_key_with_a_different_body_is_a_422(keyed, db):
+    api, client_id = keyed
+    body = {"title": "Bomba", "description": "Cambio de bomba", "client_id": client_id}
+    first, mismatch = post_twice(api, body, {**body, "title": "Caldera"})
+    assert first.status_code == 200
+    assert mismatch.status_code == 422
+    assert asyncio.run(db.work_orders.count_documents({})) == 1
+
+
+def test_failed_request_can_be_retried_with_its_key(keyed, db):
+    api, client_id = keyed
+    body = {"title": "Bomba", "description": "Cambio de bomba", "client_id": client_id}
+    failed, retried = post_twice(api, {**body, "client_id": "missing"}, body)
+    assert failed.status_code == 404
+    # The body differs, but nothing was stored for the failed attempt
+    assert retried.status_code == 200
+
+
+def test_keyed_requests_wait_for_the_unique_index(api, monkeypatch):
+    monkeypatch.setitem(server.startup_checks, "idempotency_index", False)
+    body = {"title": "Bomba", "description": "Cambio de bomba", "client_id": "client-1"}
+    response, _ = post_twice(api, body, body)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
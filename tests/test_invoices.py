@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def billable(db):
+    """A client with two completed, uninvoiced work orders; returns their ids."""
+    client = server.Client(name="Ana", business_name="Ana SRL", rut="1", address="x").model_dump()
+    work_orders = [
+        server.WorkOrder(title=f"Trabajo {i}", description="d", client_id=client["id"], status="completed").model_dump()
+        for i in range(2)
+    ]
+
+    async def setup():
+        await db.clients.insert_one(client)
+        await db.work_orders.insert_many(work_orders)
+    asyncio.run(setup())
+    return client["id"], [wo["id"] for wo in work_orders]
+
+
+def post_invoice(api, client_id, work_order_ids):
+    body = {
+        "client_id": client_id,
+        "work_order_ids": work_order_ids,
+        "items": [{"description": "Servicio", "quantity": 1, "unit_price": 100}],
+    }
+
+    async def run():
+        async with api:
+            return await api.post("/api/invoices", json=body)
+    return asyncio.run(run())
+
+
+def stored_work_orders(db):
+    return asyncio.run(db.work_orders.find({}, {"_id": 0, "id": 1, "invoiced": 1, "invoice_id": 1}).to_list(None))
+
+
+def test_invoice_claims_its_work_orders(api, db, billable):
+    client_id, work_order_ids = billable
+    response = post_invoice(api, client_id, work_order_ids)
+    assert response.status_code == 200
+    invoice_id = response.json()["id"]
+    assert all(wo["invoiced"] and wo["invoice_id"] == invoice_id for wo in stored_work_orders(db))
+
+
+def test_work_order_billed_meanwhile_fails_the_whole_invoice(api, db, billable, monkeypatch):
+    client_id, work_order_ids = billable
+    run_in_transaction = server.run_in_transaction
+
+    async def claimed_first(operation):
+        # Another invoice takes the second work order after the checks passed
+        await db.work_orders.update_one({"id": work_order_ids[1]}, {"$set": {"invoiced": True, "invoice_id": "other"}})
+        return await run_in_transaction(operation)
+    monkeypatch.setattr(server, "run_in_transaction", claimed_first)
+
+    response = post_invoice(api, client_id, work_order_ids)
+    assert response.status_code == 400
+    assert asyncio.run(db.invoices.count_documents({})) == 0
+    by_id = {wo["id"]: wo for wo in stored_work_orders(db)}
+    assert not by_id[work_order_ids[0]]["invoiced"] and by_id[work_order_ids[0]]["invoice_id"] is None
+    assert by_id[work_order_ids[1]]["invoice_id"] == "other"
+
+
+def test_completing_a_work_order_releases_its_resources_through_the_outbox(api, db):
+    resource = server.Resource(name="Juan", type="personnel", status="assigned").model_dump()
+    work_order = server.WorkOrder(
+        title="Bomba", description="d", client_id="client-1", status="in_progress", assigned_personnel=[resource["id"]]
+    ).model_dump()
+    resource["assigned_work_orders"] = [work_order["id"]]
+
+    async def run():
+        await db.resources.insert_one(resource)
+        await db.work_orders.insert_one(work_order)
+        async with api:
+            response = await api.patch(f"/api/work-orders/{work_order['id']}", json={"status": "completed"})
+        events = await db.outbox.find({}, {"_id": 0, "type": 1, "status": 1}).to_list(None)
+        await server.outbox.dispatch_batch()
+        return (
+            response, events, await db.outbox.find_one({}, {"_id": 0, "status": 1}),
+            await db.resources.find_one({"id": resource["id"]}, {"_id": 0})
+        )
+
+    response, events, dispatched, released = asyncio.run(run())
+    assert response.status_code == 200
+    assert events == [{"type": "work_order.completed", "status": "pending"}]
+    assert dispatched["status"] == "done"
+    assert (released["assigned_work_orders"], released["status"]) == ([], "available")
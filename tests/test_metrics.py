@@ -0,0 +1,38 @@
+import json
+
+import server
+
+
+def test_metrics_add_up_across_workers(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "metrics_registry", [])
+    requests = server.Counter("test_requests_total", "Requests", ("route",))
+    latency = server.Histogram("test_latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    server.Gauge("test_pending", "Pending", lambda: 2)
+    requests.inc(("/api/a",), 3)
+    latency.observe(("/api/a",), 0.05)
+    # Another worker that has since exited: its counts stay, its gauge does not
+    other = {
+        "test_requests_total": [[["/api/a"], 4], [["/api/b"], 1]],
+        "test_latency_seconds": [[["/api/a"], [0, 1, 0.5, 1]]],
+        "test_pending": 9,
+    }
+    (tmp_path / "999999999.json").write_text(json.dumps(other))
+    monkeypatch.setattr(server, "process_alive", lambda pid: pid != 999999999)
+
+    lines = server.render_metrics().splitlines()
+
+    assert 'test_requests_total{route="/api/a"} 7' in lines
+    assert 'test_requests_total{route="/api/b"} 1' in lines
+    assert 'test_latency_seconds_bucket{route="/api/a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{route="/api/a",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_count{route="/api/a"} 2' in lines
+    assert [line for line in lines if line.startswith("test_pending")] == [f'test_pending{{worker="{server.os.getpid()}"}} 2']
+
+
+def test_metrics_without_shared_directory_report_this_process(monkeypatch):
+    monkeypatch.setattr(server, "METRICS_DIR", None)
+    monkeypatch.setattr(server, "metrics_registry", [])
+    requests = server.Counter("test_requests_total", "Requests")
+    requests.inc()
+    assert server.render_metrics().splitlines()[-1] == "test_requests_total 1"
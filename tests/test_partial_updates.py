@@ -0,0 +1,50 @@
+import asyncio
+
+import server
+
+
+def test_plan_update_skips_stored_values():
+    current = {"title": "Pump", "location": "Site A", "notes": "old"}
+    changes = {"title": "Pump", "location": "Site B", "notes": None, "priority": None}
+    assert server.plan_update(changes, current) == ({"location": "Site B"}, {"notes": ""})
+
+
+def patch_work_order(api, db, body):
+    """PATCH body onto a fresh work order; returns the response and the stored document."""
+    doc = server.WorkOrder(
+        title="Bomba", description="Cambio de bomba", client_id="client-1", location="Av. Italia 2000", priority=2
+    ).model_dump()
+
+    async def run():
+        await db.work_orders.insert_one(dict(doc))
+        async with api:
+            response = await api.patch(f"/api/work-orders/{doc['id']}", json=body)
+        return response, await db.work_orders.find_one({"id": doc["id"]}, {"_id": 0})
+
+    return asyncio.run(run())
+
+
+def test_null_clears_an_optional_field_and_leaves_the_rest(api, db):
+    response, stored = patch_work_order(api, db, {"location": None})
+    assert response.status_code == 200
+    assert "location" not in stored
+    assert (stored["title"], stored["priority"], stored["version"]) == ("Bomba", 2, 2)
+
+
+def test_required_fields_cannot_be_cleared(api, db):
+    response, stored = patch_work_order(api, db, {"title": None, "priority": 4})
+    assert response.status_code == 422
+    assert (stored["title"], stored["priority"], stored["version"]) == ("Bomba", 2, 1)
+
+
+def test_unknown_and_server_managed_fields_are_ignored(api, db):
+    response, stored = patch_work_order(api, db, {"comment_count": 99, "priority": 4})
+    assert response.status_code == 200
+    assert (stored["comment_count"], stored["priority"]) == (0, 4)
+
+
+def test_unchanged_values_do_not_write(api, db):
+    response, stored = patch_work_order(api, db, {"title": "Bomba", "priority": 2})
+    assert response.status_code == 200
+    assert stored["version"] == 1
+    assert response.headers["ETag"] == '"1"'
@@ -0,0 +1,55 @@
+import asyncio
+
+import httpx
+from fastapi import APIRouter, Depends, FastAPI
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+import server
+
+
+def make_app():
+    """The limiter as server.app wires it, behind uvicorn's proxy header handling."""
+    router = APIRouter(prefix="/api")
+
+    @router.get("/work-orders")
+    async def list_work_orders():
+        return []
+
+    app = FastAPI()
+    app.include_router(router, dependencies=[Depends(server.enforce_rate_limit)])
+    return ProxyHeadersMiddleware(app, trusted_hosts="127.0.0.1")
+
+
+def statuses(peer, calls):
+    """Status codes for calls made from peer; each call is a headers dict."""
+    async def run():
+        transport = httpx.ASGITransport(app=make_app(), client=(peer, 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://backend") as http:
+            return [(await http.get("/api/work-orders", headers=headers)).status_code for headers in calls]
+    return asyncio.run(run())
+
+
+def limit(monkeypatch, burst):
+    monkeypatch.setattr(server, "rate_limit_buckets", server.TokenBuckets(100))
+    monkeypatch.setitem(server.RATE_LIMIT_ROUTES, "GET /api/work-orders", {"rate": 0.01, "burst": burst})
+
+
+def test_anonymous_callers_behind_proxy_get_their_own_buckets(monkeypatch):
+    limit(monkeypatch, burst=2)
+    first = {"X-Forwarded-For": "203.0.113.7"}
+    second = {"X-Forwarded-For": "198.51.100.20"}
+    assert statuses("127.0.0.1", [first, first, first, second, second]) == [200, 200, 429, 200, 200]
+
+
+def test_forwarded_address_ignored_from_untrusted_peer(monkeypatch):
+    limit(monkeypatch, burst=2)
+    spoofed = [{"X-Forwarded-For": f"192.0.2.{n}"} for n in range(3)]
+    assert statuses("198.51.100.99", spoofed) == [200, 200, 429]
+
+
+def test_token_subject_keys_the_bucket(monkeypatch):
+    limit(monkeypatch, burst=1)
+    alice = {"Authorization": f"Bearer {server.create_access_token({'sub': 'alice'})}"}
+    bob = {"Authorization": f"Bearer {server.create_access_token({'sub': 'bob'})}"}
+    # Same address, different users
+    assert statuses("127.0.0.1", [alice, alice, bob]) == [200, 429, 200]
@@ -0,0 +1,6 @@
+import server
+
+
+def test_build_search_terms():
+    client = {"name": "José Muñoz", "business_name": None, "rut": "12.345.678-9", "contact_person": "Ana"}
+    assert server.build_search_terms("clients", client) == ["12", "123456789", "345", "678", "9", "ana", "jose", "munoz"]
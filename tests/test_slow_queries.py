@@ -0,0 +1,25 @@
+import asyncio
+import os
+
+import server
+
+
+def test_query_shape_hides_values():
+    query = {"status": "pending", "id": {"$in": ["a", "b"]}, "$or": [{"rut": "1"}, {"name": "x"}]}
+    assert server.query_shape(query) == {"status": "?", "id": {"$in": ["?"]}, "$or": [{"rut": "?"}, {"name": "?"}]}
+    assert server.query_shape({"id": {"$in": []}}) == {"id": {"$in": []}}
+
+
+def test_slow_queries_are_labelled_with_the_worker(api, monkeypatch):
+    log = server.SlowQueryLog(threshold_ms=1, explain=False, max_shapes=10)
+    log.record("test", "find", {"find": "work_orders", "filter": {"status": "pending"}}, 250.0)
+    monkeypatch.setattr(server, "slow_query_log", log)
+
+    async def run():
+        async with api:
+            return await api.get("/api/admin/slow-queries")
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    [shape] = response.json()
+    assert (shape["worker"], shape["collection"], shape["count"]) == (os.getpid(), "work_orders", 1)
@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+
+
+def work_order(**fields):
+    doc = server.WorkOrder(title="Bomba", description="Cambio de bomba", client_id="client-1", **fields).model_dump()
+    doc["updated_at"] = datetime.utcnow() - timedelta(minutes=5)
+    return doc
+
+
+def test_pull_during_slow_geocoding_still_delivers_the_change(api, db, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_SETTLE_SECONDS", 0)
+    geocoding = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_geocode(location):
+        geocoding.set()
+        await release.wait()
+        return server.GeoPoint(coordinates=[-56.16, -34.9])
+    monkeypatch.setattr(server, "geocode_location", slow_geocode)
+
+    async def run():
+        doc, other = work_order(), work_order()
+        await db.work_orders.insert_many([dict(doc), dict(other)])
+        async with api:
+            first = (await api.get("/api/sync", params={"collections": "work_orders"})).json()
+            patch = asyncio.create_task(
+                api.patch(f"/api/work-orders/{doc['id']}", json={"location": "Av. Italia 2000"})
+            )
+            await geocoding.wait()
+            # A quicker write lands meanwhile and moves the cursor forward
+            assert (await api.patch(f"/api/work-orders/{other['id']}", json={"priority": 5})).status_code == 200
+            during = (await api.get("/api/sync", params={"collections": "work_orders", "cursor": first["cursor"]})).json()
+            release.set()
+            assert (await patch).status_code == 200
+            after = (await api.get("/api/sync", params={"collections": "work_orders", "cursor": during["cursor"]})).json()
+        return other, during, after
+
+    other, during, after = asyncio.run(run())
+    assert [change["id"] for change in during["changes"]["work_orders"]] == [other["id"]]
+    assert [change["location"] for change in after["changes"]["work_orders"]] == ["Av. Italia 2000"]
@@ -0,0 +1,72 @@
+import asyncio
+
+import server
+
+
+def work_order(**fields):
+    return server.WorkOrder(title="Bomba", description="Cambio de bomba", client_id="client-1", **fields).model_dump()
+
+
+def invoice():
+    items = [server.InvoiceItem(description="Servicio", quantity=1, unit_price=100)]
+    return server.Invoice(client_id="client-1", items=items, total_amount=122).model_dump()
+
+
+def requests(api, db, collection, doc, calls):
+    """Store doc, make each (method, path, headers, json) call and return the responses and stored doc."""
+    async def run():
+        await db[collection].insert_one(dict(doc))
+        async with api:
+            responses = [
+                await api.request(method, path, headers=headers, json=body) for method, path, headers, body in calls
+            ]
+        return responses, await db[collection].find_one({"id": doc["id"]}, {"_id": 0})
+    return asyncio.run(run())
+
+
+def test_work_order_if_match_rejects_a_stale_version(api, db):
+    doc = work_order()
+    path = f"/api/work-orders/{doc['id']}"
+    (read, first, stale), stored = requests(api, db, "work_orders", doc, [
+        ("GET", path, {}, None),
+        ("PATCH", path, {"If-Match": '"1"'}, {"priority": 5}),
+        ("PATCH", path, {"If-Match": '"1"'}, {"title": "Caldera"}),
+    ])
+    assert read.headers["ETag"] == '"1"'
+    assert first.status_code == 200 and first.headers["ETag"] == '"2"'
+    assert stale.status_code == 409 and stale.headers["ETag"] == '"2"'
+    assert stale.json()["detail"]["current"]["priority"] == 5
+    assert (stored["title"], stored["version"]) == ("Bomba", 2)
+
+
+def test_documents_from_before_versions_match_version_1(api, db):
+    doc = work_order()
+    del doc["version"]
+    (response,), stored = requests(api, db, "work_orders", doc, [
+        ("PATCH", f"/api/work-orders/{doc['id']}", {"If-Match": '"1"'}, {"priority": 5}),
+    ])
+    assert response.status_code == 200
+    assert stored["priority"] == 5
+
+
+def test_malformed_if_match_is_a_400(api, db):
+    doc = work_order()
+    (response,), _ = requests(api, db, "work_orders", doc, [
+        ("PATCH", f"/api/work-orders/{doc['id']}", {"If-Match": "abc"}, {"priority": 5}),
+    ])
+    assert response.status_code == 400
+
+
+def test_invoice_status_if_match_rejects_a_stale_version(api, db):
+    doc = invoice()
+    path = f"/api/invoices/{doc['id']}/status"
+    (first, stale, unconditional), stored = requests(api, db, "invoices", doc, [
+        ("PUT", f"{path}?status=sent", {"If-Match": '"1"'}, None),
+        ("PUT", f"{path}?status=cancelled", {"If-Match": '"1"'}, None),
+        ("PUT", f"{path}?status=paid", {}, None),
+    ])
+    assert first.status_code == 200 and first.headers["ETag"] == '"2"'
+    assert stale.status_code == 409 and stale.headers["ETag"] == '"2"'
+    assert stale.json()["detail"]["current"]["status"] == "sent"
+    assert unconditional.status_code == 200
+    assert (stored["status"], stored["paid_amount"], stored["version"]) == ("paid", 122, 3)